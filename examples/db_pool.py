@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# program to use database (sqlite3) with AsyncDBPool, so that (blocking)
+# database operations don't block tasks; see
+# http://pycos.sourceforge.io/pycos.html for details.
+
+import os, tempfile, sqlite3, functools
+import pycos
+
+
+def setup(pool, task=None):
+    yield pool.execute('CREATE TABLE log (id INTEGER PRIMARY KEY, level INTEGER, msg TEXT)')
+    n = yield pool.executemany('INSERT INTO log VALUES (?, ?, ?)',
+                               [(i, i % 5, 'message %d' % i) for i in range(10000)])
+    print('inserted %d rows' % n)
+
+
+def reader(pool, level, task=None):
+    # stream rows in chunks with a connection checked out from pool
+    conn = yield pool.checkout()
+    try:
+        yield conn.execute('SELECT id FROM log WHERE level = ?', (level,))
+        count = total = 0
+        while True:
+            # while this task processes rows, next chunk is fetched in
+            # connection's thread
+            rows = yield conn.fetchmany(500)
+            if not rows:
+                break
+            count += len(rows)
+            total += sum(row[0] for row in rows)
+    finally:
+        pool.checkin(conn)
+    raise StopIteration((level, count, total))
+
+
+def checkout_timeout(pool, task=None):
+    # hold all connections, so another checkout times out
+    conns = []
+    for i in range(pool_size):
+        conns.append((yield pool.checkout()))
+    conn = yield pool.checkout(timeout=0.1)
+    print('checkout with all connections in use: %s' % conn)
+    for conn in conns:
+        pool.checkin(conn)
+
+
+def failed_update(pool, task=None):
+    # last row is duplicate, so insert fails and none of these rows are added
+    try:
+        yield pool.executemany('INSERT INTO log VALUES (?, ?, ?)',
+                               [(20000, 1, 'a'), (20001, 1, 'b'), (5, 1, 'dup')])
+    except sqlite3.IntegrityError as exc:
+        print('insert failed: %s' % exc)
+    # rows inserted before failure are rolled back, so they are not
+    # committed by next operation on that connection
+    yield pool.execute('UPDATE log SET msg = ? WHERE id = ?', ('updated', 0))
+    rows = yield pool.execute('SELECT COUNT(*) FROM log WHERE id >= 20000')
+    print('rows added by failed insert: %s' % rows[0][0])
+
+
+def client_proc(pool, task=None):
+    yield setup(pool, task=task)
+    readers = [pycos.Task(reader, pool, level) for level in range(5)]
+    for rtask in readers:
+        level, count, total = yield rtask.finish()
+        print('level %d: %d rows, sum of ids: %d' % (level, count, total))
+    yield checkout_timeout(pool, task=task)
+    yield failed_update(pool, task=task)
+    print('pool stats: %s' % pool.stats())
+
+
+if __name__ == '__main__':
+    pool_size = 3
+    db_file = os.path.join(tempfile.gettempdir(), 'pycos_db_pool.db')
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    # each connection is created in (and used only by) its own thread
+    pool = pycos.AsyncDBPool(functools.partial(sqlite3.connect, db_file, timeout=10),
+                             num_conns=pool_size)
+    pycos.Task(client_proc, pool).value()
+    pool.terminate()
+    os.remove(db_file)
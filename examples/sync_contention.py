@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# program to measure cost of task synchronization primitives when thousands of
+# tasks contend for them; see http://pycos.sourceforge.io/pycos.html for
+# details. Number of tasks can be given as argument (default 5000).
+
+import sys, time
+import pycos
+
+
+def lock_user(lock, n, task=None):
+    # every other task waits with timeout, so some of them give up
+    if (yield lock.acquire(timeout=(0.01 if n % 2 else -1))):
+        yield task.sleep(0)
+        lock.release()
+
+
+def sem_user(sem, task=None):
+    yield sem.acquire()
+    yield task.sleep(0)
+    sem.release()
+
+
+def cv_user(cv, waiting, task=None):
+    yield cv.acquire()
+    waiting[0] += 1
+    yield cv.wait()
+    cv.release()
+
+
+def producer(q, n, task=None):
+    for i in range(n):
+        yield q.put(i)
+
+
+def consumer(q, n, task=None):
+    for i in range(n):
+        yield q.get()
+
+
+def batch_consumer(q, n, task=None):
+    while n > 0:
+        items = yield q.get_batch(100)
+        n -= len(items)
+
+
+def bench(name, tasks, task=None):
+    start = time.time()
+    for t in tasks:
+        yield t.finish()
+    print('%s: %d tasks in %.3f sec' % (name, len(tasks), time.time() - start))
+
+
+def main(num_tasks, task=None):
+    lock = pycos.Lock()
+    yield bench('Lock', [pycos.Task(lock_user, lock, i) for i in range(num_tasks)], task=task)
+
+    sem = pycos.Semaphore(10)
+    yield bench('Semaphore', [pycos.Task(sem_user, sem) for i in range(num_tasks)], task=task)
+
+    cv = pycos.Condition()
+    waiting = [0]
+    tasks = [pycos.Task(cv_user, cv, waiting) for i in range(num_tasks)]
+    while waiting[0] < num_tasks:
+        yield task.sleep(0.01)
+    yield cv.acquire()
+    cv.notify_all()
+    cv.release()
+    yield bench('Condition', tasks, task=task)
+
+    q = pycos.Queue(100)
+    tasks = [pycos.Task(consumer, q, 10) for i in range(num_tasks // 10)]
+    tasks.extend(pycos.Task(producer, q, 10) for i in range(num_tasks // 10))
+    yield bench('Queue', tasks, task=task)
+
+    # one consumer gets items in batches
+    tasks = [pycos.Task(batch_consumer, q, 10 * (num_tasks // 10))]
+    tasks.extend(pycos.Task(producer, q, 10) for i in range(num_tasks // 10))
+    yield bench('Queue batch', tasks, task=task)
+
+
+if __name__ == '__main__':
+    pycos.logger.setLevel(pycos.Logger.WARNING)
+    num_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    pycos.Task(main, num_tasks)
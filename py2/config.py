@@ -13,6 +13,9 @@ NetPort = 9705
 
 MinPulseInterval = MsgTimeout
 MaxPulseInterval = 10 * MinPulseInterval
+# dispycos scheduler saves arguments of jobs that may be resubmitted to disk
+# if their (serialized) size exceeds this many bytes
+DispycosJobArgsSpillSize = 1024 * 1024
 # Settings below are evaluated so must be expressions
 DispycosSchedulerPort = 'pycos.config.NetPort'
 DispycosNodePort = 'pycos.config.DispycosSchedulerPort + 1'
@@ -25,9 +25,13 @@ def _dispycos_server_proc():
     import traceback
     import sys
     import time
+    try:
+        import resource
+    except ImportError:
+        resource = None
 
     from pycos.dispycos import MinPulseInterval, MaxPulseInterval, \
-        DispycosNodeInfo, DispycosNodeAvailInfo, Scheduler
+        DispycosNodeInfo, DispycosNodeAvailInfo, DispycosTaskResources, Scheduler
     from pycos import Task, SysTask, Location, MonitorStatus, deserialize, logger
     global _DispycosJob_
     from pycos.dispycos import _DispycosJob_
@@ -51,6 +55,9 @@ def _dispycos_server_proc():
     if _dispycos_config['max_pulse_interval'] > 0:
         MaxPulseInterval = _dispycos_config['max_pulse_interval']
     _dispycos_busy_time = _dispycos_config.pop('busy_time')
+    # time when status was last delivered to scheduler; node doesn't send its
+    # pulse if servers delivered status since its last pulse
+    _dispycos_sched_time = _dispycos_config.pop('sched_time')
     pycos.netpycos.MsgTimeout = pycos.MsgTimeout = _dispycos_config.pop('msg_timeout')
 
     if ((yield _dispycos_node_task.deliver({'req': 'server_task',  'auth': _dispycos_auth,
@@ -81,11 +88,42 @@ def _dispycos_server_proc():
                 _dispycos_task.location, _dispycos_config['pid'], _dispycos_config['dest_path'])
     _dispycos_req = _dispycos_reply_task = _dispycos_msg = None
     _dispycos_peer_status = _dispycos_monitor_task = _dispycos_monitor_proc = _dispycos_job = None
-    _dispycos_restart = False
+    _dispycos_restart = _dispycos_park = False
     _dispycos_job_tasks = set()
+    _dispycos_task_usage = {}
     _dispycos_jobs_done = pycos.Event()
     _dispycos_jobs_done.set()
 
+    def _dispycos_memory():
+        # memory (in bytes) shared with other processes (e.g., data set up by
+        # node_setup in spawn process) and private to (copied into) this server
+        for path in ('/proc/self/smaps_rollup', '/proc/self/smaps'):
+            shared = private = 0
+            try:
+                with open(path) as fd:
+                    for line in fd:
+                        if line.startswith('Shared_'):
+                            shared += int(line.split()[1])
+                        elif line.startswith('Private_'):
+                            private += int(line.split()[1])
+            except Exception:
+                continue
+            return (1024 * shared, 1024 * private)
+        return None
+
+    def _dispycos_usage():
+        # wall time, CPU time, peak resident memory and bytes of messages sent / received by
+        # this process; difference of these when a task starts and finishes is its usage
+        if resource:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform != 'darwin':
+                rss *= 1024
+        else:
+            rss = None
+        cpu = os.times()
+        return (time.time(), cpu[0] + cpu[1], rss,
+                _dispycos_scheduler._sent_bytes, _dispycos_scheduler._received_bytes)
+
     def _dispycos_timer_proc(task=None):
         task.set_daemon()
         pulse_interval = _dispycos_config['pulse_interval']
@@ -148,6 +186,13 @@ def _dispycos_server_proc():
                     _dispycos_var = ('task %s running at %s raised exception:\n%s' %
                                      (msg.info.name, task.location, msg.value))
                     msg = MonitorStatus(msg.info, msg.type, _dispycos_var)
+                _dispycos_var = _dispycos_task_usage.pop(msg.info, None)
+                if _dispycos_var:
+                    usage = _dispycos_usage()
+                    msg.resources = DispycosTaskResources(
+                        usage[0] - _dispycos_var[0], usage[1] - _dispycos_var[1],
+                        (usage[2] - _dispycos_var[2]) if usage[2] is not None else None,
+                        usage[3] - _dispycos_var[3], usage[4] - _dispycos_var[4])
                 if (yield _dispycos_scheduler_task.deliver(msg)) != 1:
                     try:
                         pycos.serialize(msg.value)
@@ -163,6 +208,8 @@ def _dispycos_server_proc():
                                              (msg.info.name, task.location,
                                               ''.join(_dispycos_var))))
                         _dispycos_scheduler_task.send(msg)
+                else:
+                    _dispycos_sched_time.value = int(time.time())
 
             else:
                 logger.warning('invalid message to monitor ignored: %s', type(msg))
@@ -181,9 +228,19 @@ def _dispycos_server_proc():
                                                'auth': _dispycos_auth})
         SysTask(node_peer)
 
+    def _dispycos_data_add(*keys):
+        _dispycos_scheduler_task.send({'status': 'data', 'location': _dispycos_task.location,
+                                       'auth': _dispycos_auth, 'add': keys})
+
+    def _dispycos_data_remove(*keys):
+        _dispycos_scheduler_task.send({'status': 'data', 'location': _dispycos_task.location,
+                                       'auth': _dispycos_auth, 'remove': keys})
+
     globals()['dispycos_close_server'] = _dispycos_close_server
     globals()['dispycos_close_node'] = _dispycos_close_node
-    del _dispycos_close_server, _dispycos_close_node
+    globals()['dispycos_data_add'] = _dispycos_data_add
+    globals()['dispycos_data_remove'] = _dispycos_data_remove
+    del _dispycos_close_server, _dispycos_close_node, _dispycos_data_add, _dispycos_data_remove
 
     _dispycos_task.register('_dispycos_server')
     _dispycos_var = deserialize(_dispycos_config['scheduler_location'])
@@ -191,8 +248,12 @@ def _dispycos_server_proc():
         logger.warning('%s could not communicate with scheduler', _dispycos_task.location)
         raise StopIteration(-1)
     _dispycos_peers.add(_dispycos_var)
-    _dispycos_scheduler_task = yield SysTask.locate('dispycos_status', location=_dispycos_var,
-                                                    timeout=5)
+    if _dispycos_config.get('scheduler_task', None):
+        # scheduler running more than one client has status task for each
+        _dispycos_scheduler_task = deserialize(_dispycos_config['scheduler_task'])
+    else:
+        _dispycos_scheduler_task = yield SysTask.locate('dispycos_status', location=_dispycos_var,
+                                                        timeout=5)
     if not isinstance(_dispycos_scheduler_task, SysTask):
         logger.warning('%s could not locate scheduler', _dispycos_task.location)
         raise StopIteration(-1)
@@ -203,7 +264,8 @@ def _dispycos_server_proc():
         raise StopIteration(-1)
     _dispycos_peers.add(_dispycos_var)
 
-    _dispycos_scheduler.peer_status(SysTask(_dispycos_peer_status))
+    _dispycos_peer_task = SysTask(_dispycos_peer_status)
+    _dispycos_scheduler.peer_status(_dispycos_peer_task)
     _dispycos_scheduler_task.send({'status': Scheduler.ServerDiscovered, 'task': _dispycos_task,
                                    'name': _dispycos_name, 'auth': _dispycos_auth,
                                    'pid': _dispycos_config['pid']})
@@ -222,7 +284,7 @@ def _dispycos_server_proc():
                 if _dispycos_req == 'enable_server':
                     _dispycos_var = _dispycos_msg.get('setup_args', ())
                     break
-                elif _dispycos_req == 'terminate' or _dispycos_req == 'quit':
+                elif _dispycos_req in ('terminate', 'quit', 'park'):
                     if _dispycos_msg.get('pid', None) != _dispycos_config['pid']:
                         # TODO: ignore this req?
                         logger.warning('Invalid pid for %s: %s / %s', _dispycos_req,
@@ -268,7 +330,7 @@ def _dispycos_server_proc():
                                    'name': _dispycos_name, 'auth': _dispycos_auth,
                                    'pid': _dispycos_config['pid']})
 
-    SysTask(_dispycos_timer_proc)
+    _dispycos_timer_task = SysTask(_dispycos_timer_proc)
     _dispycos_monitor_task = SysTask(_dispycos_monitor_proc)
     logger.debug('serving scheduler at %s', _dispycos_scheduler_task.location)
 
@@ -322,6 +384,7 @@ def _dispycos_server_proc():
                         ''.join(_dispycos_req))
                 else:
                     _dispycos_job_tasks.add(_dispycos_var)
+                    _dispycos_task_usage[_dispycos_var] = _dispycos_usage()
                     _dispycos_jobs_done.clear()
                     logger.debug('task %s created at %s', _dispycos_var, _dispycos_task.location)
                     _dispycos_var.notify(_dispycos_monitor_task)
@@ -329,7 +392,7 @@ def _dispycos_server_proc():
                 _dispycos_reply_task.send(_dispycos_var)
                 Task._pycos._lock.release()
 
-        elif _dispycos_req == 'close' or _dispycos_req == 'quit':
+        elif _dispycos_req == 'close' or _dispycos_req == 'quit' or _dispycos_req == 'park':
             if (_dispycos_msg.get('auth', None) != _dispycos_auth or
                 _dispycos_msg.get('pid', None) != _dispycos_config['pid']):
                 pycos.logger.debug('Invalid pid for %s: %s / %s', _dispycos_req,
@@ -356,6 +419,10 @@ def _dispycos_server_proc():
                     break
             if _dispycos_msg.get('restart', False):
                 _dispycos_restart = True
+            # if scheduler is gone ('close'), node may still reuse this server
+            _dispycos_park = (_dispycos_req == 'park' or
+                              (_dispycos_req == 'close' and
+                               _dispycos_config.get('reuse_servers', False)))
             break
 
         elif _dispycos_req == 'terminate':
@@ -377,10 +444,23 @@ def _dispycos_server_proc():
             print('  dispycos server "%s" @ %s with PID %s running %d tasks for %s' %
                   (_dispycos_name, _dispycos_task.location, _dispycos_config['pid'],
                    len(_dispycos_job_tasks), _dispycos_scheduler_task.location))
+            _dispycos_var = _dispycos_memory()
+            if _dispycos_var:
+                print('    memory shared: %.1f MB, private (copied): %.1f MB' %
+                      (_dispycos_var[0] / 1048576.0, _dispycos_var[1] / 1048576.0))
 
         elif _dispycos_req == 'peers':
             if _dispycos_msg.get('auth', None) != _dispycos_auth:
                 continue
+            _dispycos_reply_task = _dispycos_msg.get('reply_task', None)
+            if isinstance(_dispycos_reply_task, Task):
+                # caller waits until peers are connected (e.g., gang jobs)
+                def dispycos_peers(peers, reply_task, task=None):
+                    for location in peers:
+                        yield _dispycos_scheduler.peer(location)
+                    reply_task.send(_dispycos_task.location)
+                SysTask(dispycos_peers, _dispycos_msg.get('peers', []), _dispycos_reply_task)
+                continue
             for _dispycos_var in _dispycos_msg.get('peers', []):
                 pycos.Task(_dispycos_scheduler.peer, _dispycos_var)
 
@@ -412,12 +492,20 @@ def _dispycos_server_proc():
     for _dispycos_var in _dispycos_job_tasks:
         _dispycos_var.terminate()
     _dispycos_job_tasks.clear()
+    _dispycos_task_usage.clear()
     _dispycos_msg = {'status': Scheduler.ServerDisconnected, 'location': _dispycos_task.location,
                      'auth': _dispycos_auth, 'pid': _dispycos_config['pid']}
     _dispycos_scheduler_task.send(_dispycos_msg)
 
     logger.debug('dispycos server %s @ %s done', _dispycos_config['sid'], _dispycos_task.location)
-    raise StopIteration({'status': 0, 'restart': _dispycos_restart})
+    if _dispycos_park:
+        # process is kept to serve next client with same computation
+        _dispycos_timer_task.terminate()
+        _dispycos_monitor_task.terminate()
+        _dispycos_scheduler.peer_status(None)
+        _dispycos_peer_task.terminate()
+        _dispycos_task.unregister()
+    raise StopIteration({'status': 0, 'restart': _dispycos_restart, 'park': _dispycos_park})
 
 
 def _dispycos_server_process(_dispycos_mp_queue, _dispycos_config):
@@ -504,9 +592,13 @@ def _dispycos_server_process(_dispycos_mp_queue, _dispycos_config):
         exit(0)
 
     _dispycos_node_task = _dispycos_config['node_task']
-    _dispycos_task = pycos.SysTask(_dispycos_config.pop('server_proc'))
+    server_proc = _dispycos_config.pop('server_proc')
+    _dispycos_task = pycos.SysTask(server_proc)
     _dispycos_path = _dispycos_config['dest_path'] = config['dest_path']
     _dispycos_config['pid'] = _dispycos_pid
+    # server_proc consumes its configuration; keep a copy in case this process
+    # is reused by another client
+    server_config = dict(_dispycos_config)
     _dispycos_task.send(_dispycos_config)
     _dispycos_queue.put({'req': 'server_task', 'auth': _dispycos_auth, 'task': _dispycos_task,
                          'pid': _dispycos_pid, 'server_id': _dispycos_sid})
@@ -526,13 +618,55 @@ def _dispycos_server_process(_dispycos_mp_queue, _dispycos_config):
     _dispycos_config = None
     del config, _dispycos_var, sighandler
 
-    _dispycos_status = _dispycos_task.value()
+    def park(task=None):
+        # close connections to client and wait for node to pass next client
+        # (or to quit)
+        for location in _dispycos_scheduler.peers():
+            if location != _dispycos_node_task.location:
+                yield _dispycos_scheduler.close_peer(location)
+        for name in os.listdir(_dispycos_path):
+            name = os.path.join(_dispycos_path, name)
+            if os.path.isdir(name):
+                shutil.rmtree(name, ignore_errors=True)
+            else:
+                try:
+                    os.remove(name)
+                except Exception:
+                    pass
+        msg = {'req': 'server_parked', 'auth': _dispycos_auth, 'task': task, 'pid': _dispycos_pid,
+               'server_id': _dispycos_sid}
+        if (yield _dispycos_node_task.deliver(msg, timeout=5)) != 1:
+            raise StopIteration(None)
+        while 1:
+            msg = yield task.receive()
+            if not isinstance(msg, dict) or msg.get('auth', None) != _dispycos_auth:
+                continue
+            if msg.get('req', None) == 'rebind' and isinstance(msg.get('config', None), dict):
+                raise StopIteration(msg['config'])
+            if msg.get('req', None) in ('quit', 'terminate'):
+                raise StopIteration(None)
+
+    while 1:
+        _dispycos_status = _dispycos_task.value()
+        if not isinstance(_dispycos_status, dict):
+            _dispycos_status = {'status': _dispycos_status, 'restart': False}
+        if not _dispycos_status.get('park', False):
+            break
+        _dispycos_task = pycos.SysTask(park)
+        _dispycos_var = _dispycos_task.value()
+        if not _dispycos_var:
+            break
+        _dispycos_auth = _dispycos_var['auth']
+        _dispycos_var = dict(server_config, **_dispycos_var)
+        _dispycos_task = pycos.SysTask(server_proc)
+        _dispycos_task.send(_dispycos_var)
     _dispycos_task = None
-    if not isinstance(_dispycos_status, dict):
-        _dispycos_status = {'status': _dispycos_status, 'restart': False}
 
     def epilogue(task=None):
         _dispycos_scheduler.peer_status(None)
+        if _dispycos_status.get('park', False):
+            # node may have moved on to another client
+            raise StopIteration
         yield _dispycos_scheduler.peer(_dispycos_node_task.location)
         msg = {'req': 'server_task', 'auth': _dispycos_auth, 'task': None, 'pid': _dispycos_pid,
                'server_id': _dispycos_sid, 'restart': _dispycos_status.get('restart', False)}
@@ -590,8 +724,11 @@ def _dispycos_spawn(_dispycos_node_q, _dispycos_spawn_q, _dispycos_config, _disp
         pycos.logger.setLevel(pycos.logger.INFO)
     pycos_scheduler = pycos.Pycos.instance()
 
-    servers = [pycos.Struct(sid=sid, port=port, busy_time=busy_time, proc=None, status=None, pid=0)
-               for sid, port, busy_time in _dispycos_server_params]
+    servers = [pycos.Struct(sid=sid, port=port, busy_time=busy_time, sched_time=sched_time,
+                            proc=None, status=None, pid=0)
+               for sid, port, busy_time, sched_time in _dispycos_server_params]
+    # servers are forked from this process (template) so they share
+    # (copy-on-write) code and data set up by node_setup
     mp_q = multiprocessing.Queue()
     lock = threading.Lock()
     spawn_closed = False
@@ -760,6 +897,7 @@ def _dispycos_spawn(_dispycos_node_q, _dispycos_spawn_q, _dispycos_config, _disp
         server_config['name'] = '%s_server-%s' % (_dispycos_config['name'], server_config['sid'])
         server_config['tcp_port'] = server.port
         server_config['busy_time'] = server.busy_time
+        server_config['sched_time'] = server.sched_time
         server_config['peers'] = _dispycos_config['peers'][:]
         server_config['dest_path'] = os.path.join(_dispycos_config['dest_path'],
                                                   'dispycos_server_%s' % server_config['sid'])
@@ -841,6 +979,10 @@ def _dispycos_spawn(_dispycos_node_q, _dispycos_spawn_q, _dispycos_config, _disp
                 if close:
                     close_servers([server])
 
+            elif req.get('msg') == 'rebind':
+                # servers are reused for another client
+                _dispycos_config.update(req.get('config', {}))
+
             elif req.get('msg') == 'quit':
                 mp_q.put({'req': 'quit', 'auth': _dispycos_config['auth']})
                 # break
@@ -1175,13 +1317,15 @@ def _dispycos_node():
         node_servers[_dispycos_id] = pycos.Struct(
             id=_dispycos_id, pid=0, task=None, name='%s_server-%s' % (node_name, _dispycos_id),
             port=node_ports[_dispycos_id], restart=False, pid_file=_dispycos_var, done=pycos.Event(),
-            busy_time=multiprocessing.RawValue('L', 0)
+            busy_time=multiprocessing.RawValue('L', 0), sched_time=multiprocessing.RawValue('L', 0),
+            parked=None
         )
     node_servers[0].name = None
 
     client_info = pycos.Struct(auth=None, scheduler=None, client_location=None, cpus_reserved=0,
                          spawn_mpproc=None, interval=_dispycos_config['max_pulse_interval'],
-                         zombie_period=0, restart_servers=False, served=0, node_q=None, spawn_q=None)
+                         zombie_period=0, restart_servers=False, served=0, node_q=None, spawn_q=None,
+                         jobs={}, spawn_auth=None, reuse_key=None, files=None)
 
     if _dispycos_config['clean']:
         if os.path.isfile(node_servers[0].pid_file):
@@ -1255,12 +1399,81 @@ def _dispycos_node():
         msg_timeout = _dispycos_config['msg_timeout']
         disk_path = dispycos_scheduler.dest_path
         _dispycos_config['node_location'] = pycos.serialize(task.location)
+        # waiting on multiprocessing queues / processes (for spawn process) is
+        # done in a thread so node's tasks are not blocked
+        mp_pool = pycos.AsyncThreadPool(1)
+        sample_interval = _dispycos_config.pop('sample_interval')
+        node_avail = pycos.Struct(info=None, sent=None, pulses=0)
+        node_location = task.location
+
+        def sample_resources(servers=None):
+            return DispycosNodeAvailInfo(node_location, 100.0 - psutil.cpu_percent(),
+                                         psutil.virtual_memory().available,
+                                         psutil.disk_usage(disk_path).free,
+                                         100.0 - psutil.swap_memory().percent, servers=servers)
+
+        def resource_sampler():
+            # node's resources and CPU / memory used by each server are sampled
+            # in a thread, as psutil calls may take a while (e.g., disk usage
+            # of network file system)
+            procs = {}
+            while 1:
+                servers = {}
+                for server in node_servers:
+                    server_task, pid = server.task, server.pid
+                    if not server.id or not server_task or not pid:
+                        continue
+                    proc = procs.get(pid, None)
+                    try:
+                        if not proc:
+                            proc = procs[pid] = psutil.Process(pid)
+                        with proc.oneshot():
+                            servers[server_task.location] = (proc.cpu_percent(),
+                                                             proc.memory_info().rss)
+                    except Exception:
+                        procs.pop(pid, None)
+                for pid in procs.keys():
+                    if all(server.pid != pid for server in node_servers):
+                        del procs[pid]
+                try:
+                    node_avail.info = sample_resources(servers)
+                except Exception:
+                    pycos.logger.debug(traceback.format_exc())
+                time.sleep(sample_interval)
+
+        def avail_changed(info, prev):
+            # only significant changes in resources are sent to scheduler
+            if not prev:
+                return True
+            if abs(info.cpu - prev.cpu) >= 5 or abs(info.swap - prev.swap) >= 5:
+                return True
+            if (abs(info.memory - prev.memory) > 0.05 * prev.memory or
+                abs(info.disk - prev.disk) > 0.05 * prev.disk):
+                return True
+            if set(info.servers) != set(prev.servers):
+                return True
+            for location, (cpu, rss) in info.servers.iteritems():
+                prev_cpu, prev_rss = prev.servers[location]
+                if abs(cpu - prev_cpu) >= 5 or abs(rss - prev_rss) > 0.05 * prev_rss:
+                    return True
+            return False
+
+        if psutil:
+            sampler = threading.Thread(target=resource_sampler)
+            sampler.daemon = True
+            sampler.start()
 
-        def close_server(server, pid, terminate=False, restart=False, task=None):
+        def close_server(server, pid, terminate=False, restart=False, park=False, task=None):
             if not server.task or server.pid != pid:
                 raise StopIteration
-            if (yield server.task.deliver({'req': 'terminate' if terminate else 'quit',
-                                           'pid': pid, 'auth': client_info.auth})) == 1:
+            if terminate:
+                req = 'terminate'
+            elif park:
+                req = 'park'
+            else:
+                req = 'quit'
+            if (yield server.task.deliver({'req': req, 'pid': pid,
+                                           'auth': client_info.auth})) == 1:
                 if not terminate:
                     raise StopIteration
                 yield server.done.wait(timeout=10)
@@ -1281,31 +1494,31 @@ def _dispycos_node():
                    'task': None, 'pid': pid, 'restart': restart}
             server_task_msg(msg)
 
-        def close_spawn_proc():
+        def close_spawn_proc(task=None):
             proc = client_info.spawn_mpproc
             cur_auth = client_info.auth
             if not proc:
-                return 0
+                raise StopIteration(0)
             if not proc.is_alive():
                 client_info.spawn_mpproc = None
-                return 0
-            client_info.spawn_q.put({'msg': 'quit', 'auth': client_info.auth})
+                raise StopIteration(0)
+            client_info.spawn_q.put({'msg': 'quit', 'auth': client_info.spawn_auth})
             for j in range(10):
                 try:
-                    msg = client_info.node_q.get(True, 2)
+                    msg = yield mp_pool.async_task(client_info.node_q.get, True, 2)
                 except Exception:
                     pycos.logger.debug(traceback.format_exc())
                     continue
                 if client_info.auth != cur_auth:
-                    return 0
+                    raise StopIteration(0)
                 if (isinstance(msg, dict) and msg.get('msg', None) == 'closed' and
-                    msg.get('auth', None) == client_info.auth):
-                    proc.join(2)
+                    msg.get('auth', None) == client_info.spawn_auth):
+                    yield mp_pool.async_task(proc.join, 2)
                     if proc == client_info.spawn_mpproc and not proc.is_alive():
                         client_info.spawn_mpproc = None
-                        return 0
+                        raise StopIteration(0)
             if client_info.auth != cur_auth:
-                return 0
+                raise StopIteration(0)
             if proc == client_info.spawn_mpproc and proc.is_alive():
                 try:
                     if os.name == 'nt':
@@ -1314,15 +1527,15 @@ def _dispycos_node():
                         proc.terminate()
                 except Exception:
                     pass
-                proc.join(2)
+                yield mp_pool.async_task(proc.join, 2)
                 if client_info.auth != cur_auth:
-                    return 0
+                    raise StopIteration(0)
                 for i in range(10):
                     if proc == client_info.spawn_mpproc and not proc.is_alive():
                         break
-                    proc.join(2)
+                    yield mp_pool.async_task(proc.join, 2)
                     if client_info.auth != cur_auth:
-                        return 0
+                        raise StopIteration(0)
                     if i == 9:
                         try:
                             if os.name == 'nt':
@@ -1337,11 +1550,11 @@ def _dispycos_node():
                         except Exception:
                             pass
             if proc == client_info.spawn_mpproc:
-                proc.join(2)
+                yield mp_pool.async_task(proc.join, 2)
                 if proc == client_info.spawn_mpproc and not proc.is_alive():
                     client_info.spawn_mpproc = None
-                    return 0
-            return -1
+                    raise StopIteration(0)
+            raise StopIteration(-1)
 
         def service_available():
             now = time.time()
@@ -1481,12 +1694,26 @@ def _dispycos_node():
                     pycos.Task(start_server, server)
                 return 0
 
-        def start_client():
+        def unpark_servers(task=None):
+            # parked servers are closed before closing spawn process
+            for server in node_servers:
+                if server.parked:
+                    yield server.parked.deliver({'req': 'quit', 'auth': client_info.spawn_auth},
+                                                timeout=msg_timeout)
+                    server.parked = None
+                    if os.path.exists(server.pid_file):
+                        try:
+                            os.remove(server.pid_file)
+                        except Exception:
+                            pass
+
+        def start_client(task=None):
             if client_info.spawn_mpproc:
-                close_spawn_proc()
+                yield close_spawn_proc(task=task)
             if not os.path.isdir(dispycos_path):
                 os.path.makedirs(dispycos_path)
             _dispycos_config['scheduler_location'] = pycos.serialize(client_info.scheduler.location)
+            _dispycos_config['scheduler_task'] = pycos.serialize(client_info.scheduler)
             _dispycos_config['client_location'] = pycos.serialize(client_info.client_location)
             _dispycos_config['auth'] = client_info.auth
             if client_info.interval < _dispycos_config['min_pulse_interval']:
@@ -1496,7 +1723,7 @@ def _dispycos_node():
             servers = [server for server in node_servers if server.id and not server.task]
             servers = servers[:client_info.cpus_reserved]
             if not servers:
-                return 0
+                raise StopIteration(0)
             for server in servers:
                 server.pid = 0
                 server.restart = False
@@ -1504,8 +1731,10 @@ def _dispycos_node():
             node_servers[0].busy_time.value = int(time.time())
             client_info.node_q = multiprocessing.Queue()
             client_info.spawn_q = multiprocessing.Queue()
+            client_info.spawn_auth = client_info.auth
             args = (client_info.node_q, client_info.spawn_q, _dispycos_config,
-                    [(server.id, server.port, server.busy_time) for server in servers])
+                    [(server.id, server.port, server.busy_time, server.sched_time)
+                     for server in servers])
             client_info.spawn_mpproc = multiprocessing.Process(target=_dispycos_spawn, args=args)
             client_info.spawn_mpproc.start()
             with open(node_servers[0].pid_file, 'wb') as fd:
@@ -1513,7 +1742,7 @@ def _dispycos_node():
                              'spid': client_info.spawn_mpproc.pid}, fd)
             cpus = 0
             try:
-                msg = client_info.node_q.get(True, 30)
+                msg = yield mp_pool.async_task(client_info.node_q.get, True, 30)
             except Exception:
                 pycos.logger.debug(traceback.format_exc())
             else:
@@ -1529,23 +1758,94 @@ def _dispycos_node():
                         cpus = len(msg['sids'])
                     elif msg.get('msg', None) == 'closed':
                         cpus = msg.get('exception', 0)
+            raise StopIteration(cpus)
+
+        def rebind_client(client):
+            # pass client to servers parked by previous client with same computation
+            _dispycos_config['scheduler_location'] = pycos.serialize(client_info.scheduler.location)
+            _dispycos_config['scheduler_task'] = pycos.serialize(client_info.scheduler)
+            _dispycos_config['client_location'] = pycos.serialize(client_info.client_location)
+            _dispycos_config['auth'] = client_info.auth
+            if client_info.interval < _dispycos_config['min_pulse_interval']:
+                client_info.interval = _dispycos_config['min_pulse_interval']
+                pycos.logger.warning('Pulse interval for client has been raised to %s',
+                                     client_info.interval)
+            config = {'auth': client_info.auth,
+                      'scheduler_location': _dispycos_config['scheduler_location'],
+                      'scheduler_task': _dispycos_config['scheduler_task'],
+                      'client_location': _dispycos_config['client_location'],
+                      'pulse_interval': _dispycos_config['pulse_interval'],
+                      'server_setup': client._server_setup,
+                      'disable_servers': client._disable_servers}
+            client_info.spawn_q.put({'msg': 'rebind', 'auth': client_info.spawn_auth,
+                                     'config': config})
+            now = int(time.time())
+            cpus = 0
+            for server in node_servers:
+                if not server.parked:
+                    continue
+                server.parked.send({'req': 'rebind', 'auth': client_info.spawn_auth,
+                                    'config': config})
+                server.parked = None
+                server.restart = False
+                server.busy_time.value = now
+                server.done.clear()
+                cpus += 1
+            node_servers[0].busy_time.value = now
+            client_info.spawn_auth = client_info.auth
             return cpus
 
+        def client_files():
+            # files sent by client (servers' directories are excluded)
+            files = {}
+            for path, dirs, names in os.walk(dispycos_path):
+                if path == dispycos_path:
+                    dirs[:] = [name for name in dirs if not name.startswith('dispycos_server_')]
+                for name in names:
+                    name = os.path.join(path, name)
+                    try:
+                        stat_buf = os.stat(name)
+                    except Exception:
+                        continue
+                    files[name] = (stat_buf.st_size, int(stat_buf.st_mtime))
+            return files
+
         def close_client(req='close', restart=False, task=None):
+            park = (_dispycos_config['reuse_servers'] and req == 'close' and not restart and
+                    not client_info.restart_servers and client_info.reuse_key is not None)
             client_info.restart_servers = False
             for server in node_servers:
                 if server.task:
                     server.restart = False
-                    pycos.Task(close_server, server, server.pid, terminate=(req == 'terminate'))
+                    pycos.Task(close_server, server, server.pid, terminate=(req == 'terminate'),
+                               park=park)
             if not client_info.cpus_reserved:
                 raise StopIteration
             cpus_reserved, client_info.cpus_reserved = client_info.cpus_reserved, 0
             for server in node_servers:
                 if server.task:
                     yield server.done.wait()
-            close_spawn_proc()
+            if park and any(server.parked for server in node_servers):
+                # keep spawn process and parked servers for next client
+                for name in os.listdir(dispycos_path):
+                    if name.startswith('dispycos_server_'):
+                        continue
+                    name = os.path.join(dispycos_path, name)
+                    try:
+                        if os.path.isfile(name):
+                            os.remove(name)
+                        else:
+                            shutil.rmtree(name, ignore_errors=True)
+                    except Exception:
+                        pycos.logger.warning('Could not remove "%s"' % name)
+            else:
+                park = False
+                client_info.reuse_key = None
+            if not park:
+                yield unpark_servers(task=task)
+                yield close_spawn_proc(task=task)
             for server in node_servers:
-                if not server.id:
+                if not server.id or park:
                     continue
                 for i in range(20):
                     if server.task:
@@ -1559,15 +1859,17 @@ def _dispycos_node():
                                 pycos.logger.warning('Could not remove "%s"', path)
                         break
 
-            try:
-                client_info.node_q.close()
-            except Exception:
-                pass
-            try:
-                client_info.spawn_q.close()
-            except Exception:
-                pass
-            client_info.node_q = client_info.spawn_q = None
+            if not park:
+                try:
+                    client_info.node_q.close()
+                except Exception:
+                    pass
+                try:
+                    client_info.spawn_q.close()
+                except Exception:
+                    pass
+                client_info.node_q = client_info.spawn_q = None
+            client_info.jobs.clear()
             if not os.path.isdir(dispycos_path):
                 os.path.makedirs(dispycos_path)
             if not client_info.spawn_mpproc:
@@ -1575,11 +1877,11 @@ def _dispycos_node():
                     pickle.dump({'pid': dispycos_pid, 'ppid': dispycos_ppid, 'spid': -1}, fd)
             if restart:
                 client_info.cpus_reserved = cpus_reserved
-                cpus = start_client()
+                cpus = yield start_client(task=task)
                 if not isinstance(cpus, int) or cpus <= 0:
                     yield close_client(req='close', restart=False, task=task)
                 raise StopIteration
-            if os.path.isdir(dispycos_path):
+            if os.path.isdir(dispycos_path) and not park:
                 for name in os.listdir(dispycos_path):
                     name = os.path.join(dispycos_path, name)
                     try:
@@ -1634,25 +1936,54 @@ def _dispycos_node():
         def timer_proc(task=None):
             task.set_daemon()
             last_pulse = last_ping = last_zombie = time.time()
+            # pulses are spaced out (up to 3 times pulse interval) while scheduler
+            # is reachable and node's status doesn't change; each pulse tells
+            # scheduler when the next one is due
+            pulse_scale = 1.0
             while 1:
-                yield task.sleep(client_info.interval)
+                # next pulse is due that long after scheduler last heard from node
+                wait = last_pulse + (pulse_scale * client_info.interval) - time.time()
+                if wait <= 0:
+                    wait = pulse_scale * client_info.interval
+                yield task.sleep(wait)
                 now = time.time()
                 if client_info.scheduler:
-                    msg = {'status': 'pulse', 'location': task.location}
-                    if psutil:
-                        msg['node_status'] = DispycosNodeAvailInfo(
-                            task.location, 100.0 - psutil.cpu_percent(),
-                            psutil.virtual_memory().available, psutil.disk_usage(disk_path).free,
-                            100.0 - psutil.swap_memory().percent)
-
-                    sent = yield client_info.scheduler.deliver(msg, timeout=msg_timeout)
+                    msg = {'status': 'pulse', 'location': task.location,
+                           'busy_time': max(server.busy_time.value for server in node_servers)}
+                    info = node_avail.info
+                    if info:
+                        # full status is sent at least every 10 pulses
+                        node_avail.pulses += 1
+                        if node_avail.pulses >= 10 or avail_changed(info, node_avail.sent):
+                            msg['node_status'] = info
+                        else:
+                            info = None
+
+                    sched_time = max(server.sched_time.value for server in node_servers)
+                    if not info and sched_time > max(last_pulse, now - client_info.interval):
+                        # status delivered by servers serves as pulse from node
+                        last_pulse = sched_time
+                        sent = 1
+                    else:
+                        # scheduler expects next pulse within this interval
+                        next_scale = 1.0 if info else min(1.25 * pulse_scale, 3.0)
+                        msg['interval'] = next_scale * client_info.interval
+                        sent = yield client_info.scheduler.deliver(msg, timeout=msg_timeout)
+                        if sent == 1:
+                            last_pulse = now
+                            pulse_scale = next_scale
                     if sent == 1:
-                        last_pulse = now
-                    elif client_info.scheduler and (now - last_pulse) > (5 * client_info.interval):
-                        pycos.logger.warning('Scheduler is not reachable; closing client "%s"',
-                                             client_info.auth)
-                        node_task.send({'req': 'close', 'auth': node_auth})
-                        pycos.Task(dispycos_scheduler.close_peer, client_info.scheduler.location)
+                        if info:
+                            node_avail.sent = info
+                            node_avail.pulses = 0
+                    else:
+                        pulse_scale = 1.0
+                        if client_info.scheduler and (now - last_pulse) > (5 * client_info.interval):
+                            pycos.logger.warning('Scheduler is not reachable; closing client "%s"',
+                                                 client_info.auth)
+                            node_task.send({'req': 'close', 'auth': node_auth})
+                            pycos.Task(dispycos_scheduler.close_peer,
+                                       client_info.scheduler.location)
 
                     if (client_info.zombie_period and
                         ((now - last_zombie) > client_info.zombie_period) and client_info.scheduler):
@@ -1708,12 +2039,10 @@ def _dispycos_node():
             elif req == 'dispycos_node_info':
                 reply_task = msg.get('reply_task', None)
                 if isinstance(reply_task, pycos.Task):
-                    if psutil:
-                        info = DispycosNodeAvailInfo(task.location,
-                                                     100.0 - psutil.cpu_percent(),
-                                                     psutil.virtual_memory().available,
-                                                     psutil.disk_usage(disk_path).free,
-                                                     100.0 - psutil.swap_memory().percent)
+                    if node_avail.info:
+                        info = node_avail.info
+                    elif psutil:
+                        info = sample_resources()
                     else:
                         info = DispycosNodeAvailInfo(task.location, None, None, None, None)
                     info = DispycosNodeInfo(node_name, task.location.addr,
@@ -1752,6 +2081,7 @@ def _dispycos_node():
                     client_info.cpus_reserved = cpus
                     client_info.scheduler = msg['status_task']
                     client_info.client_location = msg['client_location']
+                    node_avail.sent = None
                     dispycos_scheduler.ignore_peers = True
                     client_info.interval = msg['pulse_interval']
                     if client_info.interval < _dispycos_config['min_pulse_interval']:
@@ -1785,7 +2115,25 @@ def _dispycos_node():
                     with open(os.path.join(dispycos_path, '..', 'dispycos_client'), 'wb') as fd:
                         pickle.dump({'auth': client_info.auth, 'client': client,
                                      'setup_args': msg['setup_args']}, fd)
-                    cpus = start_client()
+                    cpus = 0
+                    if _dispycos_config['reuse_servers']:
+                        client = pycos.deserialize(client)
+                        key = (client._code, client._node_setup, client._server_setup,
+                               msg['setup_args'])
+                        files = client_files()
+                        if (key == client_info.reuse_key and files == client_info.files and
+                            not client_info.restart_servers and
+                            len([server for server in node_servers if server.parked]) ==
+                            client_info.cpus_reserved):
+                            cpus = rebind_client(client)
+                            pycos.logger.debug('Reusing %s servers for client %s',
+                                               cpus, client_info.auth)
+                        client_info.reuse_key = key
+                        client_info.files = files
+                        del key, files
+                    if not cpus:
+                        yield unpark_servers(task=task)
+                        cpus = yield start_client(task=task)
                     if ((yield reply_task.deliver(cpus)) == 1) and isinstance(cpus, int) and cpus > 0:
                         client_info.cpus_reserved = cpus
                         timer_task.resume()
@@ -1861,8 +2209,49 @@ def _dispycos_node():
                     if server and msg.get('pid', None) == server.pid:
                         server.restart = msg.get('restart', False)
                         if server.pid:
-                            pycos.Task(close_server, server, server.pid,
-                                       terminate=msg.get('terminate', False))
+                            terminate = msg.get('terminate', False)
+                            park = (_dispycos_config['reuse_servers'] and not terminate and
+                                    client_info.reuse_key is not None and not server.restart and
+                                    not client_info.restart_servers)
+                            pycos.Task(close_server, server, server.pid, terminate=terminate,
+                                       park=park)
+
+            elif req == 'server_parked':
+                auth = msg.get('auth', None)
+                server_id = msg.get('server_id', None)
+                if (not client_info.auth or auth != client_info.auth or
+                    not isinstance(server_id, int) or not (0 < server_id < len(node_servers))):
+                    continue
+                server = node_servers[server_id]
+                if (server.task and server.pid == msg.get('pid', None) and
+                    isinstance(msg.get('task', None), pycos.SysTask)):
+                    # server process (and its pid file) is kept for next client
+                    server.parked = msg['task']
+                    server.task = None
+                    server.done.set()
+
+            elif req == 'queue_job':
+                # job is kept until scheduler asks to run it at a server that
+                # finishes a job
+                if msg.get('auth', None) == client_info.auth and client_info.auth:
+                    client_info.jobs[msg.get('id', None)] = msg.get('job', None)
+
+            elif req == 'run_job':
+                if msg.get('auth', None) != client_info.auth or not client_info.auth:
+                    continue
+                job = client_info.jobs.pop(msg.get('id', None), None)
+                server_task = msg.get('server', None)
+                reply_task = msg.get('reply_task', None)
+                if job and isinstance(server_task, pycos.Task):
+                    server_task.send({'req': 'task', 'auth': client_info.auth, 'job': job,
+                                      'reply_task': reply_task})
+                elif isinstance(reply_task, pycos.Task):
+                    reply_task.send(None)
+                del job
+
+            elif req == 'dequeue_job':
+                if msg.get('auth', None) == client_info.auth and client_info.auth:
+                    client_info.jobs.pop(msg.get('id', None), None)
 
             elif req == 'abandon_zombie':
                 auth = msg.get('auth', None)
@@ -1873,6 +2262,11 @@ def _dispycos_node():
                 pycos.logger.warning('Invalid message %s ignored',
                                      str(msg) if isinstance(msg, dict) else '')
 
+        if client_info.spawn_mpproc and not client_info.scheduler:
+            # servers parked for next client
+            yield unpark_servers(task=task)
+            yield close_spawn_proc(task=task)
+            client_info.node_q = client_info.spawn_q = None
         if os.path.isfile(node_servers[0].pid_file) and not client_info.spawn_q:
             try:
                 os.remove(node_servers[0].pid_file)
@@ -1893,7 +2287,7 @@ def _dispycos_node():
         pycos.logger.debug('dispycosnode (%s) received signal %s', dispycos_pid, signum)
         if client_info.spawn_q:
             try:
-                client_info.spawn_q.put({'msg': 'quit', 'auth': client_info.auth})
+                client_info.spawn_q.put({'msg': 'quit', 'auth': client_info.spawn_auth})
             except Exception:
                 pass
         if os.path.isfile(node_servers[0].pid_file):
@@ -1987,6 +2381,7 @@ if __name__ == '__main__':
     import shutil
     import cPickle as pickle
     import traceback
+    import threading
     try:
         import readline
     except Exception:
@@ -2060,6 +2455,9 @@ if __name__ == '__main__':
                         help='maximum pulse interval clients can use in number of seconds')
     parser.add_argument('--zombie_period', dest='zombie_period', default=0, type=int,
                         help='maximum number of seconds for client to not run tasks')
+    parser.add_argument('--sample_interval', dest='sample_interval', default=5, type=int,
+                        help='interval in number of seconds for sampling node\'s resources '
+                        '(CPU, memory, disk) with psutil')
     parser.add_argument('--ping_interval', dest='ping_interval', default=0, type=int,
                         help='interval in number of seconds for node to broadcast its address')
     parser.add_argument('--daemon', action='store_true', dest='daemon', default=False,
@@ -2067,6 +2465,10 @@ if __name__ == '__main__':
     parser.add_argument('--clean', action='store_true', dest='clean', default=False,
                         help='if given, server processes from previous run will be killed '
                         'and new server process started')
+    parser.add_argument('--reuse_servers', action='store_true', dest='reuse_servers',
+                        default=False, help='if given, server processes are kept after a client '
+                        'is done and reused by next client with same code, files and '
+                        'node_setup arguments')
     parser.add_argument('--peer', dest='peers', action='append', default=[],
                         help='peer location (in the form node:TCPport) to communicate')
     parser.add_argument('-d', '--debug', action='store_true', dest='loglevel', default=False,
@@ -121,6 +121,8 @@ class Pycos(pycos.Pycos):
         self._pending_reqs = {}
         self._pending_replies = {}
         self._addrinfos = []
+        # bytes of messages sent to / received from remote tasks and channels
+        self._sent_bytes = self._received_bytes = 0
 
         if not dest_path:
             dest_path = os.path.join(os.sep, tempfile.gettempdir(), 'pycos')
@@ -994,6 +996,9 @@ class Pycos(pycos.Pycos):
                     logger.warning('invalid request "%s" ignored', req.name)
                 break
 
+            if req.name == 'send' or req.name == 'deliver':
+                self._received_bytes += len(msg)
+
             # if req.dst and req.dst != addrinfo.location:
             #     logger.debug('invalid request "%s" to %s (%s)',
             #                  req.name, req.dst, addrinfo.location)
@@ -1883,7 +1888,10 @@ class _Peer(object):
 
             req.auth = self.auth
             try:
-                yield self.conn.send_msg(serialize(req))
+                msg = serialize(req)
+                if req.name == 'send' or req.name == 'deliver':
+                    _Peer._pycos._sent_bytes += len(msg)
+                yield self.conn.send_msg(msg)
                 if req.reply:
                     req.reply = yield self.conn.recv_msg()
                     req.reply = deserialize(req.reply)
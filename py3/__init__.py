@@ -7,6 +7,7 @@ download package provide API for distributed programming, asynchronous pipes,
 distributed concurrent communicating processes.
 """
 
+import os
 import time
 import threading
 from functools import partial as partial_func
@@ -26,6 +27,8 @@ from bisect import bisect_left
 import queue
 import atexit
 import collections
+import multiprocessing
+import tempfile
 import pickle
 import copy
 
@@ -61,9 +64,11 @@ __status__ = "Production"
 __version__ = "4.12.2"
 
 __all__ = ['Task', 'Pycos', 'Lock', 'RLock', 'Event', 'Condition', 'Semaphore',
+           'BoundedSemaphore', 'Barrier', 'BrokenBarrierError', 'Queue',
            'AsyncSocket', 'HotSwapException', 'MonitorStatus', 'Location', 'Channel',
-           'CategorizeMessages', 'AsyncThreadPool', 'AsyncDBCursor',
-           'Singleton', 'logger', 'serialize', 'deserialize', 'Logger']
+           'CategorizeMessages', 'RecordReader', 'AsyncThreadPool', 'AsyncProcessPool',
+           'AsyncDBCursor', 'AsyncDBConnection', 'AsyncDBPool', 'Singleton', 'logger',
+           'serialize', 'deserialize', 'Logger']
 
 # PyPI / pip packaging adjusts assertion below for Python 3.7+
 assert sys.version_info.major == 3 and sys.version_info.minor < 7, \
@@ -406,6 +411,12 @@ class _AsyncSocket(object):
         self._read_fn = self._write_fn = None
         self._read_task = self._write_task = None
 
+    def iter_lines(self, delim=b'\n', bufsize=65536):
+        """Return RecordReader to get lines (or records separated by
+        'delim') received.
+        """
+        return RecordReader(self.recv, delim=delim, bufsize=bufsize)
+
     def unwrap(self):
         """Get rid of AsyncSocket setup and return underlying socket object.
         """
@@ -1827,7 +1838,6 @@ if platform.system() == 'Windows':
 
 
 if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
-    import os
     try:
         import fcntl
     except ImportError:
@@ -2195,12 +2205,79 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
     _AsyncNotifier = _AsyncPoller
 
 
+class _WaitQueue(object):
+    """Internal use only.
+
+    FIFO of tasks waiting on synchronization primitives. Each waiter is kept
+    in an entry (list) so a waiter that stops waiting (e.g., due to timeout)
+    is removed in constant time by marking its entry; marked entries are
+    skipped when popping (and purged when too many accumulate).
+    """
+
+    __slots__ = ('_entries', '_len')
+
+    def __init__(self):
+        self._entries = collections.deque()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return (entry[0] for entry in self._entries if entry[0] is not None)
+
+    def append(self, task):
+        entry = [task]
+        self._entries.append(entry)
+        self._len += 1
+        return entry
+
+    def appendleft(self, task):
+        entry = [task]
+        self._entries.appendleft(entry)
+        self._len += 1
+        return entry
+
+    def popleft(self):
+        while self._entries:
+            entry = self._entries.popleft()
+            task = entry[0]
+            if task is not None:
+                entry[0] = None
+                self._len -= 1
+                return task
+        return None
+
+    def cancel(self, entry):
+        """Returns True if waiter is removed, or False if it has already been
+        popped.
+        """
+        if entry[0] is None:
+            return False
+        entry[0] = None
+        self._len -= 1
+        if len(self._entries) > (2 * self._len + 32):
+            self._entries = collections.deque(entry for entry in self._entries
+                                              if entry[0] is not None)
+        return True
+
+    def clear(self):
+        tasks = []
+        for entry in self._entries:
+            if entry[0] is not None:
+                tasks.append(entry[0])
+                entry[0] = None
+        self._entries.clear()
+        self._len = 0
+        return tasks
+
+
 class Lock(object):
     """'Lock' primitive for tasks.
     """
     def __init__(self):
         self._owner = None
-        self._waitlist = []
+        self._waitlist = _WaitQueue()
         self._scheduler = None
 
     def acquire(self, blocking=True, timeout=-1):
@@ -2218,12 +2295,9 @@ class Lock(object):
                 if timeout <= 0:
                     raise StopIteration(False)
                 start = _time()
-            self._waitlist.append(task)
+            entry = self._waitlist.append(task)
             if (yield task._await_(timeout)) is None:
-                try:
-                    self._waitlist.remove(task)
-                except ValueError:
-                    pass
+                self._waitlist.cancel(entry)
             if timeout is not None:
                 timeout -= (_time() - start)
         self._owner = task
@@ -2237,7 +2311,7 @@ class Lock(object):
             raise RuntimeError('"%s"/%s: invalid lock release - not locked' % (task._name, task._id))
         self._owner = None
         if self._waitlist:
-            wake = self._waitlist.pop(0)
+            wake = self._waitlist.popleft()
             wake._proceed_(True)
 
 
@@ -2247,7 +2321,7 @@ class RLock(object):
     def __init__(self):
         self._owner = None
         self._depth = 0
-        self._waitlist = []
+        self._waitlist = _WaitQueue()
         self._scheduler = None
 
     def acquire(self, blocking=True, timeout=-1):
@@ -2269,12 +2343,9 @@ class RLock(object):
                 if timeout <= 0:
                     raise StopIteration(False)
                 start = _time()
-            self._waitlist.append(task)
+            entry = self._waitlist.append(task)
             if (yield task._await_(timeout)) is None:
-                try:
-                    self._waitlist.remove(task)
-                except ValueError:
-                    pass
+                self._waitlist.cancel(entry)
             if timeout is not None:
                 timeout -= (_time() - start)
         assert self._depth == 0
@@ -2293,7 +2364,7 @@ class RLock(object):
         if self._depth == 0:
             self._owner = None
             if self._waitlist:
-                wake = self._waitlist.pop(0)
+                wake = self._waitlist.popleft()
                 wake._proceed_(True)
 
 
@@ -2305,8 +2376,8 @@ class Condition(object):
         """
         self._owner = None
         self._depth = 0
-        self._waitlist = []
-        self._notifylist = []
+        self._waitlist = _WaitQueue()
+        self._notifylist = _WaitQueue()
         self._scheduler = None
 
     def acquire(self, blocking=True, timeout=-1):
@@ -2327,12 +2398,9 @@ class Condition(object):
                 if timeout <= 0:
                     raise StopIteration(False)
                 start = _time()
-            self._waitlist.append(task)
+            entry = self._waitlist.append(task)
             if (yield task._await_(timeout)) is None:
-                try:
-                    self._waitlist.remove(task)
-                except ValueError:
-                    pass
+                self._waitlist.cancel(entry)
             if timeout is not None:
                 timeout -= (_time() - start)
         assert self._depth == 0
@@ -2351,14 +2419,14 @@ class Condition(object):
         if self._depth == 0:
             self._owner = None
             if self._waitlist:
-                wake = self._waitlist.pop(0)
+                wake = self._waitlist.popleft()
                 wake._proceed_(True)
 
     def notify(self, n=1):
         """May not be used with 'yield'.
         """
         while self._notifylist and n:
-            wake = self._notifylist.pop(0)
+            wake = self._notifylist.popleft()
             wake._proceed_(True)
             n -= 1
 
@@ -2379,28 +2447,23 @@ class Condition(object):
         self._depth = 0
         self._owner = None
         if self._waitlist:
-            wake = self._waitlist.pop(0)
+            wake = self._waitlist.popleft()
             wake._proceed_(True)
-        self._notifylist.append(task)
+        entry = self._notifylist.append(task)
         start = _time()
         if (yield task._await_(timeout)) is None:
-            try:
-                self._notifylist.remove(task)
-            except ValueError:
-                pass
+            self._notifylist.cancel(entry)
             raise StopIteration(False)
         while self._owner is not None:
-            self._waitlist.insert(0, task)
+            entry = self._waitlist.appendleft(task)
             if timeout is not None:
                 timeout -= (_time() - start)
                 if timeout <= 0:
+                    self._waitlist.cancel(entry)
                     raise StopIteration(False)
                 start = _time()
             if (yield task._await_(timeout)) is None:
-                try:
-                    self._waitlist.remove(task)
-                except ValueError:
-                    pass
+                self._waitlist.cancel(entry)
                 raise StopIteration(False)
         assert self._depth == 0
         self._owner = task
@@ -2413,16 +2476,15 @@ class Event(object):
     """
     def __init__(self):
         self._flag = False
-        self._waitlist = []
+        self._waitlist = _WaitQueue()
         self._scheduler = None
 
     def set(self):
         """May be used with 'yield'.
         """
         self._flag = True
-        for task in self._waitlist:
+        for task in self._waitlist.clear():
             task._proceed_(True)
-        self._waitlist = []
 
     def is_set(self):
         """No need to use with 'yield'.
@@ -2447,12 +2509,9 @@ class Event(object):
         if timeout is not None:
             if timeout <= 0:
                 raise StopIteration(False)
-        self._waitlist.append(task)
+        entry = self._waitlist.append(task)
         if (yield task._await_(timeout)) is None:
-            try:
-                self._waitlist.remove(task)
-            except ValueError:
-                pass
+            self._waitlist.cancel(entry)
             raise StopIteration(False)
         else:
             raise StopIteration(True)
@@ -2463,20 +2522,29 @@ class Semaphore(object):
     """
     def __init__(self, value=1):
         assert value >= 1
-        self._waitlist = []
+        self._waitlist = _WaitQueue()
         self._counter = value
         self._scheduler = None
 
-    def acquire(self, blocking=True):
+    def acquire(self, blocking=True, timeout=-1):
         """Must be used with 'yield' as 'yield sem.acquire()'.
         """
         if blocking:
             if not self._scheduler:
                 self._scheduler = Pycos.scheduler()
             task = Pycos.cur_task(self._scheduler)
+            if timeout < 0:
+                timeout = None
             while self._counter == 0:
-                self._waitlist.append(task)
-                yield task._await_()
+                if timeout is not None:
+                    if timeout <= 0:
+                        raise StopIteration(False)
+                    start = _time()
+                entry = self._waitlist.append(task)
+                if (yield task._await_(timeout)) is None:
+                    self._waitlist.cancel(entry)
+                if timeout is not None:
+                    timeout -= (_time() - start)
         elif self._counter == 0:
             raise StopIteration(False)
         self._counter -= 1
@@ -2488,8 +2556,261 @@ class Semaphore(object):
         self._counter += 1
         assert self._counter > 0
         if self._waitlist:
-            wake = self._waitlist.pop(0)
-            wake._proceed_()
+            wake = self._waitlist.popleft()
+            wake._proceed_(True)
+
+
+class BoundedSemaphore(Semaphore):
+    """'BoundedSemaphore' primitive for tasks; releasing it more times than
+    it has been acquired raises ValueError.
+    """
+    def __init__(self, value=1):
+        super(BoundedSemaphore, self).__init__(value)
+        self._value = value
+
+    def release(self):
+        """May be used with 'yield'.
+        """
+        if self._counter >= self._value:
+            raise ValueError('semaphore released too many times')
+        super(BoundedSemaphore, self).release()
+
+
+class BrokenBarrierError(RuntimeError):
+    """Raised in tasks waiting on a Barrier when it is broken (reset,
+    aborted, or timed out).
+    """
+    pass
+
+
+class Barrier(object):
+    """'Barrier' primitive for tasks; 'parties' tasks wait until all of them
+    reach the barrier.
+    """
+    def __init__(self, parties, action=None, timeout=None):
+        """If 'action' is given, it is called (by the last task to reach the
+        barrier) before waiting tasks are released. 'timeout' is default
+        timeout for 'wait'.
+        """
+        assert parties >= 1
+        self._parties = parties
+        self._action = action
+        self._timeout = timeout
+        self._count = 0
+        self._broken = False
+        self._waitlist = _WaitQueue()
+        self._scheduler = None
+
+    def wait(self, timeout=None):
+        """Must be used with 'yield' as 'index = yield barrier.wait()'.
+
+        Returns index (0 to parties - 1), unique for each task, of task
+        reaching the barrier. If barrier is broken, or timeout expires, raises
+        BrokenBarrierError.
+        """
+        if self._broken:
+            raise BrokenBarrierError
+        if not self._scheduler:
+            self._scheduler = Pycos.scheduler()
+        task = Pycos.cur_task(self._scheduler)
+        if timeout is None:
+            timeout = self._timeout
+        index = self._count
+        self._count += 1
+        if self._count == self._parties:
+            if self._action:
+                try:
+                    self._action()
+                except Exception:
+                    self._break()
+                    raise
+            self._count = 0
+            for wake in self._waitlist.clear():
+                wake._proceed_(True)
+            raise StopIteration(index)
+        entry = self._waitlist.append(task)
+        passed = yield task._await_(timeout)
+        if passed is None:
+            if self._waitlist.cancel(entry):
+                self._break()
+                raise BrokenBarrierError
+            # released (or broken) when timeout expired
+            passed = not self._broken
+        if not passed:
+            raise BrokenBarrierError
+        raise StopIteration(index)
+
+    def _break(self):
+        self._broken = True
+        self._count = 0
+        for wake in self._waitlist.clear():
+            wake._proceed_(False)
+
+    def reset(self):
+        """Tasks waiting on the barrier get BrokenBarrierError and barrier is
+        reset to initial state. May be used with 'yield'.
+        """
+        self._break()
+        self._broken = False
+
+    def abort(self):
+        """Puts barrier in broken state; tasks waiting (and those that call
+        'wait' later) get BrokenBarrierError. May be used with 'yield'.
+        """
+        self._break()
+
+    @property
+    def parties(self):
+        return self._parties
+
+    @property
+    def n_waiting(self):
+        return len(self._waitlist)
+
+    @property
+    def broken(self):
+        return self._broken
+
+
+class Queue(object):
+    """'Queue' (FIFO) for exchanging items between tasks, similar to
+    'Queue' in standard 'queue' module, except that 'put' and 'get' must be
+    used with 'yield'.
+    """
+    def __init__(self, maxsize=0):
+        """If 'maxsize' is positive, queue holds at most that many items;
+        tasks putting more items wait until items are taken out.
+        """
+        self.maxsize = maxsize
+        self._items = collections.deque()
+        self._getters = _WaitQueue()
+        self._putters = _WaitQueue()
+        self._scheduler = None
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def full(self):
+        return 0 < self.maxsize <= len(self._items)
+
+    def put(self, item, block=True, timeout=None):
+        """Must be used with 'yield' as 'yield q.put(item)'.
+
+        If queue is full, waits for up to 'timeout' seconds (forever if it is
+        None) for a free slot; if 'block' is False or timeout expires,
+        'queue.Full' exception is raised.
+        """
+        if 0 < self.maxsize <= len(self._items):
+            if not block:
+                raise queue.Full
+            if not self._scheduler:
+                self._scheduler = Pycos.scheduler()
+            task = Pycos.cur_task(self._scheduler)
+            if timeout is not None:
+                timeout += _time()
+            while 0 < self.maxsize <= len(self._items):
+                if timeout is None:
+                    wait = None
+                else:
+                    wait = timeout - _time()
+                    if wait <= 0:
+                        raise queue.Full
+                entry = self._putters.append(task)
+                if (yield task._await_(wait)) is None:
+                    self._putters.cancel(entry)
+        self._items.append(item)
+        if self._getters:
+            self._getters.popleft()._proceed_(True)
+
+    def put_nowait(self, item):
+        """Puts 'item' if queue is not full, otherwise raises 'queue.Full'.
+        Need not be used with 'yield'.
+        """
+        if 0 < self.maxsize <= len(self._items):
+            raise queue.Full
+        self._items.append(item)
+        if self._getters:
+            self._getters.popleft()._proceed_(True)
+
+    def get(self, block=True, timeout=None):
+        """Must be used with 'yield' as 'item = yield q.get()'.
+
+        If queue is empty, waits for up to 'timeout' seconds (forever if it is
+        None) for an item; if 'block' is False or timeout expires,
+        'queue.Empty' exception is raised.
+        """
+        if not self._items:
+            if not block:
+                raise queue.Empty
+            if not self._scheduler:
+                self._scheduler = Pycos.scheduler()
+            task = Pycos.cur_task(self._scheduler)
+            if timeout is not None:
+                timeout += _time()
+            while not self._items:
+                if timeout is None:
+                    wait = None
+                else:
+                    wait = timeout - _time()
+                    if wait <= 0:
+                        raise queue.Empty
+                entry = self._getters.append(task)
+                if (yield task._await_(wait)) is None:
+                    self._getters.cancel(entry)
+        item = self._items.popleft()
+        if self._putters:
+            self._putters.popleft()._proceed_(True)
+        raise StopIteration(item)
+
+    def get_nowait(self):
+        """Returns an item if available, otherwise raises 'queue.Empty'. Need
+        not be used with 'yield'.
+        """
+        if not self._items:
+            raise queue.Empty
+        item = self._items.popleft()
+        if self._putters:
+            self._putters.popleft()._proceed_(True)
+        return item
+
+    def get_batch(self, max_items=None, timeout=None):
+        """Must be used with 'yield' as
+        'items = yield q.get_batch(max_items, timeout)'.
+
+        Returns list of items available in queue, up to 'max_items' (all, if
+        it is None), so a consumer can process items in batches with one
+        resume. If queue is empty, waits for up to 'timeout' seconds (forever
+        if it is None) for an item; if timeout expires, returns empty list.
+        """
+        if not self._items:
+            if not self._scheduler:
+                self._scheduler = Pycos.scheduler()
+            task = Pycos.cur_task(self._scheduler)
+            if timeout is not None:
+                timeout += _time()
+            while not self._items:
+                if timeout is None:
+                    wait = None
+                else:
+                    wait = timeout - _time()
+                    if wait <= 0:
+                        raise StopIteration([])
+                entry = self._getters.append(task)
+                if (yield task._await_(wait)) is None:
+                    self._getters.cancel(entry)
+        if max_items is None or max_items >= len(self._items):
+            items = list(self._items)
+            self._items.clear()
+        else:
+            items = [self._items.popleft() for i in range(max(1, max_items))]
+        for i in range(len(items)):
+            if not self._putters:
+                break
+            self._putters.popleft()._proceed_(True)
+        raise StopIteration(items)
 
 
 class HotSwapException(Exception):
@@ -3369,14 +3690,38 @@ class Channel(object):
 class CategorizeMessages(object):
     """Splits messages to task into categories so that they can be processed on
     priority basis, for example.
+
+    Messages can be categorized with routes (see 'add_route'), which are
+    checked without calling functions, and / or with functions (see 'add'),
+    which are called in turn until one of them returns a category. Type routes
+    are looked up in constant time (after first message of each class); key
+    routes are checked one key at a time, so their cost grows with the number
+    of different keys routed (values of a key are looked up in constant time).
     """
 
-    def __init__(self, task):
+    def __init__(self, task, maxlen=None, overflow='drop_oldest'):
         """Categorize messages to task 'task'.
+
+        If 'maxlen' is given, it is the maximum number of messages kept in
+        each category (other than None, which is not limited unless set with
+        'set_limit'), so messages in categories that are not received do not
+        accumulate without bound. When a category is full, 'overflow'
+        determines what happens to a new message: with 'drop_oldest' the
+        oldest message in that category is discarded, with 'drop_newest' the
+        new message is discarded, and if it is a function, it is called with
+        category and the new message (and the message is not queued).
         """
         self._task = task
         self._categories = {None: collections.deque()}
         self._categorize = []
+        # routes based on message type, value of key (of dict messages)
+        self._types = {}
+        self._type_cache = {}
+        self._keys = collections.OrderedDict()
+        self._limits = {}
+        self._maxlen = maxlen
+        self._overflow = overflow
+        self._dropped = 0
 
     def add(self, categorize):
         """Add given method to categorize messages. When a message is received,
@@ -3407,6 +3752,143 @@ class CategorizeMessages(object):
         except ValueError:
             logger.warning('invalid categorize function')
 
+    def add_route(self, category=None, msg_type=None, key=None, value=None):
+        """Add route to categorize messages without calling functions.
+
+        If 'msg_type' is given, messages that are instances of that class (or
+        its subclasses) are put in 'category'.
+
+        If 'key' is given, messages that are dictionaries with that key are
+        categorized by its value: if 'category' is None, the value itself is
+        the category (e.g., with key='req', message {'req': 'status', ...} is
+        put in category 'status'); otherwise, messages with that key having
+        'value' are put in 'category'.
+
+        Routes are checked before functions added with 'add'; type routes
+        are checked before key routes, and keys are checked in the order they
+        were first added.
+        """
+        if msg_type is not None:
+            if category is None:
+                logger.warning('invalid route for %s ignored', msg_type)
+                return -1
+            self._types[msg_type] = category
+            self._type_cache.clear()
+        elif key is not None:
+            if category is None:
+                self._keys[key] = None
+            else:
+                values = self._keys.get(key, None)
+                if values is None:
+                    values = self._keys[key] = {}
+                values[value] = category
+        else:
+            logger.warning('invalid route ignored')
+            return -1
+        return 0
+
+    def remove_route(self, category=None, msg_type=None, key=None, value=None):
+        """Remove route added earlier with 'add_route' (with same arguments).
+        """
+        if msg_type is not None:
+            if self._types.pop(msg_type, None) is None:
+                return -1
+            self._type_cache.clear()
+        elif key is not None:
+            if key not in self._keys:
+                return -1
+            values = self._keys[key]
+            if category is None or values is None:
+                self._keys.pop(key)
+            else:
+                if values.pop(value, None) is None:
+                    return -1
+                if not values:
+                    self._keys.pop(key)
+        else:
+            return -1
+        return 0
+
+    def set_limit(self, category, maxlen, overflow=None):
+        """Set maximum number of messages kept in 'category' (no limit if
+        'maxlen' is None) and 'overflow' policy for it (default policy, if
+        None). See '__init__' for details.
+        """
+        if maxlen is None and overflow is None:
+            self._limits.pop(category, None)
+        else:
+            self._limits[category] = (maxlen, overflow or self._overflow)
+
+    @property
+    def dropped(self):
+        """Number of messages discarded due to overflow.
+        """
+        return self._dropped
+
+    def _route(self, msg):
+        # message class is used (instead of type) so old style classes work
+        # with Python 2 as well
+        if self._types:
+            cls = getattr(msg, '__class__', type(msg))
+            try:
+                category = self._type_cache[cls]
+            except KeyError:
+                category = None
+                for base in inspect.getmro(cls):
+                    category = self._types.get(base, None)
+                    if category is not None:
+                        break
+                self._type_cache[cls] = category
+            except TypeError:
+                category = None
+            if category is not None:
+                return category
+        if self._keys and isinstance(msg, dict):
+            for key, values in self._keys.items():
+                if key in msg:
+                    if values is None:
+                        category = msg[key]
+                    else:
+                        try:
+                            category = values.get(msg[key], None)
+                        except TypeError:
+                            category = None
+                    if category is not None:
+                        return category
+        for categorize in self._categorize:
+            category = categorize(msg)
+            if category is not None:
+                return category
+        return None
+
+    def _queue(self, category, msg):
+        bucket = self._categories.get(category, None)
+        if bucket is None:
+            bucket = self._categories[category] = collections.deque()
+        limit = self._limits.get(category, None)
+        if limit:
+            maxlen, overflow = limit
+        elif category is None:
+            maxlen = None
+        else:
+            maxlen, overflow = self._maxlen, self._overflow
+        if maxlen is not None and len(bucket) >= maxlen:
+            self._dropped += 1
+            if overflow == 'drop_oldest':
+                if not bucket:
+                    return
+                bucket.popleft()
+            elif overflow == 'drop_newest':
+                return
+            else:
+                try:
+                    overflow(category, msg)
+                except Exception:
+                    logger.warning('overflow function for category %s failed: %s',
+                                   category, traceback.format_exc())
+                return
+        bucket.append(msg)
+
     def receive(self, category=None, timeout=None, alarm_value=None):
         """Similar to 'receive' of Task, except it retrieves (waiting, if
         necessary) messages in given 'category'.
@@ -3422,18 +3904,10 @@ class CategorizeMessages(object):
             msg = yield self._task.receive(timeout=timeout, alarm_value=alarm_value)
             if msg == alarm_value:
                 raise StopIteration(msg)
-            for categorize in self._categorize:
-                c = categorize(msg)
-                if c == category:
-                    raise StopIteration(msg)
-                if c is not None:
-                    bucket = self._categories.get(c, None)
-                    if not bucket:
-                        bucket = self._categories[c] = collections.deque()
-                    bucket.append(msg)
-                    break
-            else:
-                self._categories[None].append(msg)
+            c = self._route(msg)
+            if c == category:
+                raise StopIteration(msg)
+            self._queue(c, msg)
             if timeout:
                 now = _time()
                 timeout -= now - start
@@ -3441,6 +3915,38 @@ class CategorizeMessages(object):
 
     recv = receive
 
+    def receive_any(self, categories, timeout=None, alarm_value=None):
+        """Similar to 'receive', except it waits for a message in any of given
+        'categories' (list / tuple, in order of priority) and returns tuple
+        (category, message). If timeout expires, (None, alarm_value) is
+        returned.
+        """
+        for category in categories:
+            c = self._categories.get(category, None)
+            if c:
+                raise StopIteration((category, c.popleft()))
+        categories = set(categories)
+        if timeout:
+            start = _time()
+        while 1:
+            msg = yield self._task.receive(timeout=timeout, alarm_value=alarm_value)
+            if msg == alarm_value:
+                raise StopIteration((None, msg))
+            c = self._route(msg)
+            if c in categories:
+                raise StopIteration((c, msg))
+            self._queue(c, msg)
+            if timeout:
+                now = _time()
+                timeout -= now - start
+                start = now
+
+    def pending(self, category=None):
+        """Number of messages queued in given category.
+        """
+        c = self._categories.get(category, None)
+        return len(c) if c else 0
+
 
 class Pycos(object, metaclass=Singleton):
     """Task scheduler.
@@ -4121,6 +4627,96 @@ class Pycos(object, metaclass=Singleton):
         return ''
 
 
+class RecordReader(object):
+    """Buffered reader to split data read (with 'read' function, e.g., 'recv'
+    method of AsyncSocket or 'read' method of AsyncFile) into records (e.g.,
+    lines) separated by 'delim'. Data is read in chunks of (at most) 'bufsize'
+    bytes, so many records can be obtained with one read. Usually created with
+    'iter_lines' method of AsyncSocket, AsyncFile or AsyncPipe; e.g.,
+
+        lines = async_pipe.iter_lines()
+        while True:
+            records = yield lines.records()
+            if not records:
+                break
+            for line in records:
+                ...
+    """
+
+    def __init__(self, read, delim=b'\n', bufsize=65536):
+        if not delim:
+            raise ValueError('invalid delimiter')
+        self._read = read
+        self._delim = delim
+        self.bufsize = bufsize
+        self._records = collections.deque()
+        # data (chunks) of incomplete record
+        self._partial = []
+        self._eof = False
+
+    def _split(self, data):
+        delim = self._delim
+        dlen = len(delim)
+        if self._partial and dlen > 1:
+            # delimiter may span chunks
+            tail = self._partial[-1][1 - dlen:]
+            self._partial[-1] = self._partial[-1][:len(self._partial[-1]) - len(tail)]
+            data = tail + data
+        pos = data.find(delim)
+        if pos < 0:
+            self._partial.append(data)
+            return
+        start = pos + dlen
+        if self._partial:
+            self._partial.append(data[:start])
+            self._records.append(b''.join(self._partial))
+            self._partial = []
+        else:
+            self._records.append(data[:start])
+        find, append = data.find, self._records.append
+        while 1:
+            pos = find(delim, start)
+            if pos < 0:
+                break
+            pos += dlen
+            append(data[start:pos])
+            start = pos
+        if start < len(data):
+            self._partial.append(data[start:])
+
+    def records(self):
+        """Get list of records (each including 'delim'), reading data if no
+        records are available. If data ends without 'delim', that data is
+        last record. Empty list is returned when there is no more data.
+
+        Must be used with 'yield' as 'records = yield reader.records()'.
+        """
+        while not self._records and not self._eof:
+            data = yield self._read(self.bufsize)
+            if data:
+                self._split(data)
+            else:
+                self._eof = True
+                if self._partial:
+                    self._records.append(b''.join(self._partial))
+                    self._partial = []
+        records = list(self._records)
+        self._records.clear()
+        raise StopIteration(records)
+
+    def record(self):
+        """Get next record; empty data is returned when there is no more
+        data.
+
+        Must be used with 'yield' as 'record = yield reader.record()'.
+        """
+        if not self._records:
+            self._records.extend((yield self.records()))
+            if not self._records:
+                raise StopIteration(b'')
+        raise StopIteration(self._records.popleft())
+
+
 class AsyncThreadPool(object):
     """Schedule synchronous tasks with threads to be executed asynchronously.
 
@@ -4129,29 +4725,97 @@ class AsyncThreadPool(object):
     (not task locking).
     """
 
-    def __init__(self, num_threads):
+    def __init__(self, num_threads, max_threads=None, latency=0.01, idle_time=60):
+        """'num_threads' threads are started and kept. If 'max_threads' is
+        greater than 'num_threads', more threads (up to 'max_threads') are
+        started when scheduled functions wait in queue for more than
+        'latency' seconds; these threads are stopped when they are idle for
+        'idle_time' seconds.
+        """
         self._scheduler = Pycos.scheduler()
-        self._num_threads = num_threads
+        self._min_threads = num_threads
+        self._max_threads = max(num_threads, max_threads or num_threads)
+        self.latency = latency
+        self.idle_time = idle_time
+        self._num_threads = 0
+        self._terminating = False
         self._task_queue = queue.Queue()
+        # results of functions executed are delivered to tasks in batches by
+        # '_deliver_task' so there is only one wakeup of scheduler per batch
+        self._lock = threading.Lock()
+        self._results = []
+        self._deliver_task = None
         for n in range(num_threads):
-            tasklet = threading.Thread(target=self._tasklet)
-            tasklet.daemon = True
-            tasklet.start()
+            self._add_thread()
+
+    def _add_thread(self):
+        with self._lock:
+            if self._num_threads >= self._max_threads or self._terminating:
+                return
+            self._num_threads += 1
+        tasklet = threading.Thread(target=self._tasklet)
+        tasklet.daemon = True
+        tasklet.start()
 
     def _tasklet(self):
         while 1:
-            item = self._task_queue.get(block=True)
+            # only threads above 'num_threads' wait with timeout (to exit when
+            # idle), as waiting with timeout polls with Python 2
+            if self._num_threads > self._min_threads:
+                timeout = self.idle_time
+            else:
+                timeout = None
+            try:
+                item = self._task_queue.get(block=True, timeout=timeout)
+            except queue.Empty:
+                with self._lock:
+                    if self._num_threads > self._min_threads and not self._terminating:
+                        self._num_threads -= 1
+                        break
+                continue
             if item is None:
                 self._task_queue.task_done()
                 break
-            task, target, args, kwargs = item
+            task, target, args, kwargs, queued = item
+            if (_time() - queued) > self.latency and self._num_threads < self._max_threads:
+                self._add_thread()
             try:
-                val = target(*args, **kwargs)
-                task._proceed_(val)
+                result = (task, None, target(*args, **kwargs))
             except Exception:
-                task.throw(*sys.exc_info())
+                result = (task, sys.exc_info(), None)
             finally:
                 self._task_queue.task_done()
+            if task:
+                self._done(result)
+
+    def _done(self, result):
+        with self._lock:
+            self._results.append(result)
+            if len(self._results) > 1:
+                return
+        self._deliver_task.send(None)
+
+    def _deliver(self, task=None):
+        task.set_daemon()
+        while 1:
+            yield task.receive()
+            with self._lock:
+                results, self._results = self._results, []
+            for rtask, exc, val in results:
+                if exc:
+                    rtask.throw(*exc)
+                else:
+                    rtask._proceed_(val)
+
+    def _submit(self):
+        if not self._scheduler:
+            self._scheduler = Pycos.scheduler()
+        task = Pycos.cur_task(self._scheduler)
+        # assert isinstance(task, Task)
+        if not self._deliver_task:
+            self._deliver_task = Task(self._deliver)
+        task._await_()
+        return task
 
     def async_task(self, target, *args, **kwargs):
         """Must be used with 'yield', as
@@ -4168,16 +4832,52 @@ class AsyncThreadPool(object):
         'target(*args, **kwargs)'.
         """
 
-        if not self._scheduler:
-            self._scheduler = Pycos.scheduler()
-        task = Pycos.cur_task(self._scheduler)
-        # assert isinstance(task, Task)
         # if arguments are passed as per Thread call, get args and kwargs
         if not args and kwargs:
             args = kwargs.pop('args', ())
             kwargs = kwargs.pop('kwargs', kwargs)
-        task._await_()
-        self._task_queue.put((task, target, args, kwargs))
+        task = self._submit()
+        self._task_queue.put((task, target, args, kwargs, _time()))
+
+    def map(self, target, items, chunksize=1):
+        """Must be used with 'yield', as
+        'results = yield pool.map(target, items)'.
+
+        Executes 'target' with each item in 'items' with threads in the pool and
+        returns list of results (in the same order as items). Items are sent to
+        threads in chunks of 'chunksize' items, so larger value reduces overhead
+        when 'target' takes little time. If 'target' raises exception for any
+        item, that exception is thrown to the task after all items are done.
+        """
+        items = list(items)
+        chunksize = max(1, chunksize)
+        task = self._submit()
+        if not items:
+            task._proceed_([])
+            return
+        results = [None] * len(items)
+        excs = []
+        pending = [(len(items) + chunksize - 1) // chunksize]
+
+        def run_chunk(start, end):
+            try:
+                for i in range(start, end):
+                    results[i] = target(items[i])
+            except Exception:
+                excs.append(sys.exc_info())
+            with self._lock:
+                pending[0] -= 1
+                if pending[0]:
+                    return
+            if excs:
+                self._done((task, excs[0], None))
+            else:
+                self._done((task, None, results))
+
+        now = _time()
+        for start in range(0, len(items), chunksize):
+            self._task_queue.put((None, run_chunk, (start, min(start + chunksize, len(items))),
+                                  {}, now))
 
     def join(self):
         """Wait till all scheduled tasks are completed.
@@ -4188,11 +4888,196 @@ class AsyncThreadPool(object):
         """Wait for all scheduled tasks to complete and terminate
         threads.
         """
-        for n in range(self._num_threads):
+        with self._lock:
+            self._terminating = True
+            num_threads = self._num_threads
+        for n in range(num_threads):
             self._task_queue.put(None)
         self._task_queue.join()
 
 
+# directory for files used by AsyncProcessPool to pass large data
+_ShmDir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def _pack_pool_msg(obj, shm_size):
+    """Internal use only.
+    """
+    data = serialize(obj)
+    if shm_size and len(data) > shm_size:
+        # large data is passed through file in shared memory (if available)
+        fd, path = tempfile.mkstemp(prefix='pycos_', dir=_ShmDir)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        return b'S' + path.encode()
+    return b'I' + data
+
+
+def _unpack_pool_msg(msg):
+    """Internal use only.
+    """
+    if msg[:1] == b'S':
+        path = msg[1:].decode()
+        try:
+            with open(path, 'rb') as fp:
+                msg = fp.read()
+        finally:
+            os.remove(path)
+        return deserialize(msg)
+    return deserialize(msg[1:])
+
+
+def _process_pool_worker(conn, shm_size):
+    """Internal use only.
+    """
+    # runs in worker process of AsyncProcessPool; as it may be forked from
+    # pycos thread, signal handlers can't be set, so interrupt just stops it
+    conn = AsyncSocket(conn, blocking=True)
+    try:
+        while 1:
+            msg = conn.recv_msg()
+            if not msg:
+                break
+            try:
+                target, args, kwargs = _unpack_pool_msg(msg)
+                result = (0, target(*args, **kwargs))
+            except Exception:
+                result = (1, sys.exc_info()[1])
+            try:
+                msg = _pack_pool_msg(result, shm_size)
+            except Exception:
+                msg = _pack_pool_msg((1, Exception(traceback.format_exc())), shm_size)
+            conn.send_msg(msg)
+    except (KeyboardInterrupt, socket.error):
+        pass
+    conn.close()
+
+
+class AsyncProcessPool(object):
+    """Schedule (CPU bound) functions to be executed in separate processes, so
+    they are not limited by Python's GIL and don't block tasks. Functions
+    (targets), their arguments and results must be serializable; e.g., targets
+    should be defined at module level.
+
+    Arguments and results are sent to / received from processes over sockets
+    handled by pycos scheduler; if serialized data is larger than 'shm_size'
+    bytes, it is passed through a file in shared memory (/dev/shm, if
+    available) instead.
+    """
+
+    def __init__(self, num_procs=None, shm_size=(1024 * 1024)):
+        """'num_procs' is number of processes to start; if it is not given,
+        number of CPUs available is used.
+        """
+        self._scheduler = Pycos.scheduler()
+        self._num_procs = num_procs or multiprocessing.cpu_count()
+        self._shm_size = shm_size
+        self._pending = collections.deque()
+        self._idle = []
+        self._workers = []
+        self._terminating = False
+
+    def _start_proc(self):
+        sock, child = socket.socketpair()
+        proc = multiprocessing.Process(target=_process_pool_worker,
+                                       args=(child, self._shm_size))
+        proc.daemon = True
+        proc.start()
+        child.close()
+        return (AsyncSocket(sock), proc)
+
+    def _worker(self, task=None):
+        task.set_daemon()
+        conn, proc = self._start_proc()
+        while 1:
+            if self._pending:
+                job = self._pending.popleft()
+            else:
+                self._idle.append(task)
+                job = yield task.receive()
+                if not job:
+                    break
+            rtask, target, args, kwargs = job
+            try:
+                msg = _pack_pool_msg((target, args, kwargs), self._shm_size)
+            except Exception:
+                rtask.throw(*sys.exc_info())
+                continue
+            try:
+                yield conn.send_msg(msg)
+                msg = yield conn.recv_msg()
+            except Exception:
+                msg = None
+            if not msg:
+                logger.warning('process %s of AsyncProcessPool failed; restarting it',
+                               proc.pid)
+                rtask.throw(Exception('process running "%s" failed' %
+                                      getattr(target, '__name__', target)))
+                conn.close()
+                yield self._reap_proc(proc, 0, task=task)
+                conn, proc = self._start_proc()
+                continue
+            try:
+                status, result = _unpack_pool_msg(msg)
+            except Exception:
+                rtask.throw(*sys.exc_info())
+                continue
+            if status:
+                rtask.throw(type(result), result)
+            else:
+                rtask._proceed_(result)
+        # other processes may have (inherited) this socket, so closing it
+        # doesn't stop process; empty message does
+        try:
+            yield conn.send_msg(b'')
+        except Exception:
+            pass
+        conn.close()
+        yield self._reap_proc(proc, 5, task=task)
+
+    def _reap_proc(self, proc, timeout, task=None):
+        # 'join' would block scheduler, so poll for process to exit;
+        # terminate it if it doesn't exit within 'timeout' seconds
+        start = _time()
+        while proc.is_alive():
+            if timeout is not None and (_time() - start) >= timeout:
+                proc.terminate()
+                timeout = None
+            yield task.sleep(0.01)
+
+    def async_task(self, target, *args, **kwargs):
+        """Must be used with 'yield', as
+        'val = yield pool.async_task(target, *args, **kwargs)'.
+
+        Executes 'target(*args, **kwargs)' in a process and returns its
+        result. If it raises exception, that exception is thrown to the task.
+        """
+        if not self._scheduler:
+            self._scheduler = Pycos.scheduler()
+        task = Pycos.cur_task(self._scheduler)
+        # assert isinstance(task, Task)
+        if self._terminating:
+            raise Exception('AsyncProcessPool is terminated')
+        if not self._workers:
+            self._workers = [Task(self._worker) for n in range(self._num_procs)]
+        task._await_()
+        if self._idle:
+            self._idle.pop().send((task, target, args, kwargs))
+        else:
+            self._pending.append((task, target, args, kwargs))
+
+    def terminate(self):
+        """Wait for all scheduled functions to complete and terminate
+        processes. This method should be called from main thread, not from
+        any task.
+        """
+        self._terminating = True
+        for worker in self._workers:
+            worker.send(None)
+        for worker in self._workers:
+            worker.value()
+
+
 class AsyncDBCursor(object):
     """Database cursor proxy for asynchronous processing of executions.
 
@@ -4234,3 +5119,305 @@ class AsyncDBCursor(object):
         yield self._sem.acquire()
         self._thread_pool.async_task(self._exec_task,
                                      partial_func(self._cursor.callproc, proc, args))
+
+
+class AsyncDBConnection(object):
+    """Database connection proxy used with AsyncDBPool.
+
+    Connection is created, used and closed in a dedicated thread (as
+    connections can't be shared in threads), so operations on it are run
+    sequentially in that thread. Connections are obtained with
+    'pool.checkout()'; methods (other than attributes) must be used with
+    'yield'.
+    """
+
+    def __init__(self, pool, connect):
+        self._pool = pool
+        self._connect = connect
+        self._conn = None
+        self._cursor = None
+        # rows fetched by connection's thread in advance for 'fetchmany'
+        self._rows = []
+        self._prefetch = 0
+        self._exc = None
+        self.description = None
+        self.rowcount = -1
+        self._num_jobs = 0
+        self._queue_time = 0
+        self._exec_time = 0
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while 1:
+            item = self._jobs.get(block=True)
+            if item is None:
+                break
+            task, func, args, queued = item
+            start = _time()
+            self._num_jobs += 1
+            self._queue_time += start - queued
+            try:
+                if self._conn is None:
+                    self._conn = self._connect()
+                    self._cursor = self._conn.cursor()
+                result = func(*args)
+            except Exception:
+                self._exec_time += _time() - start
+                if task:
+                    task.throw(*sys.exc_info())
+                else:
+                    logger.warning('database operation failed: %s', traceback.format_exc())
+                continue
+            self._exec_time += _time() - start
+            if task:
+                task._proceed_(result)
+            # while task processes rows, get next batch (unless task has
+            # already submitted another operation)
+            if self._prefetch and self._jobs.empty():
+                try:
+                    self._rows.extend(self._cursor.fetchmany(self._prefetch))
+                except Exception:
+                    self._exc = sys.exc_info()
+            self._prefetch = 0
+        if self._conn is not None:
+            try:
+                self._cursor.close()
+                self._conn.close()
+            except Exception:
+                logger.warning('closing database connection failed: %s', traceback.format_exc())
+            self._conn = self._cursor = None
+
+    def _submit(self, func, *args):
+        task = Pycos.cur_task(self._pool._scheduler)
+        task._await_()
+        self._jobs.put((task, func, args, _time()))
+
+    def _execute(self, query, args, many=False):
+        self._rows = []
+        self._exc = None
+        if many:
+            self._cursor.executemany(query, args)
+        else:
+            self._cursor.execute(query, args)
+        self.description = self._cursor.description
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def _prefetched(self):
+        if self._exc:
+            exc, self._exc = self._exc, None
+            raise exc[1]
+
+    def _fetchmany(self, size, prefetch=True):
+        self._prefetched()
+        rows = self._rows[:size]
+        del self._rows[:size]
+        if len(rows) < size:
+            rows.extend(self._cursor.fetchmany(size - len(rows)))
+        if prefetch and len(rows) == size:
+            self._prefetch = size
+        return rows
+
+    def _fetchone(self):
+        rows = self._fetchmany(1, prefetch=False)
+        return rows[0] if rows else None
+
+    def _fetchall(self):
+        self._prefetched()
+        rows, self._rows = self._rows, []
+        rows.extend(self._cursor.fetchall())
+        return rows
+
+    def _query(self, query, args, many):
+        # used by AsyncDBPool to execute, fetch and commit in one operation
+        try:
+            self._execute(query, args, many)
+            if self.description is None:
+                result = self.rowcount
+            else:
+                result = self._cursor.fetchall()
+            self._conn.commit()
+        except Exception:
+            # don't leave partial updates to be committed by next user
+            self._conn.rollback()
+            raise
+        return result
+
+    def _reset(self):
+        # when connection is checked in, discard any transaction left open
+        # (e.g., after a failed operation) by the task that used it
+        self._rows = []
+        self._exc = None
+        if getattr(self._conn, 'in_transaction', True):
+            self._conn.rollback()
+
+    def _call(self, func, args, kwargs):
+        return func(self._conn, *args, **kwargs)
+
+    def execute(self, query, args=()):
+        """Must be used with 'yield' as 'n = yield conn.execute(query, args)'.
+
+        Returns 'rowcount' of the cursor; 'description' and 'rowcount'
+        attributes are also updated.
+        """
+        self._submit(self._execute, query, args)
+
+    def executemany(self, query, args):
+        """Must be used with 'yield' as 'n = yield conn.executemany(query, args)'.
+        """
+        self._submit(self._execute, query, args, True)
+
+    def fetchone(self):
+        """Must be used with 'yield' as 'row = yield conn.fetchone()'.
+        """
+        self._submit(self._fetchone)
+
+    def fetchmany(self, size=100):
+        """Must be used with 'yield' as 'rows = yield conn.fetchmany(size)'.
+
+        Returns list of (up to) 'size' rows; an empty list indicates all rows
+        have been fetched. After each call, next 'size' rows are fetched by
+        connection's thread while the task processes current rows, so results
+        can be streamed in chunks without waiting for each chunk.
+        """
+        self._submit(self._fetchmany, max(1, size))
+
+    def fetchall(self):
+        """Must be used with 'yield' as 'rows = yield conn.fetchall()'.
+        """
+        self._submit(self._fetchall)
+
+    def commit(self):
+        """Must be used with 'yield' as 'yield conn.commit()'.
+        """
+        self._submit(lambda: self._conn.commit())
+
+    def rollback(self):
+        """Must be used with 'yield' as 'yield conn.rollback()'.
+        """
+        self._submit(lambda: self._conn.rollback())
+
+    def call(self, func, *args, **kwargs):
+        """Must be used with 'yield' as 'val = yield conn.call(func, *args, **kwargs)'.
+
+        Executes 'func(connection, *args, **kwargs)' in connection's thread,
+        where 'connection' is the DB-API connection, and returns its result.
+        """
+        self._submit(self._call, func, args, kwargs)
+
+
+class AsyncDBPool(object):
+    """Pool of database connections for asynchronous processing of queries.
+
+    Each connection is used in its own thread (so it is not shared in
+    threads); tasks check out a connection, use it and check it in, or use
+    'execute' / 'executemany' methods that do this automatically.
+    """
+
+    def __init__(self, connect, num_conns=4):
+        """'connect' must be a function (e.g., partial function) without
+        arguments that returns a DB-API connection, such as
+        'partial_func(sqlite3.connect, "test.db")'. It is called in the thread
+        where that connection is used. 'num_conns' connections (and threads)
+        are used.
+        """
+        self._scheduler = Pycos.scheduler()
+        self._conns = [AsyncDBConnection(self, connect) for i in range(num_conns)]
+        self._idle = collections.deque(self._conns)
+        self._waitlist = _WaitQueue()
+        self._checkouts = 0
+        self._wait_time = 0
+        self._max_wait_time = 0
+
+    def checkout(self, timeout=None):
+        """Must be used with 'yield' as 'conn = yield pool.checkout()'.
+
+        Returns an idle connection (instance of AsyncDBConnection), waiting
+        for one if necessary. If 'timeout' is given and no connection is
+        available within that many seconds, None is returned. The connection
+        must be returned to the pool with 'checkin'.
+        """
+        if not self._scheduler:
+            self._scheduler = Pycos.scheduler()
+        task = Pycos.cur_task(self._scheduler)
+        start = _time()
+        while not self._idle:
+            if timeout is not None:
+                wait = timeout - (_time() - start)
+                if wait <= 0:
+                    raise StopIteration(None)
+            else:
+                wait = None
+            entry = self._waitlist.append(task)
+            if (yield task._await_(wait)) is None:
+                self._waitlist.cancel(entry)
+        conn = self._idle.popleft()
+        wait = _time() - start
+        self._checkouts += 1
+        self._wait_time += wait
+        if wait > self._max_wait_time:
+            self._max_wait_time = wait
+        raise StopIteration(conn)
+
+    def checkin(self, conn):
+        """Returns connection obtained with 'checkout' to the pool. May be
+        used with 'yield'.
+
+        Any transaction not committed with the connection is rolled back.
+        """
+        conn._jobs.put((None, conn._reset, (), _time()))
+        self._idle.append(conn)
+        if self._waitlist:
+            self._waitlist.popleft()._proceed_(True)
+
+    def _query(self, query, args, many):
+        conn = yield self.checkout()
+        try:
+            result = yield conn._submit(conn._query, query, args, many)
+        finally:
+            self.checkin(conn)
+        raise StopIteration(result)
+
+    def execute(self, query, args=()):
+        """Must be used with 'yield' as 'rows = yield pool.execute(query, args)'.
+
+        Checks out a connection, executes query, commits and checks in the
+        connection. Returns list of rows if query returns rows (e.g., SELECT),
+        otherwise 'rowcount' of the cursor.
+        """
+        return self._query(query, args, False)
+
+    def executemany(self, query, args):
+        """Must be used with 'yield' as 'n = yield pool.executemany(query, args)'.
+
+        Similar to 'execute', except that query is executed with each item in
+        'args'.
+        """
+        return self._query(query, args, True)
+
+    def stats(self):
+        """Returns dictionary with (cumulative) metrics of the pool:
+        'checkouts' is number of connections checked out, 'wait_time' and
+        'max_wait_time' are total and maximum time (in seconds) tasks waited
+        for connections, 'waiting' is number of tasks currently waiting,
+        'operations' is number of operations done by connections,
+        'queue_time' and 'exec_time' are total time operations waited in
+        queue and took to execute in connections' threads.
+        """
+        return {'checkouts': self._checkouts, 'wait_time': self._wait_time,
+                'max_wait_time': self._max_wait_time, 'waiting': len(self._waitlist),
+                'operations': sum(conn._num_jobs for conn in self._conns),
+                'queue_time': sum(conn._queue_time for conn in self._conns),
+                'exec_time': sum(conn._exec_time for conn in self._conns)}
+
+    def terminate(self):
+        """Wait for operations to complete, close connections and terminate
+        threads.
+        """
+        for conn in self._conns:
+            conn._jobs.put(None)
+        for conn in self._conns:
+            conn._thread.join()
@@ -2,10 +2,12 @@
 This file is part of pycos; see https://pycos.org for details.
 
 This module provides API for asynchronous file and pipe processing.  They work
-with Windows, Linux, OS X and likely other UNIX variants. Note that regular
-(on-disk) files don't support asynchronous I/O, as they are non-blocking and
-can't be used for polling to signal read/write events - they are always ready to
-be read/written.
+with Windows, Linux, OS X and likely other UNIX variants. Note that under Unix
+variants regular (on-disk) files don't support asynchronous I/O, as they are
+non-blocking and can't be used for polling to signal read/write events - they
+are always ready to be read/written. So I/O on regular files with AsyncFile is
+done in a pool of (IOThreads) threads instead, so tasks are not blocked while
+data is read / written (e.g., from / to slow disks or network file systems).
 
 Under Windows, pipes must be opened with Popen in this module instead of Popen
 in subprocess module.
@@ -18,23 +20,45 @@ import os
 import sys
 import errno
 import platform
+import stat
+import io
+import mmap
+import threading
+import collections
 from functools import partial as partial_func
 
 import pycos
-from pycos import _AsyncPoller, Pycos, Task
+from pycos import _AsyncPoller, Pycos, Task, RecordReader
 
 __author__ = "Giridhar Pemmasani (pgiri@yahoo.com)"
 __copyright__ = "Copyright (c) 2014 Giridhar Pemmasani"
 __license__ = "Apache 2.0"
 __url__ = "https://pycos.org"
 
-__all__ = ['AsyncFile', 'AsyncPipe']
+__all__ = ['AsyncFile', 'AsyncPipe', 'MappedFile']
 # PyPI / pip packaging adjusts assertion below for Python 3.7+
 assert sys.version_info.major == 3 and sys.version_info.minor < 7, \
     ('"%s" is not suitable for Python version %s.%s; use file installed by pip instead' %
      (__file__, sys.version_info.major, sys.version_info.minor))
 
 
+# number of threads used for I/O on regular files
+IOThreads = 4
+# when reading regular files, at least this many bytes are read, so lines / small
+# reads are served from buffer
+FileReadAhead = 65536
+_io_thread_pool = None
+
+
+def _io_pool():
+    """Internal use only.
+    """
+    global _io_thread_pool
+    if not _io_thread_pool:
+        _io_thread_pool = pycos.AsyncThreadPool(IOThreads)
+    return _io_thread_pool
+
+
 if platform.system() == 'Windows':
     __all__ += ['pipe', 'Popen']
 
@@ -236,7 +260,7 @@ if platform.system() == 'Windows':
                 flags = os.O_RDONLY if mode.startswith('r') else 0
                 self._fileno = msvcrt.open_osfhandle(self._handle.Detach(), flags)
 
-            self._buflist = []
+            self._buflist = collections.deque()
             self._read_result = None
             self._write_result = None
             self._timeout = None
@@ -276,7 +300,7 @@ if platform.system() == 'Windows':
                     if rc != winerror.ERROR_OPERATION_ABORTED:
                         if (self._buflist or rc == winerror.ERROR_HANDLE_EOF or
                            rc == winerror.ERROR_BROKEN_PIPE):
-                            buf, self._buflist = b''.join(self._buflist), []
+                            buf, self._buflist = b''.join(self._buflist), collections.deque()
                             self._read_task._proceed_(buf)
                             return
                         self._read_task.throw(IOError(rc, 'ReadFile', str(rc)))
@@ -298,7 +322,7 @@ if platform.system() == 'Windows':
                     except pywintypes.error as exc:
                         rc = exc.winerror
                     if rc and rc != winerror.ERROR_IO_PENDING:
-                        buf, self._buflist = b''.join(self._buflist), []
+                        buf, self._buflist = b''.join(self._buflist), collections.deque()
                         self._overlap.object = self._read_result = None
                         if self._timeout:
                             self._notifier._del_timeout(self)
@@ -307,7 +331,7 @@ if platform.system() == 'Windows':
                     return
 
                 if self._buflist:
-                    buf, self._buflist = b''.join(self._buflist), []
+                    buf, self._buflist = b''.join(self._buflist), collections.deque()
                 if self._timeout:
                     self._notifier._del_timeout(self)
                 self._overlap.object = self._read_result = None
@@ -323,12 +347,12 @@ if platform.system() == 'Windows':
                 full = True
             else:
                 if self._buflist:
-                    buf, self._buflist = b''.join(self._buflist), []
+                    buf, self._buflist = b''.join(self._buflist), collections.deque()
                     if len(buf) > size:
-                        buf, self._buflist = buf[:size], [buf[size:]]
+                        buf, self._buflist = buf[:size], collections.deque([buf[size:]])
                     if (not full) or (len(buf) == size):
                         return buf
-                    self._buflist = [buf]
+                    self._buflist = collections.deque([buf])
                     size -= len(buf)
                 count = size
             self._read_result = win32file.AllocateReadBuffer(count)
@@ -339,7 +363,7 @@ if platform.system() == 'Windows':
                 rc, _ = win32file.ReadFile(self._handle, self._read_result, self._overlap)
             except pywintypes.error as exc:
                 if exc.winerror == winerror.ERROR_BROKEN_PIPE:
-                    buf, self._buflist = b''.join(self._buflist), []
+                    buf, self._buflist = b''.join(self._buflist), collections.deque()
                     self._read_task._proceed_(buf)
                     self._read_result = self._read_task = self._overlap.object = None
                     return
@@ -486,7 +510,7 @@ if platform.system() == 'Windows':
                     self._handle = None
                     self._read_result = self._write_result = None
                     self._read_task = self._write_task = None
-                    self._buflist = []
+                    self._buflist = collections.deque()
 
                 if self._overlap.object:
                     self._overlap.object = _close_
@@ -499,7 +523,7 @@ if platform.system() == 'Windows':
             """
             if self._read_task:
                 if self._buflist:
-                    buf, self._buflist = b''.join(self._buflist), []
+                    buf, self._buflist = b''.join(self._buflist), collections.deque()
                     self._read_task._proceed_(buf)
                     self._read_task = None
                 else:
@@ -515,7 +539,9 @@ else:
         Unix variants.
 
         Tested with AsyncPipe and sockets under Linux and OS X; it should
-        work on other Unix variants.
+        work on other Unix variants. Regular (on-disk) files are read / written
+        at current position (see 'seek' and 'tell') with pread / pwrite in
+        (IOThreads) threads; 'timeout' is ignored for them.
         """
 
         def __init__(self, fd):
@@ -526,7 +552,7 @@ else:
                 self._fd = fd
                 self._fileno = fd.fileno()
             elif isinstance(fd, int):
-                self._fd, self._fileno = None, self._fd
+                self._fd, self._fileno = None, fd
             else:
                 raise ValueError('invalid file descriptor')
             self._pycos = Pycos.scheduler()
@@ -541,10 +567,20 @@ else:
             self._read_fn = None
             self._write_task = None
             self._write_fn = None
-            self._buflist = []
+            self._buflist = collections.deque()
             self._event = None
             flags = fcntl.fcntl(self._fileno, fcntl.F_GETFL)
-            fcntl.fcntl(self._fileno, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self._regular = stat.S_ISREG(os.fstat(self._fileno).st_mode)
+            if self._regular:
+                # '_offset' is where next read from disk starts; data read ahead
+                # of current position is in '_buflist'
+                self._offset = os.lseek(self._fileno, 0, os.SEEK_CUR)
+                self._append = bool(flags & os.O_APPEND)
+                self._io_lock = threading.Lock()
+                self._fio = None
+                self.readahead = FileReadAhead
+            else:
+                fcntl.fcntl(self._fileno, fcntl.F_SETFL, flags | os.O_NONBLOCK)
 
         def read(self, size=0, full=False, timeout=None):
             """Read at most 'size' bytes from file; if 'size' <= 0,
@@ -594,7 +630,7 @@ else:
                         return
 
                 if self._buflist:
-                    buf, self._buflist = b''.join(self._buflist), []
+                    buf, self._buflist = b''.join(self._buflist), collections.deque()
                 self._notifier.clear(self, _AsyncPoller._Read)
                 self._read_task._proceed_(buf)
                 self._read_task = self._read_fn = None
@@ -608,13 +644,15 @@ else:
                 size = 0
                 full = True
             elif self._buflist:
-                buf, self._buflist = b''.join(self._buflist), []
+                buf, self._buflist = b''.join(self._buflist), collections.deque()
                 if len(buf) > size:
-                    buf, self._buflist = buf[:size], [buf[size:]]
+                    buf, self._buflist = buf[:size], collections.deque([buf[size:]])
                 if (not full) or (len(buf) == size):
                     return buf
-                self._buflist = [buf]
+                self._buflist = collections.deque([buf])
                 size -= len(buf)
+            if self._regular:
+                return self._read_file(size)
             self._timeout = timeout
             self._read_task = Pycos.cur_task(self._pycos)
             self._read_task._await_()
@@ -666,6 +704,8 @@ else:
                 self._notifier = self._pycos._notifier
                 if hasattr(self._fd, '_fileno'):
                     self._notifier.unregister(self._fd)
+            if self._regular:
+                return self._write_file(buf)
             if full:
                 view = memoryview(buf)
             else:
@@ -676,17 +716,126 @@ else:
             self._write_fn = partial_func(_write, view, 0)
             self._notifier.add(self, _AsyncPoller._Write)
 
+        def seek(self, offset, whence=os.SEEK_SET):
+            """Similar to 'seek' of file descriptor; works only for
+            regular files.
+            """
+            if not self._regular:
+                raise IOError('seek is supported only for regular files')
+            if whence == os.SEEK_CUR:
+                offset += self.tell()
+            elif whence == os.SEEK_END:
+                offset += os.fstat(self._fileno).st_size
+            else:
+                assert whence == os.SEEK_SET
+            self._buflist = collections.deque()
+            self._offset = offset
+
+        def tell(self):
+            """Similar to 'tell' of file descriptor; works only for
+            regular files.
+            """
+            if not self._regular:
+                raise IOError('tell is supported only for regular files')
+            return self._offset - sum(len(buf) for buf in self._buflist)
+
+        def fileno(self):
+            """Similar to 'fileno' of file descriptor.
+            """
+            return self._fileno
+
+        def _read_file(self, size):
+            """Internal use only.
+            """
+            if size > 0:
+                count = max(size, self.readahead)
+            else:
+                count = 0
+            data = yield _io_pool().async_task(self._pread, count, self._offset)
+            self._offset += len(data)
+            self._buflist.append(data)
+            buf, self._buflist = b''.join(self._buflist), collections.deque()
+            if size > 0:
+                # include data buffered before
+                size += len(buf) - len(data)
+                if len(buf) > size:
+                    buf, self._buflist = buf[:size], collections.deque([buf[size:]])
+            raise StopIteration(buf)
+
+        def _write_file(self, buf):
+            """Internal use only.
+            """
+            # data read ahead is discarded and written at current position
+            offset = self.tell()
+            self._buflist = collections.deque()
+            self._offset = offset
+            n, self._offset = yield _io_pool().async_task(self._pwrite, buf, offset)
+            raise StopIteration(n)
+
+        def _pread(self, count, offset):
+            """Internal use only.
+            """
+            # runs in I/O thread; reads 'count' bytes at 'offset' (or up to EOF
+            # if 'count' is 0)
+            buflist = []
+            while 1:
+                n = count or 1048576
+                buf = os.pread(self._fileno, n, offset)
+                if not buf:
+                    break
+                buflist.append(buf)
+                offset += len(buf)
+                if count:
+                    count -= len(buf)
+                    if count <= 0:
+                        break
+            return b''.join(buflist)
+
+        def _pwrite(self, buf, offset):
+            """Internal use only.
+            """
+            # runs in I/O thread; returns number of bytes written and offset
+            # after them
+            view = memoryview(buf)
+            written = 0
+            try:
+                while written < len(view):
+                    written += os.pwrite(self._fileno, view[written:], offset + written)
+            finally:
+                view.release()
+            if self._append:
+                offset = os.fstat(self._fileno).st_size - written
+            return (written, offset + written)
+
+        def _preadinto(self, view, offset):
+            """Internal use only.
+            """
+            # runs in I/O thread; reads into memoryview 'view' at 'offset'
+            with self._io_lock:
+                if not self._fio:
+                    self._fio = io.FileIO(self._fileno, closefd=False)
+                os.lseek(self._fileno, offset, os.SEEK_SET)
+                n = 0
+                while n < len(view):
+                    m = self._fio.readinto(view[n:])
+                    if not m:
+                        break
+                    n += m
+            return n
+
         def close(self):
             """Close file descriptor.
             """
             if self._fileno:
-                self._notifier.unregister(self)
+                if not self._regular:
+                    self._notifier.unregister(self)
                 if self._fd:
                     self._fd.close()
                 self._fd = self._fileno = None
+                self._fio = None
                 self._read_task = self._write_task = None
                 self._read_fn = self._write_fn = None
-                self._buflist = []
+                self._buflist = collections.deque()
 
         def _eof(self):
             """Internal use only.
@@ -699,7 +848,7 @@ else:
             """
             if self._read_task:
                 if self._read_fn and self._buflist:
-                    buf, self._buflist = b''.join(self._buflist), []
+                    buf, self._buflist = b''.join(self._buflist), collections.deque()
                     self._notifier.clear(self, _AsyncPoller._Read)
                     self._read_task._proceed_(buf)
                 else:
@@ -719,25 +868,26 @@ else:
 class AsyncFile(_AsyncFile):
     """See _AsyncFile above.
     """
-    def readline(self, size=0, sizehint=100, timeout=None):
+    def readline(self, size=0, sizehint=8192, timeout=None):
         """Read a line up to 'size' and return. 'size' and 'timeout'
-        are as per 'read' method above. 'sizehint' indicates
-        approximate number of bytes expected in a line. Too big/small
-        value affects performance, otherwise has no effect.
+        are as per 'read' method above. 'sizehint' is number of bytes
+        read at a time; data read after the line is buffered for next
+        read. To read many lines, 'iter_lines' is more efficient.
 
         Must be used with 'yield' as 'line = yield fd.readline()'
         """
         if not size or size < 0:
             size = 0
-        if self._buflist:
-            buf, self._buflist = b''.join(self._buflist), []
-        else:
-            buf = yield self.read(size=sizehint, timeout=timeout)
-            if not buf:
-                raise StopIteration(buf)
-
+        # only new data is searched for newline and data after the line is
+        # split into lines in '_buflist' so it is not copied in next calls
         buflist = []
         while 1:
+            if self._buflist:
+                buf = self._buflist.popleft()
+            else:
+                buf = yield self.read(size=sizehint, timeout=timeout)
+                if not buf:
+                    raise StopIteration(b''.join(buflist))
             if size > 0:
                 pos = buf.find(b'\n', 0, size)
                 size -= len(buf)
@@ -746,17 +896,233 @@ class AsyncFile(_AsyncFile):
             else:
                 pos = buf.find(b'\n')
             if pos >= 0:
-                if buflist:
-                    buf = b''.join(buflist) + buf
-                    pos += sum(len(b) for b in buflist)
+                pos += 1
                 if len(buf) > pos:
-                    buf, self._buflist = buf[:pos+1], [buf[pos+1:]]
+                    lines = []
+                    line, start, end = buf[:pos], pos, len(buf)
+                    while start < end:
+                        pos = buf.find(b'\n', start) + 1
+                        if pos <= 0:
+                            pos = end
+                        lines.append(buf[start:pos])
+                        start = pos
+                    self._buflist.extendleft(reversed(lines))
+                    buf = line
+                if buflist:
+                    buflist.append(buf)
+                    buf = b''.join(buflist)
                 raise StopIteration(buf)
             buflist.append(buf)
-            buf = yield self.read(size=sizehint, timeout=timeout)
-            if not buf:
-                buf = b''.join(buflist)
-                raise StopIteration(buf)
+
+    def iter_lines(self, delim=b'\n', bufsize=65536):
+        """Return RecordReader to get lines (or records separated by
+        'delim') efficiently, e.g.,
+
+            lines = fd.iter_lines()
+            while True:
+                records = yield lines.records()
+                if not records:
+                    break
+                for line in records:
+                    ...
+        """
+        return RecordReader(self.read, delim=delim, bufsize=bufsize)
+
+    def mmap(self, offset=0, length=0):
+        """Map (part of) file in memory (for reading) and return MappedFile
+        instance. See MappedFile for details.
+        """
+        return MappedFile(self.fileno(), offset=offset, length=length)
+
+    def readinto(self, buf, timeout=None):
+        """Read data into 'buf' (e.g., bytearray or memoryview), which is
+        useful to read large amount of data into preallocated buffers. Returns
+        number of bytes read, which is less than length of 'buf' only if EOF
+        is encountered (or timeout expires for other than regular files).
+
+        Must be used with 'yield' as 'n = yield fd.readinto(buf)'
+        """
+        view = memoryview(buf)
+        n = 0
+        if self._buflist:
+            data, self._buflist = b''.join(self._buflist), collections.deque()
+            n = min(len(data), len(view))
+            view[:n] = data[:n]
+            if len(data) > n:
+                self._buflist = collections.deque([data[n:]])
+        if n < len(view):
+            if getattr(self, '_regular', False):
+                offset = self._offset
+                m = yield _io_pool().async_task(self._preadinto, view[n:], offset)
+                self._offset = offset + m
+                n += m
+            else:
+                data = yield self.read(len(view) - n, full=True, timeout=timeout)
+                view[n:n + len(data)] = data
+                n += len(data)
+        raise StopIteration(n)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, trace):
+        self.close()
+        return True
+
+
+class MappedFile(object):
+    """Read-only memory mapped file. Data is not copied from mapping;
+    'read', 'readline', 'readlines' and slicing return memoryview objects
+    that refer to mapped memory (use 'bytes' on them to copy). Pages of file
+    are read from disk as they are accessed, which blocks scheduler if they are
+    not in page cache, so with 'readlines' (if 'prefetch' is not 0) each
+    'prefetch' bytes of file are paged in with I/O thread (with 'madvise' if
+    available, or by touching pages) before lines in them are scanned.
+    """
+
+    def __init__(self, fd, offset=0, length=0, prefetch=(16 * 1024 * 1024)):
+        """'fd' is path of file, file object or file number. 'offset' and
+        'length' are as per 'mmap.mmap': 'offset' must be multiple of
+        mmap.ALLOCATIONGRANULARITY and if 'length' is 0, file from 'offset'
+        is mapped. 'prefetch' is size of data paged in by 'readlines'.
+        """
+        if isinstance(fd, str):
+            fileno = os.open(fd, os.O_RDONLY)
+        elif hasattr(fd, 'fileno'):
+            fileno = fd.fileno()
+        elif isinstance(fd, int):
+            fileno = fd
+        else:
+            raise ValueError('invalid file descriptor')
+        try:
+            self._mmap = mmap.mmap(fileno, length, access=mmap.ACCESS_READ, offset=offset)
+        finally:
+            if isinstance(fd, str):
+                os.close(fileno)
+        self._view = memoryview(self._mmap)
+        self._pos = 0
+        self._prefetched = 0
+        self.prefetch = prefetch
+
+    def __len__(self):
+        return len(self._mmap)
+
+    def __getitem__(self, key):
+        return self._view[key]
+
+    def _slice(self, start, end):
+        return self._view[start:end]
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Similar to 'seek' of file object.
+        """
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self._mmap)
+        else:
+            assert whence == os.SEEK_SET
+        self._pos = min(max(offset, 0), len(self._mmap))
+
+    def tell(self):
+        """Similar to 'tell' of file object.
+        """
+        return self._pos
+
+    def read(self, size=-1):
+        """Return (at most) 'size' bytes (or up to end of file if 'size' is
+        negative) from current position. Unlike AsyncFile's 'read', this
+        method should be used without 'yield'.
+        """
+        start = self._pos
+        if size < 0:
+            self._pos = len(self._mmap)
+        else:
+            self._pos = min(start + size, len(self._mmap))
+        return self._slice(start, self._pos)
+
+    def readline(self, delim=b'\n'):
+        """Return line (including 'delim') from current position; if end
+        of file is reached, returned data is empty. Unlike AsyncFile's
+        'readline', this method should be used without 'yield'.
+        """
+        start = self._pos
+        end = self._mmap.find(delim, start)
+        if end < 0:
+            end = len(self._mmap)
+        else:
+            end += len(delim)
+        self._pos = end
+        return self._slice(start, end)
+
+    def readlines(self, count=1000, delim=b'\n'):
+        """Return list of (at most 'count') lines from current position; list
+        is empty if end of file is reached. As this yields to scheduler (to
+        run other tasks) after each call, scanning large files with (large
+        enough) 'count' doesn't stall other tasks, e.g.,
+
+            while True:
+                lines = yield mapped.readlines(count=10000)
+                if not lines:
+                    break
+                for line in lines:
+                    ...
+
+        Must be used with 'yield' as 'lines = yield mapped.readlines()'.
+        """
+        size = len(self._mmap)
+        pos = self._pos
+        if self.prefetch and self._prefetched <= pos < size:
+            yield self.advise(pos, self.prefetch)
+        find = self._mmap.find
+        lines = []
+        while pos < size and len(lines) < count:
+            end = find(delim, pos)
+            if end < 0:
+                end = size
+            else:
+                end += len(delim)
+            lines.append(self._slice(pos, end))
+            pos = end
+        self._pos = pos
+        raise StopIteration(lines)
+
+    def advise(self, offset, length):
+        """Page in 'length' bytes from 'offset' with I/O thread, so later
+        access to that data doesn't block scheduler.
+
+        Must be used with 'yield' as 'yield mapped.advise(offset, length)'.
+        """
+        end = min(offset + length, len(self._mmap))
+        offset -= offset % mmap.PAGESIZE
+        if offset < end:
+            yield _io_pool().async_task(self._page_in, offset, end)
+        self._prefetched = max(self._prefetched, end)
+
+    def _page_in(self, start, end):
+        """Internal use only.
+        """
+        # runs in I/O thread
+        if hasattr(self._mmap, 'madvise'):
+            self._mmap.madvise(mmap.MADV_WILLNEED, start, end - start)
+        else:
+            mapped = self._mmap
+            for i in range(start, end, mmap.PAGESIZE):
+                mapped[i]
+
+    def close(self):
+        """Unmap file.
+        """
+        if self._mmap:
+            self._view.release()
+            self._view = None
+            try:
+                self._mmap.close()
+            except BufferError:
+                # slices are still in use; mapping is closed when they are
+                # garbage collected
+                pass
+            self._mmap = None
 
     def __enter__(self):
         return self
@@ -833,13 +1199,19 @@ class AsyncPipe(object):
         result = yield self.stdout.read(size=size, timeout=timeout)
         raise StopIteration(result)
 
-    def readline(self, size=0, sizehint=100, timeout=None):
+    def readline(self, size=0, sizehint=8192, timeout=None):
         """Read a line from stdout of pipe. See 'readline' method of
         AsyncFile for details.
         """
         result = yield self.stdout.readline(size=size, sizehint=sizehint, timeout=timeout)
         raise StopIteration(result)
 
+    def iter_lines(self, delim=b'\n', bufsize=65536):
+        """Return RecordReader to get lines from stdout of pipe. See
+        'iter_lines' method of AsyncFile for details.
+        """
+        return self.stdout.iter_lines(delim=delim, bufsize=bufsize)
+
     def read_stderr(self, size=0, timeout=None):
         """Read data from stderr of pipe. See 'read' method of
         AsyncFile for details.
@@ -847,7 +1219,7 @@ class AsyncPipe(object):
         result = yield self.stderr.read(size=size, timeout=timeout)
         raise StopIteration(result)
 
-    def readline_stderr(self, size=0, sizehint=100, timeout=None):
+    def readline_stderr(self, size=0, sizehint=8192, timeout=None):
         """Read a line from stderr of pipe. See 'readline' method of
         AsyncFile for details.
         """
@@ -868,10 +1240,9 @@ class AsyncPipe(object):
                 if n != len(input):
                     raise IOError('write failed')
             else:
-                # TODO: how to know if 'input' is file object for
-                # on-disk file?
                 if hasattr(input, 'seek') and hasattr(input, 'fileno'):
-                    read_func = partial_func(os.read, input.fileno())
+                    # on-disk file; read it in I/O thread
+                    read_func = partial_func(_io_pool().async_task, os.read, input.fileno())
                 else:
                     read_func = input.read
                 while 1:
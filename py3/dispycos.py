@@ -14,6 +14,8 @@ See 'dispycos_client*.py' files in 'examples' directory for various use cases.
 
 import os
 import sys
+import collections
+import math
 import inspect
 import hashlib
 import time
@@ -23,6 +25,10 @@ import functools
 import re
 import copy
 import stat
+import signal
+import subprocess
+import tempfile
+import traceback
 
 import pycos
 import pycos.netpycos
@@ -35,7 +41,10 @@ __license__ = "Apache 2.0"
 __url__ = "https://pycos.org"
 
 __all__ = ['Scheduler', 'Client', 'Computation', 'DispycosStatus', 'DispycosTaskInfo',
-           'DispycosNodeInfo', 'DispycosNodeAvailInfo', 'DispycosNodeAllocate']
+           'DispycosTaskResources', 'DispycosNodeInfo', 'DispycosNodeAvailInfo',
+           'DispycosNodeAllocate', 'DispycosJobOptions', 'DispycosStream',
+           'DispycosResultCache', 'DispycosClusterLoad', 'DispycosAutoscaler',
+           'DispycosLocalAutoscaler']
 
 MsgTimeout = pycos.config.MsgTimeout
 MinPulseInterval = pycos.config.MinPulseInterval
@@ -69,17 +78,37 @@ class DispycosTaskInfo(object):
         self.start_time = time.time()
 
 
+class DispycosTaskResources(object):
+    """Resources used by a task at dispycos server are given with this class as 'resources'
+    attribute of MonitorStatus message sent to client's 'status_task' when task finishes.
+    'wall_time' and 'cpu_time' are in seconds, 'rss_growth' is increase in peak resident memory
+    of server process in bytes (None if not available) and 'sent' / 'received' are bytes of
+    messages sent / received by server. These are measured for server process while task is
+    running, so they include usage by other tasks running at that server at the same time.
+    """
+    def __init__(self, wall_time, cpu_time, rss_growth, sent, received):
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.rss_growth = rss_growth
+        self.sent = sent
+        self.received = received
+
+
 class DispycosNodeAvailInfo(object):
     """Node availability status is indicated with this class.  'cpu' is
     available CPU in percent in the range 0 to 100. 0 indicates node is busy
     executing tasks on all CPUs and 100 indicates node is not busy at all.
+    'servers', if not None, is a dictionary with location of each server at
+    the node as key and tuple (CPU used in percent, resident memory in bytes) by
+    that server process as value.
     """
-    def __init__(self, location, cpu, memory, disk, swap):
+    def __init__(self, location, cpu, memory, disk, swap, servers=None):
         self.location = location
         self.cpu = cpu
         self.memory = memory
         self.disk = disk
         self.swap = swap
+        self.servers = servers
 
 
 class DispycosNodeInfo(object):
@@ -161,6 +190,584 @@ class DispycosNodeAllocate(object):
         return state
 
 
+class DispycosJobOptions(object):
+    """Options for a job can be given to Client's 'rtask' methods with keyword
+    argument 'job_options' as DispycosJobOptions instance, e.g.,
+    'rtask = yield client.rtask(compute, n, job_options=DispycosJobOptions(idempotent=True))'.
+    This keyword argument is not passed to the generator function.
+
+    'idempotent', if True, indicates that the job can be run more than once
+    without side effects, so scheduler may run a duplicate of the job if it takes
+    much longer than other jobs with same generator function (see
+    'straggler_factor' of Client).
+
+    'data', if given, must be a key or list of keys (e.g., names of files or
+    data sets) needed by the job. Servers hold a key if they reported it with
+    'dispycos_data_add' (this and 'dispycos_data_remove' are available to
+    'server_setup' and jobs at servers), or if a job that declared it finished
+    at that server earlier. The
+    scheduler runs the job at a server that holds most of these keys, waiting
+    for up to 'locality_delay' seconds for such a server to become available,
+    before using any other server.
+
+    'memory' and 'disk', if given, are memory and disk space (in bytes) needed
+    by the job. The job is scheduled only at a node whose available memory and
+    disk (as reported by node periodically, less the resources requested by
+    jobs running at that node that they haven't used yet) are sufficient; among
+    such nodes, the node with least resources left after running the job is
+    used, so nodes with more resources are available to jobs that need more.
+    These are ignored for nodes that don't report available resources
+    ('psutil' module is not installed on them).
+
+    'cpus' is number of CPUs (i.e., servers at a node) reserved for a CPU bound
+    job that uses more than one CPU (e.g., with threads or multiprocessing). The
+    job runs at one of the servers, but none of the reserved servers at that
+    node is used for other jobs until the job finishes.
+
+    'cache', if False, indicates that the result of the job should not be taken
+    from or saved in 'result_cache' of Client (e.g., if the job has side effects
+    or its result depends on more than its arguments).
+
+    'files', if given, must be a path or list of paths (at client) of input files
+    the job's result depends on (e.g., files the job reads from a shared file
+    system). Contents of these files are included in the key of the result in
+    'result_cache', so a cached result is not used after any of them changes.
+    """
+
+    def __init__(self, idempotent=False, data=None, locality_delay=5, memory=None, disk=None,
+                 cpus=1, cache=True, files=None):
+        self.idempotent = bool(idempotent)
+        if isinstance(data, str):
+            data = [data]
+        self.data = set(data) if data else None
+        self.locality_delay = locality_delay
+        self.memory = memory
+        self.disk = disk
+        self.cpus = cpus
+        self.cache = bool(cache)
+        if isinstance(files, str):
+            files = [files]
+        self.files = sorted(set(os.path.abspath(path) for path in files)) if files else None
+
+
+class DispycosStream(object):
+    """Stream of results from a remote task to client. A stream is created at client, e.g., as
+    'stream = DispycosStream()', and passed as an argument to the task with Client's 'rtask'
+    methods, e.g., 'rtask = yield client.rtask(compute, n, stream)'. The task at server sends
+    partial results with 'yield stream.put(item)' and client consumes them with
+    'item = yield stream.get()'; 'get' returns None when the stream ends, so None can't be
+    streamed. The stream ends when the task finishes (or when the task closes it with
+    'yield stream.close()'). A stream may be passed to more than one task; then it ends when
+    each of the tasks started with it has finished or closed it, and each task gets credits
+    for its own items consumed.
+
+    At most 'window' items are buffered at client; the task waits in 'put' until client consumes
+    items, so results need not be buffered in memory at server or client. 'put' returns 0 if the
+    item is sent and -1 if client is not reachable or has closed the stream (with
+    'yield stream.close()'), in which case the task should stop producing results.
+
+    Streams should not be used with jobs that may be run more than once (with 'job_retries' of
+    Client or with 'idempotent' job option), as each run sends its results.
+    """
+
+    def __init__(self, window=16):
+        if not isinstance(window, int) or window < 1:
+            raise ValueError('invalid window for DispycosStream: %s' % window)
+        self._window = window
+        # items with their producers (credit tasks at remote tasks)
+        self._items = collections.deque()
+        self._avail = pycos.Event()
+        self._closed = False
+        # number of items consumed from each producer since last credit sent to it
+        self._producers = {}
+        self._producer = None
+        # tasks started with this stream and those that closed it
+        self._rtasks = set()
+        self._ended = set()
+        self._consumer = SysTask(self._consumer_proc)
+
+    def __getstate__(self):
+        return {'_window': self._window, '_consumer': self._consumer}
+
+    def __setstate__(self, state):
+        for attr, value in state.items():
+            setattr(self, attr, value)
+        self._closed = False
+        self._credits = self._window
+        self._credit_avail = None
+        self._producer = None
+
+    def put(self, item):
+        """Must be used with 'yield' as 'yield stream.put(item)' by remote task.
+        """
+        if item is None:
+            logger.warning('None can\'t be sent with DispycosStream')
+            raise StopIteration(-1)
+        if self._closed:
+            raise StopIteration(-1)
+        if not self._producer:
+            self._credit_avail = pycos.Event()
+            self._producer = SysTask(self._producer_proc)
+        while self._credits <= 0:
+            self._credit_avail.clear()
+            yield self._credit_avail.wait()
+            if self._closed:
+                raise StopIteration(-1)
+        self._credits -= 1
+        if (yield self._consumer.deliver(('item', (item, self._producer)),
+                                         timeout=MsgTimeout)) != 1:
+            # if client closed stream, it also stops credit task
+            self._closed = True
+            raise StopIteration(-1)
+        raise StopIteration(0)
+
+    def get(self):
+        """Must be used with 'yield' as 'item = yield stream.get()' by client. Returns None when
+        the stream ends.
+        """
+        while not self._items:
+            if self._closed:
+                raise StopIteration(None)
+            self._avail.clear()
+            yield self._avail.wait()
+        item, producer = self._items.popleft()
+        consumed = self._producers.get(producer, None)
+        if consumed is not None and not self._closed:
+            consumed += 1
+            if consumed >= ((self._window + 1) // 2):
+                producer.send(consumed)
+                consumed = 0
+            self._producers[producer] = consumed
+        raise StopIteration(item)
+
+    def close(self):
+        """Must be used with 'yield' as 'yield stream.close()'. If called by remote task,
+        client gets items queued and then None. If called by client, queued items are discarded
+        and remote task's 'put' returns -1.
+        """
+        if self._closed:
+            raise StopIteration(0)
+        self._closed = True
+        if self._consumer._location:
+            # at remote task
+            if self._producer:
+                self._producer.terminate()
+            msg = ('end', (self._producer, pycos.Pycos.cur_task()))
+            raise StopIteration((yield self._consumer.deliver(msg, timeout=MsgTimeout)))
+        self._items.clear()
+        self._avail.set()
+        for producer in self._producers:
+            producer.send(None)
+        self._producers.clear()
+        self._consumer.terminate()
+        self._consumer = None
+        raise StopIteration(0)
+
+    def _start(self, rtask):
+        # called by client when a task using this stream is created
+        self._rtasks.add(rtask)
+
+    def _end(self, rtask):
+        # called by client when a task using this stream is done
+        if self._consumer:
+            self._consumer.send(('done', rtask))
+
+    def _consumer_proc(self, task=None):
+        task.set_daemon()
+        while 1:
+            msg = yield task.receive()
+            if not isinstance(msg, tuple) or len(msg) != 2:
+                logger.warning('invalid stream message ignored: %s', type(msg))
+                continue
+            if msg[0] == 'item':
+                self._items.append(msg[1])
+                self._producers.setdefault(msg[1][1], 0)
+            elif msg[0] == 'end' or msg[0] == 'done':
+                if msg[0] == 'end':
+                    # task closed stream and its credit task
+                    self._producers.pop(msg[1][0], None)
+                    self._ended.add(msg[1][1])
+                else:
+                    self._rtasks.discard(msg[1])
+                    self._ended.discard(msg[1])
+                if not (self._rtasks - self._ended):
+                    self._closed = True
+                    self._avail.set()
+                    for producer in self._producers:
+                        producer.send(None)
+                    self._producers.clear()
+                    break
+            self._avail.set()
+        self._consumer = None
+
+    def _producer_proc(self, task=None):
+        # receives credits for number of items client consumed
+        task.set_daemon()
+        while 1:
+            credits = yield task.receive()
+            if not isinstance(credits, int):
+                self._closed = True
+                self._credit_avail.set()
+                break
+            self._credits += credits
+            self._credit_avail.set()
+
+
+def _file_digest(path):
+    # SHA1 digest of contents of file 'path'
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fd:
+        while 1:
+            data = fd.read(1024000)
+            if not data:
+                break
+            digest.update(data)
+    return digest.digest()
+
+
+def _canonical_digest(obj):
+    # SHA1 digest of 'obj' that doesn't depend on order of items in dicts and sets (which
+    # serialization preserves), so equal job arguments give same key in result cache
+    if isinstance(obj, dict):
+        tag = b'dict'
+        items = sorted(_canonical_digest(key) + _canonical_digest(value)
+                       for key, value in obj.items())
+    elif isinstance(obj, (set, frozenset)):
+        tag = b'set'
+        items = sorted(_canonical_digest(item) for item in obj)
+    elif isinstance(obj, (list, tuple)):
+        tag = type(obj).__name__.encode()
+        items = [_canonical_digest(item) for item in obj]
+    else:
+        return hashlib.sha1(pycos.serialize(obj)).digest()
+    digest = hashlib.sha1(tag)
+    for item in items:
+        digest.update(item)
+    return digest.digest()
+
+
+class DispycosResultCache(object):
+    """Results of jobs can be saved in a cache on disk with this class given as 'result_cache'
+    to Client, so identical jobs (e.g., resubmitted after client restarts) are not run again.
+    Jobs are identified by name and code of generator function, code and files sent with
+    Client (components), arguments and input files declared with 'files' job option (see
+    DispycosJobOptions). Arguments are compared by value: order of items in dictionaries and
+    sets doesn't matter, but other objects in arguments must serialize the same way each time
+    they are equal.
+
+    'path' is directory where results are saved. If 'max_size' (in bytes) or 'max_entries' is
+    given, least recently used results are removed when the cache exceeds that limit. If 'ttl'
+    is given, results older than 'ttl' seconds are not used.
+    """
+
+    def __init__(self, path, max_size=None, max_entries=None, ttl=None):
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # results in least recently used order
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        entries = []
+        for name in os.listdir(path):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat_buf = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            entries.append((stat_buf.st_mtime, name, stat_buf.st_size))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self._size += size
+
+    def lookup(self, key):
+        """Returns tuple (True, result) if result for job with 'key' is in cache or (False, None)
+        otherwise.
+        """
+        if key not in self._entries:
+            return (False, None)
+        path = os.path.join(self.path, key)
+        try:
+            with open(path, 'rb') as fd:
+                created, value = pycos.deserialize(fd.read())
+        except Exception:
+            self.remove(key)
+            return (False, None)
+        if self.ttl and (time.time() - created) > self.ttl:
+            self.remove(key)
+            return (False, None)
+        self._entries[key] = self._entries.pop(key)
+        try:
+            # modification time orders results when cache is loaded again
+            os.utime(path, None)
+        except OSError:
+            pass
+        return (True, value)
+
+    def store(self, key, value):
+        """Saves 'value' as result of job with 'key'.
+        """
+        try:
+            value = pycos.serialize((time.time(), value))
+        except Exception:
+            logger.warning('result of %s can\'t be cached', key)
+            return -1
+        path = os.path.join(self.path, key)
+        try:
+            with open(path + '.tmp', 'wb') as fd:
+                fd.write(value)
+            if os.path.isfile(path):
+                os.remove(path)
+            os.rename(path + '.tmp', path)
+        except Exception:
+            logger.warning('saving result in "%s" failed', path)
+            return -1
+        self._size -= self._entries.pop(key, 0)
+        self._entries[key] = len(value)
+        self._size += len(value)
+        while self._entries and ((self.max_entries and len(self._entries) > self.max_entries) or
+                                 (self.max_size and self._size > self.max_size)):
+            self.remove(next(iter(self._entries)))
+        return 0
+
+    def remove(self, key):
+        """Removes result of job with 'key' from cache.
+        """
+        self._size -= self._entries.pop(key, 0)
+        try:
+            os.remove(os.path.join(self.path, key))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Removes all results from cache.
+        """
+        for key in list(self._entries):
+            self.remove(key)
+
+
+class DispycosClusterLoad(object):
+    """Load on nodes used by a client, as returned by Client's 'cluster_load'
+    method. 'waiting' is number of jobs waiting for a server, 'wait_time' is
+    number of seconds the oldest of them has been waiting and 'nodes' is a
+    dictionary with IP address of each node as key and tuple (number of CPUs,
+    number of CPUs used, number of seconds node has been idle, list of
+    locations of servers) as value.
+    """
+
+    def __init__(self, waiting, wait_time, nodes):
+        self.waiting = waiting
+        self.wait_time = wait_time
+        self.nodes = nodes
+
+
+class DispycosAutoscaler(object):
+    """Nodes can be added to / removed from cluster as load changes with an
+    instance of this class (or subclass that implements 'provision' and
+    'decommission') given as 'autoscaler' to Client.
+
+    Every 'interval' seconds, the client gets load from scheduler. If at least
+    'queue_depth' jobs are waiting for servers, or a job has been waiting for
+    'wait_time' seconds, 'provision' is called to start nodes (while fewer than
+    'max_nodes' nodes started by it are running). If a node started by
+    'provision' is idle (i.e., no jobs running on it) for 'idle_time' seconds
+    and more than 'min_nodes' such nodes are running, its servers are closed
+    (after jobs running on them, if any, finish), the node is closed and then
+    'decommission' is called with IP address of that node. If a node started
+    is not used by the client within 'startup_time' seconds, it is
+    decommissioned as well. When client is closed, all nodes started are
+    decommissioned.
+    """
+
+    def __init__(self, min_nodes=0, max_nodes=1, queue_depth=4, wait_time=MinPulseInterval,
+                 idle_time=(3 * MaxPulseInterval), interval=MinPulseInterval, startup_time=60):
+        self.min_nodes = min_nodes
+        self.max_nodes = max_nodes
+        self.queue_depth = queue_depth
+        self.wait_time = wait_time
+        self.idle_time = idle_time
+        self.interval = interval
+        self.startup_time = startup_time
+        # IP addresses of nodes started and of those being drained
+        self._nodes = set()
+        self._draining = set()
+        self._task = None
+
+    def provision(self, count):
+        """Called to start 'count' nodes. Should return list of host names / IP
+        addresses of nodes started. This method may be a generator function, in
+        which case it is executed as a task.
+        """
+        return []
+
+    def decommission(self, node):
+        """Called with IP address of a node (started by 'provision') after it
+        is closed, to stop it. This method may be a generator function, in
+        which case it is executed as a task.
+        """
+        pass
+
+    def _call(self, method, *args):
+        try:
+            ret = method(*args)
+            if inspect.isgenerator(ret):
+                ret = yield ret
+        except Exception:
+            logger.warning('autoscaler "%s" failed: %s', method.__name__, traceback.format_exc())
+            ret = None
+        raise StopIteration(ret)
+
+    def _drain(self, client, addr, task=None):
+        # close servers gracefully, so running jobs finish, before closing node
+        self._draining.add(addr)
+        servers = None
+        while client._auth:
+            load = yield client.cluster_load()
+            if not isinstance(load, DispycosClusterLoad):
+                break
+            info = load.nodes.get(addr, None)
+            if not info or not info[3]:
+                break
+            if servers is None:
+                servers = info[3]
+                for location in servers:
+                    client.close_server(location)
+            yield task.sleep(self.interval)
+        if client._auth:
+            client.close_node(addr)
+        self._nodes.discard(addr)
+        yield self._call(self.decommission, addr)
+        self._draining.discard(addr)
+
+    def _scale_proc(self, client, task=None):
+        task.set_daemon()
+        # nodes started but not (yet) used by client, with time they were started
+        pending = {}
+        while client._auth:
+            yield task.sleep(self.interval)
+            load = yield client.cluster_load()
+            if not isinstance(load, DispycosClusterLoad):
+                continue
+            now = time.time()
+            for addr in list(pending):
+                if addr in load.nodes:
+                    pending.pop(addr)
+                elif (now - pending[addr]) > self.startup_time:
+                    logger.warning('Node %s started by autoscaler is not used', addr)
+                    pending.pop(addr)
+                    self._nodes.discard(addr)
+                    yield self._call(self.decommission, addr)
+                else:
+                    # node may not have been running when scheduler tried it first
+                    client.node_allocate(DispycosNodeAllocate(addr))
+
+            if (load.waiting >= self.queue_depth or
+                (load.waiting and load.wait_time >= self.wait_time)):
+                if pending or len(self._nodes) >= self.max_nodes:
+                    continue
+                if load.nodes:
+                    cpus = max(1, sum(info[0] for info in load.nodes.values()) //
+                               len(load.nodes))
+                else:
+                    cpus = 1
+                count = min(max(1, load.waiting // cpus), self.max_nodes - len(self._nodes))
+                nodes = yield self._call(self.provision, count)
+                for addr in (nodes or []):
+                    addr = pycos.Pycos.host_ipaddr(addr)
+                    if not addr or addr in self._nodes:
+                        continue
+                    logger.debug('Autoscaler started node %s', addr)
+                    self._nodes.add(addr)
+                    pending[addr] = now
+                    client.node_allocate(DispycosNodeAllocate(addr))
+            elif not load.waiting:
+                idle = [addr for addr in self._nodes
+                        if addr not in self._draining and addr in load.nodes and
+                        load.nodes[addr][2] >= self.idle_time]
+                idle.sort(key=lambda addr: load.nodes[addr][2], reverse=True)
+                excess = len(self._nodes) - len(self._draining) - self.min_nodes
+                for addr in idle[:max(excess, 0)]:
+                    logger.debug('Autoscaler closing idle node %s', addr)
+                    SysTask(self._drain, client, addr)
+
+    def _start(self, client):
+        self._task = SysTask(self._scale_proc, client)
+
+    def _stop(self):
+        if self._task:
+            self._task.terminate()
+            self._task = None
+        for addr in list(self._nodes):
+            self._nodes.discard(addr)
+            yield self._call(self.decommission, addr)
+
+
+class DispycosLocalAutoscaler(DispycosAutoscaler):
+    """Autoscaler that starts 'dispycosnode.py' processes on this host, for
+    testing autoscaling with one computer. 'hosts' is list of IP addresses of
+    this host (e.g., '127.0.0.2', '127.0.0.3' etc.); a node is started at each
+    address as needed. 'node_args' is list of additional command line arguments
+    for dispycosnode. Each node uses a directory named after its IP address
+    under 'dest_path', where its output is saved in 'dispycosnode.log'. Rest of
+    the parameters are same as for DispycosAutoscaler.
+    """
+
+    def __init__(self, hosts, node_args=[], dest_path=None, **kwargs):
+        super(DispycosLocalAutoscaler, self).__init__(**kwargs)
+        self.hosts = list(hosts)
+        self.node_args = list(node_args)
+        if not dest_path:
+            dest_path = os.path.join(tempfile.gettempdir(), 'pycos', 'autoscale')
+        self.dest_path = dest_path
+        self._procs = {}
+
+    def provision(self, count):
+        program = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dispycosnode.py')
+        nodes = []
+        for host in self.hosts:
+            if len(nodes) >= count:
+                break
+            if host in self._procs:
+                continue
+            dest_path = os.path.join(self.dest_path, host)
+            if not os.path.isdir(dest_path):
+                os.makedirs(dest_path)
+            log = open(os.path.join(dest_path, 'dispycosnode.log'), 'ab')
+            try:
+                proc = subprocess.Popen([sys.executable, program, '-i', host, '--daemon',
+                                         '--dest_path', dest_path] + self.node_args,
+                                        stdin=subprocess.DEVNULL, stdout=log,
+                                        stderr=subprocess.STDOUT)
+            except Exception:
+                logger.warning('Could not start dispycosnode at %s', host)
+                continue
+            finally:
+                log.close()
+            self._procs[host] = proc
+            nodes.append(host)
+        return nodes
+
+    def decommission(self, node):
+        proc = self._procs.pop(node, None)
+        if not proc:
+            raise StopIteration
+        task = pycos.Pycos.cur_task()
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGINT)
+            for _ in range(100):
+                if proc.poll() is not None:
+                    break
+                yield task.sleep(0.1)
+            else:
+                proc.kill()
+                proc.wait()
+        logger.debug('dispycosnode at %s exited with %s', node, proc.returncode)
+
+
 class Client(object):
     """Packages components to distribute to remote pycos schedulers to create
     (remote) tasks.
@@ -170,7 +777,9 @@ class Client(object):
                  disable_nodes=False, disable_servers=False,
                  pulse_interval=(5*MinPulseInterval), node_allocations=[],
                  ping_interval=None, restart_servers=False,
-                 zombie_period=None, abandon_zombie_nodes=False):
+                 zombie_period=None, abandon_zombie_nodes=False, job_retries=0, retry_delay=5,
+                 straggler_factor=3, node_queue=0, result_cache=None, cpu_share=1,
+                 cpu_quota=0, autoscaler=None):
         """'components' should be a list, each element of which is either a
         module, a (generator or normal) function, path name of a file, a class
         or an object (in which case the code for its class is sent).
@@ -178,6 +787,50 @@ class Client(object):
         'pulse_interval' is interval (number of seconds) used for heart beat
         messages to check if client / scheduler / server is alive. If the other
         side doesn't reply to 5 heart beat messages, it is treated as dead.
+
+        'job_retries' is number of times a remote task that is abandoned (e.g.,
+        because its node / server is closed or became zombie) or failed (with an
+        exception) is resubmitted. The scheduler keeps arguments of jobs (saving
+        large arguments to disk) so they can be resubmitted. The remote task
+        returned by 'rtask' methods continues to represent the job after
+        resubmission, so its 'finish' / 'value' give the result of final
+        attempt. 'retry_delay' is number of seconds to wait before first
+        resubmission; the delay is doubled with each subsequent attempt.
+
+        'straggler_factor' is used for jobs declared idempotent (see
+        DispycosJobOptions): if such a job runs longer than 'straggler_factor'
+        times the average run time of earlier (idempotent) jobs with same
+        generator function and a server is idle (checked every pulse
+        interval), the scheduler runs a duplicate of that job at the idle
+        server (preferably on another node). The result of whichever finishes
+        first is used and the other one is terminated.
+
+        'node_queue' is number of jobs that can be queued at each node when all
+        servers are busy. Such jobs are sent to the node ahead of time and
+        started by the first of its servers that finishes a job, instead of
+        waiting at the scheduler. A server that finishes a job when there are
+        no jobs queued at its node takes a job queued at another node. Jobs
+        that need more than one CPU, memory or disk are not queued. Neither
+        are I/O bound jobs ('io_rtask' methods): they start right away at
+        the server with fewest tasks and are not moved to other servers
+        later.
+
+        'result_cache', if given, must be DispycosResultCache instance. Results
+        of jobs that finish successfully are saved in it and if same job is
+        run again, the result from cache is used without running the job; in
+        that case, 'rtask' methods return a local task that finishes with that
+        result. Jobs with DispycosStream arguments, 'rtask_gang' jobs and jobs
+        with 'cache' job option False are not cached.
+
+        'cpu_share' and 'cpu_quota' are used when scheduler runs more than one
+        client at the same time (see 'max_clients' of scheduler): CPUs of
+        nodes are divided among clients in proportion to their 'cpu_share'.
+        If 'cpu_quota' is positive, client doesn't use more than that many
+        CPUs, even if other CPUs are idle. Since a node is used by one client
+        at a time, CPUs are partitioned at node granularity.
+
+        'autoscaler', if given, must be DispycosAutoscaler instance, which
+        starts and stops nodes as load on cluster changes.
         """
 
         if pulse_interval < MinPulseInterval or pulse_interval > MaxPulseInterval:
@@ -207,6 +860,22 @@ class Client(object):
                 raise Exception('"zombie_period" must be at least 5*pulse_interval')
         elif zombie_period is None:
             zombie_period = 10*pulse_interval
+        if not isinstance(job_retries, int) or job_retries < 0:
+            raise Exception('"job_retries" must be non-negative integer')
+        if not isinstance(retry_delay, (int, float)) or retry_delay < 0:
+            raise Exception('"retry_delay" must be non-negative number')
+        if not isinstance(straggler_factor, (int, float)) or straggler_factor < 1:
+            raise Exception('"straggler_factor" must be at least 1')
+        if not isinstance(node_queue, int) or node_queue < 0:
+            raise Exception('"node_queue" must be non-negative integer')
+        if result_cache and not isinstance(result_cache, DispycosResultCache):
+            raise Exception('"result_cache" must be DispycosResultCache instance')
+        if not isinstance(cpu_share, (int, float)) or cpu_share <= 0:
+            raise Exception('"cpu_share" must be positive number')
+        if not isinstance(cpu_quota, int) or cpu_quota < 0:
+            raise Exception('"cpu_quota" must be non-negative integer')
+        if autoscaler and not isinstance(autoscaler, DispycosAutoscaler):
+            raise Exception('"autoscaler" must be DispycosAutoscaler instance')
 
         if not isinstance(components, list):
             components = [components]
@@ -244,8 +913,20 @@ class Client(object):
         self._disable_servers = bool(disable_servers)
         self._restart_servers = bool(restart_servers)
         self._abandon_zombie = bool(abandon_zombie_nodes)
+        self._job_retries = job_retries
+        self._retry_delay = retry_delay
+        self._straggler_factor = straggler_factor
+        self._node_queue = node_queue
         self.__rtasks = {}
         self.__askew_tasks = {}
+        self.__rtask_streams = {}
+        self._result_cache = result_cache
+        self.__cache_digest = None
+        self.__file_digests = {}
+        self.__rtask_cache_keys = {}
+        self._cpu_share = cpu_share
+        self._cpu_quota = cpu_quota
+        self._autoscaler = autoscaler
 
         depends = set()
         cwd = os.getcwd()
@@ -305,9 +986,9 @@ class Client(object):
 
     def schedule(self, location=None, timeout=None):
         """Schedule client for execution. Must be used with 'yield' as
-        'result = yield client.schedule()'. If scheduler is executing other clients,
-        this will block until scheduler processes them (clients are processed in the
-        order submitted).
+        'result = yield client.schedule()'. If scheduler is executing as many clients
+        as it can at the same time, this will block until scheduler processes them
+        (clients are processed in the order submitted).
         """
 
         if location is None:
@@ -371,6 +1052,8 @@ class Client(object):
             resp = yield task.receive(timeout=timeout)
             if (isinstance(resp, dict) and resp.get('auth') == self._auth and
                resp.get('resp') == 'scheduled'):
+                if self._autoscaler:
+                    self._autoscaler._start(self)
                 raise StopIteration(0)
             else:
                 yield self.close()
@@ -406,6 +1089,21 @@ class Client(object):
 
         raise StopIteration((yield Task(_servers, self).finish()))
 
+    def cluster_load(self):
+        """Get load on nodes used by this client, as DispycosClusterLoad
+        instance (or None if scheduler can't be reached). Must be used with
+        'yield' as 'yield client.cluster_load()'.
+        """
+
+        def _cluster_load(self, task=None):
+            msg = {'req': 'load', 'auth': self._auth, 'reply_task': task}
+            if (yield self.__scheduler.deliver(msg, timeout=MsgTimeout)) == 1:
+                raise StopIteration((yield task.receive(MsgTimeout)))
+            else:
+                raise StopIteration(None)
+
+        raise StopIteration((yield Task(_cluster_load, self).finish()))
+
     def tasks(self, where):
         """Get list of tasks at given node or server for this client.
         Must be used with 'yield' as 'yield client.tasks()'.
@@ -442,6 +1140,8 @@ class Client(object):
             if self._pulse_task:
                 yield self._pulse_task.send('quit')
                 self._pulse_task = None
+            if self._autoscaler:
+                yield self._autoscaler._stop()
             done.set()
 
         if self._auth:
@@ -520,6 +1220,48 @@ class Client(object):
         """
         raise StopIteration((yield self._rtask_req(None, 0, gen, *args, **kwargs)))
 
+    def rtask_gang(self, count, gen, *args, **kwargs):
+        """Must be used with 'yield' as
+
+        'rtasks = yield client.rtask_gang(count, gen, ...)'
+
+        Run 'count' CPU bound tasks with generator function 'gen' and arguments
+        'args' and 'kwargs' at as many servers (possibly at different nodes),
+        all started together when that many servers are available. Once all the
+        tasks are created, each is sent list of all tasks in the group, which
+        the tasks should receive first (e.g., with 'peers = yield
+        task.receive()') so they can communicate with each other. If the request
+        is successful, 'rtasks' will be list of (remote) tasks; otherwise, it
+        will be None.
+        """
+        if not inspect.isgeneratorfunction(gen):
+            logger.warning('rtask_gang second argument must be generator function')
+            raise StopIteration(None)
+        if not isinstance(count, int) or count < 1:
+            logger.warning('invalid number of tasks for rtask_gang: %s', count)
+            raise StopIteration(None)
+
+        name = gen.__name__
+        if name in self.__xfer_funcs:
+            code = None
+        else:
+            code = inspect.getsource(gen).lstrip()
+
+        def _gang_req(task=None):
+            msg = {'req': 'gang', 'auth': self._auth, 'reply_task': task, 'count': count,
+                   'job': _DispycosJob_(name, None, 1, code, args, kwargs)}
+            if (yield self.__scheduler.deliver(msg, timeout=MsgTimeout)) != 1:
+                pycos.logger.warning('scheduling %s timedout', name)
+                raise StopIteration(None)
+
+            rtasks = yield task.receive()
+            if not isinstance(rtasks, list):
+                pycos.logger.warning('running %s tasks of %s failed', count, name)
+                raise StopIteration(None)
+            raise StopIteration([self.__rtask_started(rtask, args, kwargs) for rtask in rtasks])
+
+        raise StopIteration((yield Task(_gang_req).finish()))
+
     run_at = rtask_at
     run = rtask
     run_async_at = io_rtask_at
@@ -722,10 +1464,23 @@ class Client(object):
             code = None
         else:
             code = inspect.getsource(gen).lstrip()
+        if isinstance(kwargs.get('job_options', None), DispycosJobOptions):
+            options = kwargs.pop('job_options')
+        else:
+            options = None
+        if (self._result_cache and (not options or options.cache) and
+            not any(isinstance(arg, DispycosStream) for arg in list(args) + list(kwargs.values()))):
+            cache_key = self.__cache_key(gen, args, kwargs, options)
+            found, value = self._result_cache.lookup(cache_key)
+            if found:
+                raise StopIteration(self.__cached_rtask(value, args, kwargs))
+        else:
+            cache_key = None
 
         def _job_req(task=None):
             msg = {'req': 'job', 'auth': self._auth, 'reply_task': task,
-                   'job': _DispycosJob_(name, where, cpu, code, args, kwargs)}
+                   'job': _DispycosJob_(name, where, cpu, code, args, kwargs,
+                                        retries=self._job_retries, options=options)}
             if (yield self.__scheduler.deliver(msg, timeout=MsgTimeout)) != 1:
                 pycos.logger.warning('scheduling %s timedout', name)
                 raise StopIteration(None)
@@ -739,40 +1494,94 @@ class Client(object):
                     msg = ''
                 pycos.logger.warning('running %s failed%s', name, msg)
                 raise StopIteration(None)
-            rtask = msg
-            setattr(rtask, '_complete', pycos.Event())
-            rtask._complete.clear()
-            if self.__askew_tasks:
-                askew = self.__askew_tasks.pop(rtask, None)
-            else:
-                askew = None
-            if askew:
-                # assert isinstance(askew._value, MonitorStatus)
-                askew._value.info = rtask
-                if askew._value.type == StopIteration:
-                    pycos.logger.debug('rtask %s done', rtask)
-                    rtask._value = askew._value.value
-                elif askew._value.type == Scheduler.TaskTerminated:
-                    pycos.logger.warning('rtask %s terminated', rtask)
-                elif askew._value.type == Scheduler.TaskAbandoned:
-                    pycos.logger.warning('rtask %s abandoned', rtask)
-                else:
-                    rtask._value = askew._value
-                    pycos.logger.warning('rtask %s failed: %s with %s',
-                                         rtask, askew._value.type, askew._value.value)
-                rtask._complete.set()
-                if self.status_task:
-                    self.status_task.send(askew._value)
-            else:
-                setattr(rtask, '_value', None)
-                self.__rtasks[rtask] = rtask
-                if self.status_task:
-                    msg = DispycosTaskInfo(rtask, args, kwargs)
-                    self.status_task.send(DispycosStatus(Scheduler.TaskStarted, msg))
-            raise StopIteration(rtask)
+            raise StopIteration(self.__rtask_started(msg, args, kwargs, cache_key))
 
         raise StopIteration((yield Task(_job_req).finish()))
 
+    def __cache_key(self, gen, args, kwargs, options):
+        # key for result of job in result_cache
+        if not self.__cache_digest:
+            digest = hashlib.sha1(self._code.encode())
+            for name, dst, sep in self._xfer_files:
+                digest.update(_file_digest(name))
+            self.__cache_digest = digest.hexdigest()
+        digest = hashlib.sha1(self.__cache_digest.encode())
+        digest.update(gen.__name__.encode())
+        digest.update(inspect.getsource(gen).encode())
+        digest.update(_canonical_digest(args))
+        digest.update(_canonical_digest(kwargs))
+        if options and options.files:
+            for path in options.files:
+                # contents of files are hashed again only when they change
+                stat_buf = os.stat(path)
+                file_digest = self.__file_digests.get(path, None)
+                if (not file_digest or
+                    file_digest[:2] != (stat_buf.st_mtime, stat_buf.st_size)):
+                    file_digest = (stat_buf.st_mtime, stat_buf.st_size, _file_digest(path))
+                    self.__file_digests[path] = file_digest
+                digest.update(path.encode())
+                digest.update(file_digest[2])
+        return digest.hexdigest()
+
+    def __cached_rtask(self, value, args, kwargs):
+        # local task that finishes with cached result is used for rtask
+        def _cached_result(task=None):
+            raise StopIteration(value)
+            yield
+
+        rtask = Task(_cached_result)
+        pycos.logger.debug('using cached result for %s', rtask)
+        if self.status_task:
+            msg = DispycosTaskInfo(rtask, args, kwargs)
+            self.status_task.send(DispycosStatus(Scheduler.TaskStarted, msg))
+            self.status_task.send(MonitorStatus(rtask, StopIteration, value))
+        return rtask
+
+    def __rtask_started(self, rtask, args, kwargs, cache_key=None):
+        # prepare rtask created for a job to be used by client
+        setattr(rtask, '_complete', pycos.Event())
+        rtask._complete.clear()
+        streams = [arg for arg in args if isinstance(arg, DispycosStream)]
+        streams.extend(arg for arg in kwargs.values() if isinstance(arg, DispycosStream))
+        for stream in streams:
+            stream._start(rtask)
+        if self.__askew_tasks:
+            askew = self.__askew_tasks.pop(rtask, None)
+        else:
+            askew = None
+        if askew:
+            # assert isinstance(askew._value, MonitorStatus)
+            askew._value.info = rtask
+            if askew._value.type == StopIteration:
+                pycos.logger.debug('rtask %s done', rtask)
+                rtask._value = askew._value.value
+                if cache_key:
+                    self._result_cache.store(cache_key, rtask._value)
+            elif askew._value.type == Scheduler.TaskTerminated:
+                pycos.logger.warning('rtask %s terminated', rtask)
+            elif askew._value.type == Scheduler.TaskAbandoned:
+                pycos.logger.warning('rtask %s abandoned', rtask)
+            else:
+                rtask._value = askew._value
+                pycos.logger.warning('rtask %s failed: %s with %s',
+                                     rtask, askew._value.type, askew._value.value)
+            rtask._complete.set()
+            for stream in streams:
+                stream._end(rtask)
+            if self.status_task:
+                self.status_task.send(askew._value)
+        else:
+            setattr(rtask, '_value', None)
+            self.__rtasks[rtask] = rtask
+            if streams:
+                self.__rtask_streams[rtask] = streams
+            if cache_key:
+                self.__rtask_cache_keys[rtask] = cache_key
+            if self.status_task:
+                msg = DispycosTaskInfo(rtask, args, kwargs)
+                self.status_task.send(DispycosStatus(Scheduler.TaskStarted, msg))
+        return rtask
+
     def _pulse_proc(self, task=None):
         """For internal use only.
         """
@@ -815,6 +1624,13 @@ class Client(object):
                             pycos.logger.warning('rtask %s failed: %s with %s',
                                                  rtask, req.type, req.value)
                         rtask._complete.set()
+                        if self.__rtask_streams:
+                            for stream in self.__rtask_streams.pop(rtask, []):
+                                stream._end(rtask)
+                        if self.__rtask_cache_keys:
+                            cache_key = self.__rtask_cache_keys.pop(rtask, None)
+                            if cache_key and req.type == StopIteration:
+                                self._result_cache.store(cache_key, req.value)
                         if self.status_task:
                             self.status_task.send(req)
                     else:
@@ -822,6 +1638,23 @@ class Client(object):
                         setattr(rtask, '_value', req)
                         self.__askew_tasks[rtask] = rtask
 
+                elif req == 'resubmitted':
+                    # scheduler resubmitted job of 'rtask' as 'new_rtask'; client
+                    # continues to use original task for the job
+                    rtask = self.__rtasks.pop(msg.get('rtask', None), None)
+                    new_rtask = msg.get('new_rtask', None)
+                    if not rtask or not isinstance(new_rtask, Task):
+                        logger.warning('Ignoring invalid resubmitted task: %s', type(new_rtask))
+                        continue
+                    pycos.logger.warning('rtask %s resubmitted as %s', rtask, new_rtask)
+                    self.__rtasks[new_rtask] = rtask
+                    if self.__askew_tasks:
+                        askew = self.__askew_tasks.pop(new_rtask, None)
+                        if askew:
+                            task.send({'req': askew._value, 'auth': self._auth})
+                    if self.status_task:
+                        self.status_task.send(DispycosStatus(Scheduler.TaskResubmitted, rtask))
+
                 elif req == 'allocate':
                     reply_task = msg.get('reply_task', None)
                     args = msg.get('args', ())
@@ -857,7 +1690,9 @@ class Client(object):
         state = {}
         for attr in ['_auth', '_code', 'status_task', '_xfer_files', '_node_setup', '_server_setup',
                      '_disable_nodes', '_disable_servers', '_pulse_interval', '_pulse_task',
-                     '_ping_interval', '_restart_servers', '_zombie_period', '_abandon_zombie']:
+                     '_ping_interval', '_restart_servers', '_zombie_period', '_abandon_zombie',
+                     '_job_retries', '_retry_delay', '_straggler_factor', '_node_queue',
+                     '_cpu_share', '_cpu_quota']:
             state[attr] = getattr(self, attr)
         if (isinstance(self._pulse_task, Task) and
             isinstance(getattr(self, '__scheduler', None), Task) and
@@ -888,15 +1723,21 @@ Computation = Client
 class _DispycosJob_(object):
     """Internal use only.
     """
-    __slots__ = ('name', 'where', 'cpu', 'code', 'args', 'kwargs', 'done')
+    __slots__ = ('name', 'where', 'cpu', 'code', 'args', 'kwargs', 'done', 'retries', 'attempt',
+                 'args_file', 'options', 'started')
 
-    def __init__(self, name, where, cpu, code, args=None, kwargs=None):
+    def __init__(self, name, where, cpu, code, args=None, kwargs=None, retries=0, options=None):
         self.name = name
         self.where = where
         self.cpu = cpu
         self.code = code
         self.args = pycos.serialize(args)
         self.kwargs = pycos.serialize(kwargs)
+        self.retries = retries
+        self.attempt = 0
+        self.args_file = None
+        self.options = options
+        self.started = None
 
 
 class Scheduler(object, metaclass=pycos.Singleton):
@@ -924,6 +1765,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
     TaskFinished = 22
     TaskAbandoned = 23
     TaskTerminated = 24
+    TaskResubmitted = 25
     TaskCreated = TaskStarted
 
     ClientScheduled = 31
@@ -950,10 +1792,84 @@ class Scheduler(object, metaclass=pycos.Singleton):
             self.task = None
             self.auth = None
             self.last_pulse = time.time()
+            # how late pulses from node arrived (relative to interval node said
+            # its next pulse is due in); these are used to estimate (phi accrual)
+            # if node is alive
+            self.pulse_delays = collections.deque()
+            self.pulse_sums = [0.0, 0.0]
+            self.pulse_due = None
             self.lock = pycos.Lock()
             self.cpu_avail = pycos.Event()
             self.cpu_avail.clear()
             self.abandon_zombie = False
+            # memory / disk requested by jobs running at node: job -> (memory, disk,
+            # memory and disk available at node when job started), in order started
+            self.reserved = collections.OrderedDict()
+            # jobs sent to node to be started when a server becomes free
+            self.job_queue = []
+            # CPUs at node (before reservation), whether node couldn't be
+            # reserved (e.g., used by another client) and should be tried
+            # again, and whether it is being freed for another client
+            self.total_cpus = 0
+            self.retry = False
+            self.draining = False
+            # when a job last ran at node (for autoscaling)
+            self.busy_time = time.time()
+
+        def reserve(self, job):
+            if job.options and (job.options.memory or job.options.disk):
+                info = self.avail_info
+                self.reserved[job] = (job.options.memory or 0, job.options.disk or 0,
+                                      info.memory if info else None, info.disk if info else None)
+
+        def unused_reservation(self):
+            # memory and disk reserved by running jobs that they haven't used yet; as usage
+            # of each job is not known, drop in availability since oldest of these jobs
+            # started is taken as used by them
+            memory = sum(reserved[0] for reserved in self.reserved.values())
+            disk = sum(reserved[1] for reserved in self.reserved.values())
+            info = self.avail_info
+            if not self.reserved or not info:
+                return (memory, disk)
+            oldest = next(iter(self.reserved.values()))
+            if oldest[2] is not None and info.memory is not None:
+                memory = max(0, memory - max(0, oldest[2] - info.memory))
+            if oldest[3] is not None and info.disk is not None:
+                disk = max(0, disk - max(0, oldest[3] - info.disk))
+            return (memory, disk)
+
+        def pulse(self, now, interval=None):
+            # any message from node shows it is alive, but only its pulses, which
+            # give 'interval' until next pulse, are used to learn their delays
+            delay = now - self.last_pulse
+            self.last_pulse = now
+            if interval is None:
+                return
+            if self.pulse_due is not None:
+                delay -= self.pulse_due
+                if len(self.pulse_delays) >= 100:
+                    old = self.pulse_delays.popleft()
+                    self.pulse_sums[0] -= old
+                    self.pulse_sums[1] -= old * old
+                self.pulse_delays.append(delay)
+                self.pulse_sums[0] += delay
+                self.pulse_sums[1] += delay * delay
+            self.pulse_due = interval
+
+        def phi(self, now):
+            # suspicion level that node is dead, assuming normal distribution of
+            # pulse delays; None if not enough pulses yet
+            n = len(self.pulse_delays)
+            if n < 3:
+                return None
+            mean = self.pulse_sums[0] / n
+            dev = max(math.sqrt(max(self.pulse_sums[1] / n - mean * mean, 0)),
+                      self.pulse_due / 4.0)
+            delay = now - self.last_pulse - self.pulse_due
+            prob = 0.5 * math.erfc((delay - mean) / (dev * math.sqrt(2)))
+            if prob <= 0:
+                return float('inf')
+            return -math.log10(prob)
 
     class _Server(object):
 
@@ -969,23 +1885,33 @@ class Scheduler(object, metaclass=pycos.Singleton):
             self.name = None
             self.pid = None
             self.done = pycos.Event()
+            self.data = set()
 
-        def run(self, job, reply_task, node):
+        def run(self, job, reply_task, node, queued=False):
             def _run(self, task=None):
-                self.task.send({'req': 'task', 'auth': node.auth, 'job': job, 'reply_task': task})
+                if queued:
+                    # job is already at node, which passes it on to this server
+                    node.task.send({'req': 'run_job', 'auth': node.auth, 'id': id(job),
+                                    'server': self.task, 'reply_task': task})
+                else:
+                    self.task.send({'req': 'task', 'auth': node.auth, 'job': job,
+                                    'reply_task': task})
                 rtask = yield task.receive(timeout=MsgTimeout)
-                # currently fault-tolerancy is not supported, so clear job's
-                # args to save space
-                job.args = job.kwargs = None
+                if job.retries or (job.options and job.options.idempotent):
+                    # keep args so job can be resubmitted / duplicated
+                    self.scheduler._retain_job_args(job)
+                else:
+                    # clear job's args to save space
+                    job.args = job.kwargs = None
                 if isinstance(rtask, Task):
-                    # TODO: keep func too for fault-tolerance
+                    job.started = time.time()
                     self.rtasks[rtask] = job
                     if self.askew_results:
                         msg = self.askew_results.pop(rtask, None)
                         if msg:
                             self.scheduler.__status_task.send(msg)
                 else:
-                    if job.cpu:
+                    if job.cpu and not self.scheduler._run_queued(self, node):
                         self.cpu_avail.set()
                         if (self.status == Scheduler.ServerInitialized and
                             node.status == Scheduler.NodeInitialized):
@@ -994,6 +1920,10 @@ class Scheduler(object, metaclass=pycos.Singleton):
                             self.scheduler._cpus_avail.set()
                             node.cpus_used -= 1
                             node.load = float(node.cpus_used) / len(node.servers)
+                    if self.scheduler._reserved_servers:
+                        self.scheduler._release_servers(job, node)
+                    if node.reserved.pop(job, None):
+                        self.scheduler._resources_avail.set()
                 raise StopIteration(rtask)
 
             rtask = yield SysTask(_run, self).finish()
@@ -1005,14 +1935,47 @@ class Scheduler(object, metaclass=pycos.Singleton):
         self._cpu_nodes = set()
         self._cpus_avail = pycos.Event()
         self._cpus_avail.clear()
+        self._resources_avail = pycos.Event()
+        self._resources_avail.clear()
+        self._reserved_servers = {}
         self._remote = False
 
         self.__client = None
         self.__client_auth = None
         self.__cur_node_allocations = []
+        # average run time of jobs (by name), details of speculative jobs and
+        # tasks whose status is not sent to client
+        self.__job_runtimes = {}
+        self.__waiting_jobs = 0
+        # time when each job waiting for a server was submitted
+        self.__job_waits = {}
+        self.__twins = {}
+        self.__spec_origins = {}
+        self.__discard_tasks = set()
+        self.__cpus_pending = 0
+        # schedulers (sharing this scheduler's pycos) for additional clients
+        self.__partitions = []
+        self.__primary = kwargs.pop('primary', None)
+        self.__max_clients = kwargs.pop('max_clients', 1)
+        if self.__primary:
+            primary = self.__primary
+            self._remote = primary._remote
+            self._node_port = primary._node_port
+            self.__pulse_interval = primary.__pulse_interval
+            self.__ping_interval = primary.__ping_interval
+            self.__zombie_period = primary.__zombie_period
+            self.__phi_threshold = primary.__phi_threshold
+            self.pycos = primary.pycos
+            self.__dest_path = primary.__dest_path
+            self.__status_task = SysTask(self.__status_proc)
+            self.__timer_task = SysTask(self.__timer_proc)
+            self.__client_task = SysTask(self.__client_proc)
+            return
+
         self.__pulse_interval = kwargs.pop('pulse_interval', MaxPulseInterval)
         self.__ping_interval = kwargs.pop('ping_interval', 0)
         self.__zombie_period = kwargs.pop('zombie_period', 100 * MaxPulseInterval)
+        self.__phi_threshold = kwargs.pop('phi_threshold', 8)
         if not isinstance(pycos.config.DispycosSchedulerPort, int):
             pycos.config.DispycosSchedulerPort = eval(pycos.config.DispycosSchedulerPort)
         if not isinstance(pycos.config.DispycosNodePort, int):
@@ -1048,8 +2011,11 @@ class Scheduler(object, metaclass=pycos.Singleton):
                       for server in node.servers.values())
         servers = functools.reduce(operator.add, [list(node.servers.keys())
                                                   for node in self._nodes.values()], [])
+        clients = len([sched for sched in self.__partitions if sched.__client])
+        if self.__client:
+            clients += 1
         return {'Client': self.__client._pulse_task.location if self.__client else '',
-                'Pending': pending, 'PendingCPU': pending_cpu,
+                'Clients': clients, 'Pending': pending, 'PendingCPU': pending_cpu,
                 'Nodes': list(self._nodes.keys()), 'Servers': servers
                 }
 
@@ -1057,6 +2023,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
         status = self.status()
         print('')
         print('  Client: %s' % status['Client'])
+        print('  Clients: %s' % status['Clients'])
         print('  Pending: %s' % status['Pending'])
         print('  Pending CPU: %s' % status['PendingCPU'])
         print('  nodes: %s' % len(status['Nodes']))
@@ -1064,8 +2031,9 @@ class Scheduler(object, metaclass=pycos.Singleton):
 
     def __status_proc(self, task=None):
         task.set_daemon()
-        task.register('dispycos_status')
-        self.pycos.peer_status(self.__status_task)
+        if not self.__primary:
+            task.register('dispycos_status')
+        self.pycos.peer_status(task)
         while 1:
             msg = yield task.receive()
             now = time.time()
@@ -1095,7 +2063,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
                     if not server:
                         logger.warning('server "%s" is invalid', rtask.location)
                         continue
-                node.last_pulse = now
+                node.pulse(now)
                 job = server.rtasks.pop(rtask, None)
                 if not job:
                     # Due to 'yield' used to create rtask, scheduler may not have updated
@@ -1104,7 +2072,8 @@ class Scheduler(object, metaclass=pycos.Singleton):
                     server.askew_results[rtask] = msg
                     continue
                 # assert isinstance(job, _DispycosJob_)
-                if job.cpu:
+                self._resources_avail.set()
+                if job.cpu and not self._run_queued(server, node):
                     server.cpu_avail.set()
                     if (server.status == Scheduler.ServerInitialized and
                         node.status == Scheduler.NodeInitialized):
@@ -1113,6 +2082,36 @@ class Scheduler(object, metaclass=pycos.Singleton):
                         self._cpus_avail.set()
                         node.cpus_used -= 1
                         node.load = float(node.cpus_used) / len(node.servers)
+                if self._reserved_servers:
+                    self._release_servers(job, node)
+                node.reserved.pop(job, None)
+                node.busy_time = now
+                if node.draining:
+                    self.__release_drained(node)
+                if msg.type == StopIteration and job.options and job.options.data:
+                    server.data.update(job.options.data)
+                if (msg.type == StopIteration and job.started and job.options and
+                    job.options.idempotent):
+                    # run times are needed only to find stragglers among idempotent jobs
+                    runtime = self.__job_runtimes.setdefault(job.name, [0, 0.0])
+                    runtime[0] += 1
+                    # prefer time measured at server, as it excludes network delays
+                    resources = getattr(msg, 'resources', None)
+                    if resources:
+                        runtime[1] += (resources.wall_time - runtime[1]) / runtime[0]
+                    else:
+                        runtime[1] += ((now - job.started) - runtime[1]) / runtime[0]
+                if self.__twins or self.__spec_origins or self.__discard_tasks:
+                    msg = self.__speculation_status(msg)
+                    if not msg:
+                        self._discard_job_args(job)
+                        continue
+                    rtask = msg.info
+                if (job.retries and self.__client and
+                    msg.type != StopIteration and msg.type != Scheduler.TaskTerminated):
+                    SysTask(self.__resubmit_job, rtask, job, msg)
+                    continue
+                self._discard_job_args(job)
                 if self.__client:
                     self.__client._pulse_task.send({'req': msg, 'auth': self.__client_auth})
 
@@ -1157,8 +2156,17 @@ class Scheduler(object, metaclass=pycos.Singleton):
                         continue
                     node = self._nodes.get(location.addr, None)
                     if node:
-                        node.last_pulse = now
+                        interval = msg.get('interval', None)
+                        if not isinstance(interval, (int, float)) or interval <= 0:
+                            interval = None
+                        node.pulse(now, interval)
+                        busy_time = msg.get('busy_time', 0)
+                        if isinstance(busy_time, (int, float)) and busy_time > node.busy_time:
+                            node.busy_time = busy_time
                         node_status = msg.get('node_status', None)
+                        if isinstance(node_status, DispycosNodeAvailInfo):
+                            node.avail_info = node_status
+                            self._resources_avail.set()
                         if (node_status and self.__client and
                            self.__client.status_task):
                             self.__client.status_task.send(node_status)
@@ -1223,7 +2231,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
                     server.name = msg.get('name')
                     server.status = status
                     server.pid = msg.get('pid', None)
-                    node.last_pulse = now
+                    node.pulse(now)
                     if node.status == Scheduler.NodeInitialized:
                         if not node.servers:
                             if self.__client and self.__client.status_task:
@@ -1238,6 +2246,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
                         self._cpu_nodes.add(node)
                         self._cpus_avail.set()
                         node.cpu_avail.set()
+                        self._resources_avail.set()
                         node.load = float(node.cpus_used) / len(node.servers)
                         if self.__client and self.__client.status_task:
                             self.__client.status_task.send(
@@ -1273,6 +2282,23 @@ class Scheduler(object, metaclass=pycos.Singleton):
                     server.status = status
                     SysTask(self.__close_server, server, server.pid, node)
 
+                elif status == 'data':
+                    location = msg.get('location', None)
+                    if not isinstance(location, Location):
+                        continue
+                    node = self._nodes.get(location.addr, None)
+                    if not node:
+                        node = self._disabled_nodes.get(location.addr, None)
+                    if not node or node.auth != msg.get('auth', None):
+                        continue
+                    server = node.servers.get(location, None)
+                    if not server:
+                        server = node.disabled_servers.get(location, None)
+                        if not server:
+                            continue
+                    server.data.update(msg.get('add', ()))
+                    server.data.difference_update(msg.get('remove', ()))
+
                 elif status == Scheduler.NodeClosed:
                     location = msg.get('location', None)
                     if not isinstance(location, Location):
@@ -1289,12 +2315,48 @@ class Scheduler(object, metaclass=pycos.Singleton):
                         continue
                     node.status = status
                     SysTask(self.__close_node, node)
+                    if (self.__primary or self).__max_clients > 1:
+                        self.__node_released(node.addr)
 
                 else:
                     logger.warning('Ignoring invalid status message: %s', status)
             else:
                 logger.warning('invalid status message ignored')
 
+    def __cpus_reserved(self):
+        nodes = list(self._nodes.values()) + list(self._disabled_nodes.values())
+        return self.__cpus_pending + sum(node.cpus for node in nodes
+                                         if node.status in (Scheduler.NodeDiscovered,
+                                                            Scheduler.NodeInitialized,
+                                                            Scheduler.NodeSuspended))
+
+    def __cpu_quota(self):
+        # maximum number of CPUs current client can use; None if not limited
+        client = self.__client
+        if not client:
+            return 0
+        primary = self.__primary or self
+        quota = None
+        if primary.__max_clients > 1:
+            scheds = [sched for sched in [primary] + primary.__partitions
+                      if sched.__client and sched != self]
+            if scheds:
+                nodes = list(self._nodes.values()) + list(self._disabled_nodes.values())
+                total = sum(node.total_cpus for node in nodes)
+                shares = client._cpu_share + sum(sched.__client._cpu_share for sched in scheds)
+
+                def fair_share(sched):
+                    return int(total * sched.__client._cpu_share / float(shares))
+
+                # CPUs other clients don't (yet) need can be used as well
+                quota = max(fair_share(self), total - sum(max(fair_share(sched),
+                                                               sched.__cpus_reserved())
+                                                           for sched in scheds))
+        if client._cpu_quota:
+            if quota is None or quota > client._cpu_quota:
+                quota = client._cpu_quota
+        return quota
+
     def __node_allocate(self, node, task=None):
         if not task:
             task = pycos.Pycos.cur_task()
@@ -1329,7 +2391,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
             node.status = Scheduler.NodeIgnore
             raise StopIteration
         node.name = node_info.name
-        node.cpus = node_info.cpus
+        node.cpus = node.total_cpus = node_info.cpus
         node.platform = node_info.platform.lower()
         node.avail_info = node_info.avail_info
         if self.__client:
@@ -1357,14 +2419,28 @@ class Scheduler(object, metaclass=pycos.Singleton):
                 node.status = Scheduler.NodeIgnore
                 node.lock.release()
                 raise StopIteration(0)
+            quota = self.__cpu_quota()
+            if quota is not None:
+                cpus = min(cpus, quota - self.__cpus_reserved())
+                if cpus <= 0:
+                    node.retry = True
+                    node.lock.release()
+                    raise StopIteration(0)
 
             node.task.send({'req': 'reserve', 'cpus': cpus, 'status_task': self.__status_task,
                             'reply_task': task, 'client_location': client._pulse_task.location,
                             'abandon_zombie': client._abandon_zombie,
                             'pulse_interval': client._pulse_interval})
+            self.__cpus_pending += cpus
             resp = yield task.receive(timeout=MsgTimeout)
+            self.__cpus_pending -= cpus
             if not isinstance(resp, dict) or resp.get('cpus', 0) <= 0:
                 logger.debug('Reserving %s failed', node.addr)
+                if (self.__primary or self).__max_clients > 1 and isinstance(resp, dict):
+                    # node may be used by another client; try again later
+                    node.retry = True
+                    node.lock.release()
+                    raise StopIteration(-1)
                 self._disabled_nodes.pop(node.addr, None)
                 # node.status = Scheduler.NodeDiscoverd
                 node.lock.release()
@@ -1379,6 +2455,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
             node.status = Scheduler.NodeDiscovered
             node.cpus = resp['cpus']
             node.auth = resp['auth']
+            node.retry = False
             if self.__client and self.__client.status_task:
                 info = DispycosNodeInfo(node.name, node.addr, node.cpus, node.platform,
                                         node.avail_info)
@@ -1526,77 +2603,180 @@ class Scheduler(object, metaclass=pycos.Singleton):
                         logger.warning('Closing zombie client %s', self.__client_auth)
                         SysTask(self.__close_client)
 
-                    if (now - node_check) > self.__zombie_period:
-                        node_check = now
-                        for node in list(self._nodes.values()):
-                            if (node.status != Scheduler.NodeInitialized and
-                                node.status != Scheduler.NodeDiscovered and
-                                node.status != Scheduler.NodeSuspended):
+                    # nodes are zombies if not heard from for 'zombie_period' and
+                    # phi accrual of their pulses exceeds threshold (so nodes whose
+                    # pulses have been late before get up to another 'zombie_period')
+                    for node in list(self._nodes.values()):
+                        if (node.status != Scheduler.NodeInitialized and
+                            node.status != Scheduler.NodeDiscovered and
+                            node.status != Scheduler.NodeSuspended):
+                            continue
+                        silence = now - node.last_pulse
+                        if silence <= self.__zombie_period:
+                            continue
+                        if silence <= (2 * self.__zombie_period):
+                            phi = node.phi(now)
+                            if phi is not None and phi < self.__phi_threshold:
                                 continue
-                            if (now - node.last_pulse) > self.__zombie_period:
-                                logger.warning('dispycos node %s is zombie!', node.addr)
-                                self._nodes.pop(node.addr, None)
-                                self._disabled_nodes[node.addr] = node
-                                # TODO: assuming servers are zombies as well
-                                node.status = Scheduler.NodeAbandoned
-                                SysTask(self.__close_node, node)
+                        logger.warning('dispycos node %s is zombie!', node.addr)
+                        self._nodes.pop(node.addr, None)
+                        self._disabled_nodes[node.addr] = node
+                        # TODO: assuming servers are zombies as well
+                        node.status = Scheduler.NodeAbandoned
+                        SysTask(self.__close_node, node)
 
+                    if (now - node_check) > self.__zombie_period:
+                        node_check = now
                         if not self.__client._disable_nodes:
                             for node in self._disabled_nodes.values():
                                 if node.task and node.status == Scheduler.NodeDiscovered:
                                     SysTask(self.__init_node, node)
 
+                # running jobs are checked for stragglers once every pulse interval
+                # (not when each job finishes), as that scans all running jobs
+                if (self.__job_runtimes and not self.__waiting_jobs and
+                    self._cpus_avail.is_set()):
+                    self.__speculate(now)
+
+                self.__share_nodes()
+
             if self.__ping_interval and ((now - last_ping) > self.__ping_interval):
                 last_ping = now
                 if not self.pycos.ignore_peers:
                     self.pycos.discover_peers(port=self._node_port)
 
+    def __share_nodes(self):
+        # when CPUs reserved exceed quota (e.g., another client is scheduled),
+        # suspend nodes so they can be released to other clients when jobs
+        # running on them are done; when under quota, try to reserve nodes
+        # used by other clients
+        quota = self.__cpu_quota()
+        if quota is None:
+            return
+        reserved = self.__cpus_reserved()
+        if reserved > quota:
+            excess = reserved - quota
+            for node in sorted(self._nodes.values(), key=lambda node: node.load):
+                if node.status != Scheduler.NodeInitialized or (2 * excess) < node.cpus:
+                    continue
+                excess -= node.cpus
+                logger.debug('Releasing node %s of client %s for other clients',
+                             node.addr, self.__client_auth)
+                self._nodes.pop(node.addr, None)
+                self._disabled_nodes[node.addr] = node
+                node.status = Scheduler.NodeSuspended
+                node.draining = True
+                node.cpu_avail.clear()
+                self._cpu_nodes.discard(node)
+                if not self._cpu_nodes:
+                    self._cpus_avail.clear()
+                if self.__client.status_task:
+                    info = DispycosNodeInfo(node.name, node.addr, node.cpus, node.platform,
+                                            node.avail_info)
+                    self.__client.status_task.send(DispycosStatus(node.status, info))
+                self.__release_drained(node)
+        elif reserved < quota:
+            for node in list(self._disabled_nodes.values()):
+                if node.retry and node.status == Scheduler.NodeClosed and node.task:
+                    SysTask(self.__init_node, node)
+
+    def __release_drained(self, node):
+        if (node.status != Scheduler.NodeSuspended or node.job_queue or
+            any(server.rtasks for server in node.servers.values())):
+            return
+        node.draining = False
+        node.retry = True
+        node.task.send({'req': 'release', 'auth': node.auth})
+
+    def __node_released(self, addr):
+        # offer node released by this scheduler's client to other clients,
+        # least served (relative to their shares) first
+        primary = self.__primary or self
+        scheds = [sched for sched in [primary] + primary.__partitions
+                  if sched.__client and sched != self]
+        scheds.sort(key=lambda sched: sched.__cpus_reserved() / float(sched.__client._cpu_share))
+        for sched in scheds:
+            node = sched._disabled_nodes.get(addr, None)
+            if node and node.retry and node.status == Scheduler.NodeClosed and node.task:
+                SysTask(sched.__init_node, node)
+
     def __client_scheduler_proc(self, task=None):
         task.set_daemon()
         while 1:
-            if self.__client:
+            if self.__client and (len(self.__partitions) >= (self.__max_clients - 1) and
+                                  all(sched.__client for sched in self.__partitions)):
                 self.__client_sched_event.clear()
                 yield self.__client_sched_event.wait()
                 continue
 
-            self.__client, reply_task = yield task.receive()
-            self.__pulse_interval = self.__client._pulse_interval
-            self.__ping_interval = self.__client._ping_interval
-            if not self._remote:
-                self.__zombie_period = self.__client._zombie_period
-
-            self.__client_auth = self.__client._auth
-            self.__cur_node_allocations = self.__client._node_allocations
-            self.__client._node_allocations = []
-
-            self._disabled_nodes.update(self._nodes)
-            self._nodes.clear()
-            self._cpu_nodes.clear()
-            self._cpus_avail.clear()
-            for node in self._disabled_nodes.values():
-                node.status = Scheduler.NodeClosed
-                node.disabled_servers.clear()
-                node.servers.clear()
-                node.cpu_avail.clear()
-            logger.debug('Client %s scheduled', self.__client_auth)
-            msg = {'resp': 'scheduled', 'auth': self.__client_auth}
-            if (yield reply_task.deliver(msg, timeout=MsgTimeout)) != 1:
-                logger.warning('client not reachable?')
-                self.__client_auth = self.__client = None
+            client, reply_task = yield task.receive()
+            if not self.__client:
+                yield self.__schedule_client(client, reply_task, task=task)
                 continue
-            for node in self.__cur_node_allocations:
-                if node.ip_rex.find('*') >= 0:
-                    continue
-                loc = Location(node.ip_rex.replace('\\.', '.'),
-                               node.port if node.port else self._node_port)
-                SysTask(self.pycos.peer, loc)
-            for node in self._disabled_nodes.values():
-                SysTask(self.__get_node_info, node)
-            if not self.pycos.ignore_peers:
-                self.pycos.discover_peers(port=self._node_port)
-            self.__timer_task.resume()
+            # run this client at the same time with scheduler of its own
+            for sched in self.__partitions:
+                if not sched.__client:
+                    break
+            else:
+                sched = type.__call__(Scheduler, primary=self)
+                self.__partitions.append(sched)
+            sched.__client = client
+            SysTask(sched.__schedule_client, client, reply_task)
         self.__client_scheduler_task = None
 
+    def __schedule_client(self, client, reply_task, task=None):
+        self.__client = client
+        self.__pulse_interval = self.__client._pulse_interval
+        self.__ping_interval = self.__client._ping_interval
+        if not self._remote:
+            self.__zombie_period = self.__client._zombie_period
+
+        self.__client_auth = self.__client._auth
+        self.__cur_node_allocations = self.__client._node_allocations
+        self.__client._node_allocations = []
+        self.__job_runtimes.clear()
+        self.__waiting_jobs = 0
+        self.__job_waits.clear()
+        self.__twins.clear()
+        self.__spec_origins.clear()
+        self.__discard_tasks.clear()
+        self._reserved_servers.clear()
+
+        self._disabled_nodes.update(self._nodes)
+        self._nodes.clear()
+        self._cpu_nodes.clear()
+        self._cpus_avail.clear()
+        for node in self._disabled_nodes.values():
+            node.status = Scheduler.NodeClosed
+            node.retry = node.draining = False
+            node.disabled_servers.clear()
+            node.servers.clear()
+            node.cpu_avail.clear()
+        logger.debug('Client %s scheduled', self.__client_auth)
+        msg = {'resp': 'scheduled', 'auth': self.__client_auth}
+        if (yield reply_task.deliver(msg, timeout=MsgTimeout)) != 1:
+            logger.warning('client not reachable?')
+            self.__client_auth = self.__client = None
+            (self.__primary or self).__client_sched_event.set()
+            raise StopIteration(-1)
+        for node in self.__cur_node_allocations:
+            if node.ip_rex.find('*') >= 0:
+                continue
+            loc = Location(node.ip_rex.replace('\\.', '.'),
+                           node.port if node.port else self._node_port)
+            SysTask(self.pycos.peer, loc)
+        for node in self._disabled_nodes.values():
+            SysTask(self.__get_node_info, node)
+        if not self.pycos.ignore_peers:
+            self.pycos.discover_peers(port=self._node_port)
+        self.__timer_task.resume()
+        # other clients release nodes in excess of their (now reduced) shares
+        primary = self.__primary or self
+        for sched in [primary] + primary.__partitions:
+            if sched.__client and sched != self:
+                sched.__timer_task.resume()
+        raise StopIteration(0)
+
     def __submit_job(self, msg, task=None):
         task.set_daemon()
         job = msg['job']
@@ -1607,23 +2787,42 @@ class Scheduler(object, metaclass=pycos.Singleton):
             raise StopIteration
         cpu = job.cpu
         where = job.where
+        if cpu and job.options and job.options.cpus > 1:
+            yield self.__submit_cpus_job(job, auth, reply_task, task=task)
+            raise StopIteration
+        if not where and job.options and job.options.data:
+            where = yield self.__data_server(job, auth, task=task)
+            if self.__client_auth != auth:
+                raise StopIteration
         if not where:
+            resources = job.options and (job.options.memory or job.options.disk)
             while 1:
                 node = None
                 load = None
-                if cpu:
-                    for host in self._cpu_nodes:
-                        if host.cpu_avail.is_set() and (load is None or host.load < load):
-                            node = host
-                            load = host.load
-                else:
-                    for host in self._nodes.values():
-                        if load is None or host.load < load:
-                            node = host
-                            load = host.load
+                for host in (self._cpu_nodes if cpu else self._nodes.values()):
+                    if cpu and not host.cpu_avail.is_set():
+                        continue
+                    if resources:
+                        # best fit: node with least resources left
+                        key = self.__resources_left(host, job)
+                        if key is None:
+                            continue
+                        key = (key, host.load)
+                    else:
+                        key = host.load
+                    if load is None or key < load:
+                        node = host
+                        load = key
                 if not node:
-                    self._cpus_avail.clear()
-                    yield self._cpus_avail.wait()
+                    if (cpu and not resources and self.__client and self.__client._node_queue
+                        and self.__queue_job(job, reply_task)):
+                        raise StopIteration(True)
+                    if resources:
+                        self._resources_avail.clear()
+                        yield self._resources_avail.wait()
+                    else:
+                        self._cpus_avail.clear()
+                        yield self._cpus_avail.wait()
                     if self.__client_auth != auth:
                         raise StopIteration
                     continue
@@ -1655,6 +2854,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
                     self._cpu_nodes.discard(node)
                     if not self._cpu_nodes:
                         self._cpus_avail.clear()
+            node.reserve(job)
             yield server.run(job, reply_task, node)
 
         elif isinstance(where, str):
@@ -1691,6 +2891,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
                     self._cpu_nodes.discard(node)
                     if not self._cpu_nodes:
                         self._cpus_avail.clear()
+            node.reserve(job)
             yield server.run(job, reply_task, node)
 
         elif isinstance(where, Location):
@@ -1715,11 +2916,463 @@ class Scheduler(object, metaclass=pycos.Singleton):
                     self._cpu_nodes.discard(node)
                     if not self._cpu_nodes:
                         self._cpus_avail.clear()
+            node.reserve(job)
             yield server.run(job, reply_task, node)
 
         else:
             reply_task.send(None)
 
+    def __queue_job(self, job, reply_task):
+        # queue job at node with fewest queued jobs (relative to its servers)
+        node = None
+        load = None
+        for host in self._nodes.values():
+            if (host.status != Scheduler.NodeInitialized or not host.servers or
+                len(host.job_queue) >= self.__client._node_queue):
+                continue
+            key = (float(len(host.job_queue)) / len(host.servers), host.load)
+            if load is None or key < load:
+                node = host
+                load = key
+        if not node:
+            return False
+        node.job_queue.append((job, reply_task))
+        # job is waiting until a server at node is given 'run_job' for it
+        self.__waiting_jobs += 1
+        self.__job_waits[id(job)] = time.time()
+        # send copy, as arguments of job may be cleared before it is serialized
+        node.task.send({'req': 'queue_job', 'auth': node.auth, 'id': id(job),
+                        'job': copy.copy(job)})
+        return True
+
+    def __requeue_jobs(self, node):
+        # submit jobs queued at node again (e.g., when node is closed)
+        job_queue, node.job_queue = node.job_queue, []
+        for job, reply_task in job_queue:
+            self.__dequeued(job)
+            SysTask(self.__client_job, {'job': job, 'auth': self.__client_auth,
+                                        'reply_task': reply_task})
+
+    def __dequeued(self, job):
+        # job queued at node is no longer waiting
+        if self.__job_waits.pop(id(job), None) is not None:
+            self.__waiting_jobs -= 1
+
+    def __client_job(self, msg, task=None):
+        # keep track of jobs waiting for servers so idle servers are used for
+        # speculative jobs only when there are no other jobs; jobs queued at
+        # nodes are counted as waiting (by '__queue_job') until they run
+        auth = self.__client_auth
+        self.__waiting_jobs += 1
+        self.__job_waits[id(msg)] = time.time()
+        queued = yield self.__submit_job(msg, task=task)
+        if self.__client_auth == auth:
+            self.__waiting_jobs -= 1
+            start = self.__job_waits.pop(id(msg), None)
+            if queued and start and id(msg['job']) in self.__job_waits:
+                self.__job_waits[id(msg['job'])] = start
+
+    def __submit_cpus_job(self, job, auth, reply_task, task=None):
+        # run job that needs more than one CPU at a node
+        cpus = job.options.cpus
+        resources = job.options.memory or job.options.disk
+        where = job.where
+        while 1:
+            main = None
+            if where:
+                if isinstance(where, Location):
+                    node = self._nodes.get(where.addr, None)
+                    if node:
+                        main = node.servers.get(where, None)
+                else:
+                    node = self._nodes.get(where, None)
+                if (not node or len(node.servers) < cpus or
+                    (isinstance(where, Location) and not main)):
+                    reply_task.send(None)
+                    raise StopIteration
+                nodes = [node]
+            else:
+                nodes = self._cpu_nodes
+            best = None
+            for node in nodes:
+                if not node.cpu_avail.is_set():
+                    continue
+                servers = [server for server in node.servers.values()
+                           if server.cpu_avail.is_set() and server != main]
+                if main:
+                    if not main.cpu_avail.is_set():
+                        continue
+                    servers.insert(0, main)
+                else:
+                    servers.sort(key=lambda server: len(server.rtasks))
+                if len(servers) < cpus:
+                    continue
+                if resources:
+                    key = self.__resources_left(node, job)
+                    if key is None:
+                        continue
+                    key = (key, node.load)
+                else:
+                    key = node.load
+                if not best or key < best[0]:
+                    best = (key, node, servers[:cpus])
+            if best:
+                break
+            self._resources_avail.clear()
+            yield self._resources_avail.wait()
+            if self.__client_auth != auth:
+                raise StopIteration
+
+        node, servers = best[1], best[2]
+        for server in servers:
+            server.cpu_avail.clear()
+        node.cpus_used += cpus
+        node.load = float(node.cpus_used) / len(node.servers)
+        if node.cpus_used >= len(node.servers):
+            node.cpu_avail.clear()
+            self._cpu_nodes.discard(node)
+            if not self._cpu_nodes:
+                self._cpus_avail.clear()
+        self._reserved_servers[job] = servers[1:]
+        node.reserve(job)
+        yield servers[0].run(job, reply_task, node)
+
+    def __submit_gang(self, msg, task=None):
+        task.set_daemon()
+        job = msg['job']
+        count = msg.get('count', None)
+        auth = msg.get('auth', None)
+        reply_task = msg.get('reply_task', None)
+        if (not isinstance(job, _DispycosJob_) or not isinstance(reply_task, Task) or
+            not isinstance(count, int) or count < 1):
+            logger.warning('Ignoring invalid client gang request: %s' % type(job))
+            raise StopIteration
+        # wait until 'count' servers are available, preferring servers at same node
+        while 1:
+            servers = [(node, server)
+                       for node in sorted(self._cpu_nodes, key=lambda node: node.load)
+                       for server in node.servers.values() if server.cpu_avail.is_set()]
+            if len(servers) >= count:
+                break
+            self._resources_avail.clear()
+            yield self._resources_avail.wait()
+            if self.__client_auth != auth:
+                raise StopIteration
+
+        for node, server in servers[:count]:
+            server.cpu_avail.clear()
+            node.cpus_used += 1
+            node.load = float(node.cpus_used) / len(node.servers)
+            if node.cpus_used >= len(node.servers):
+                node.cpu_avail.clear()
+                self._cpu_nodes.discard(node)
+                if not self._cpu_nodes:
+                    self._cpus_avail.clear()
+            SysTask(server.run, copy.copy(job), task, node)
+
+        rtasks = []
+        for _ in range(count):
+            rtask = yield task.receive(timeout=2 * MsgTimeout)
+            if isinstance(rtask, Task):
+                rtasks.append(rtask)
+        if len(rtasks) < count:
+            for rtask in rtasks:
+                self.__discard_tasks.add(rtask)
+                rtask.terminate()
+            reply_task.send(None)
+            raise StopIteration
+        # servers of gang must know each other so members can exchange messages
+        locations = set(rtask.location for rtask in rtasks)
+        if len(locations) > 1:
+            for node, server in servers[:count]:
+                server.task.send({'req': 'peers', 'auth': node.auth, 'reply_task': task,
+                                  'peers': [location for location in locations
+                                            if location != server.task.location]})
+            for _ in range(count):
+                if not (yield task.receive(timeout=MsgTimeout)):
+                    logger.warning('Peering servers for gang %s may have failed', job.name)
+                    break
+        for rtask in rtasks:
+            rtask.send(rtasks)
+        reply_task.send(rtasks)
+
+    def __resubmit_job(self, rtask, job, status, task=None):
+        task.set_daemon()
+        auth = self.__client_auth
+        while job.retries > 0:
+            job.retries -= 1
+            job.attempt += 1
+            delay = self.__client._retry_delay * (2 ** (job.attempt - 1))
+            logger.warning('rtask %s %s; resubmitting %s in %s seconds (attempt %s)', rtask,
+                           'abandoned' if status.type == Scheduler.TaskAbandoned else
+                           ('failed: %s' % status.type), job.name, delay, job.attempt)
+            yield task.sleep(delay)
+            if self.__client_auth != auth:
+                raise StopIteration
+            if job.args_file:
+                try:
+                    with open(job.args_file, 'rb') as fd:
+                        job.args, job.kwargs = pycos.deserialize(fd.read())
+                except Exception:
+                    logger.warning('Could not read arguments of job %s from "%s"',
+                                   job.name, job.args_file)
+                    break
+            # resubmit to any available server if requested node / server is gone
+            if isinstance(job.where, Location):
+                node = self._nodes.get(job.where.addr, None)
+                if not node or job.where not in node.servers:
+                    job.where = None
+            elif isinstance(job.where, str):
+                if job.where not in self._nodes:
+                    job.where = None
+            queued = yield self.__submit_job({'job': job, 'auth': auth, 'reply_task': task},
+                                             task=task)
+            if self.__client_auth != auth:
+                raise StopIteration
+            if queued:
+                # job queued at node is started (or dropped when client is closed) later
+                new_rtask = yield task.receive()
+                if self.__client_auth != auth:
+                    raise StopIteration
+            else:
+                new_rtask = yield task.receive(timeout=MsgTimeout)
+            if isinstance(new_rtask, Task):
+                self.__client._pulse_task.send({'req': 'resubmitted', 'rtask': rtask,
+                                                'new_rtask': new_rtask, 'auth': auth})
+                raise StopIteration
+            if isinstance(new_rtask, MonitorStatus):
+                # job's code or arguments are not valid; retrying won't help
+                resources = getattr(status, 'resources', None)
+                status = MonitorStatus(rtask, new_rtask.type, new_rtask.value)
+                if resources:
+                    # resources used by last attempt that ran
+                    status.resources = resources
+                break
+
+        self._discard_job_args(job)
+        if self.__client_auth == auth:
+            self.__client._pulse_task.send({'req': status, 'auth': auth})
+
+    def __speculate(self, now):
+        factor = self.__client._straggler_factor
+        chosen = set()
+        for node in list(self._nodes.values()):
+            for server in node.servers.values():
+                for rtask, job in server.rtasks.items():
+                    if (not job.options or not job.options.idempotent or not job.started or
+                        job.options.cpus > 1 or rtask in self.__twins or
+                        rtask in self.__spec_origins):
+                        continue
+                    runtime = self.__job_runtimes.get(job.name, None)
+                    if not runtime or runtime[0] < 3 or (now - job.started) < factor * runtime[1]:
+                        continue
+                    # find idle server, preferably at another node
+                    idle = None
+                    for host in self._cpu_nodes:
+                        for proc in host.servers.values():
+                            if proc.cpu_avail.is_set() and proc not in chosen:
+                                key = (host == node, host.load)
+                                if not idle or key < idle[0]:
+                                    idle = (key, proc)
+                    if not idle:
+                        return
+                    chosen.add(idle[1])
+                    self.__twins[rtask] = None
+                    SysTask(self.__speculate_job, rtask, job, idle[1])
+
+    def __speculate_job(self, rtask, job, server, task=None):
+        task.set_daemon()
+        auth = self.__client_auth
+        dup = copy.copy(job)
+        if job.args_file:
+            try:
+                with open(job.args_file, 'rb') as fd:
+                    dup.args, dup.kwargs = pycos.deserialize(fd.read())
+            except Exception:
+                logger.warning('Could not read arguments of job %s from "%s"',
+                               job.name, job.args_file)
+                self.__twins.pop(rtask, None)
+                raise StopIteration
+        dup.args_file = None
+        dup.retries = 0
+        dup.started = None
+        dup.where = server.task.location
+        logger.debug('Running duplicate of straggler %s at %s', rtask, dup.where)
+        yield self.__submit_job({'job': dup, 'auth': auth, 'reply_task': task}, task=task)
+        if self.__client_auth != auth:
+            raise StopIteration
+        dup_rtask = yield task.receive(timeout=MsgTimeout)
+        if not isinstance(dup_rtask, Task):
+            if rtask in self.__twins and not self.__twins[rtask]:
+                self.__twins.pop(rtask)
+            raise StopIteration
+        if rtask in self.__twins:
+            self.__twins[rtask] = dup_rtask
+            self.__twins[dup_rtask] = rtask
+            self.__spec_origins[dup_rtask] = rtask
+        else:
+            # original job finished already
+            self.__discard_tasks.add(dup_rtask)
+            dup_rtask.terminate()
+
+    def __speculation_status(self, status):
+        # returns status to use for task in 'status' (which may be original of
+        # speculative task) or None if this status should be ignored
+        rtask = status.info
+        if rtask in self.__discard_tasks:
+            self.__discard_tasks.discard(rtask)
+            return None
+        twin = self.__twins.pop(rtask, None)
+        if twin:
+            self.__twins.pop(twin, None)
+            if status.type != StopIteration:
+                # let the other task finish
+                self.__spec_origins.pop(rtask, None)
+                return None
+            logger.debug('Terminating %s as %s finished first', twin, rtask)
+            self.__spec_origins.pop(twin, None)
+            self.__discard_tasks.add(twin)
+            twin.terminate()
+        origin = self.__spec_origins.pop(rtask, None)
+        if origin:
+            status.info = origin
+        return status
+
+    def _release_servers(self, job, node):
+        """Internal use only.
+        """
+        servers = self._reserved_servers.pop(job, None)
+        if not servers:
+            return
+        servers = [server for server in servers if not self._run_queued(server, node)]
+        if not servers:
+            return
+        for server in servers:
+            server.cpu_avail.set()
+        node.cpus_used -= len(servers)
+        if node.status == Scheduler.NodeInitialized and node.servers:
+            node.load = float(node.cpus_used) / len(node.servers)
+            node.cpu_avail.set()
+            self._cpu_nodes.add(node)
+            self._cpus_avail.set()
+        self._resources_avail.set()
+
+    def _run_queued(self, server, node):
+        """Internal use only.
+        """
+        # start job queued at node at server that finished a job; if there are
+        # no jobs queued at that node, take last job queued at another node
+        if (not self.__client or not self.__client._node_queue or
+            server.status != Scheduler.ServerInitialized or
+            node.status != Scheduler.NodeInitialized):
+            return False
+        if node.job_queue:
+            job, reply_task = node.job_queue.pop(0)
+            self.__dequeued(job)
+            SysTask(server.run, job, reply_task, node, True)
+            return True
+        busy = None
+        for host in self._nodes.values():
+            if host.job_queue and (not busy or len(host.job_queue) > len(busy.job_queue)):
+                busy = host
+        if not busy:
+            return False
+        job, reply_task = busy.job_queue.pop()
+        self.__dequeued(job)
+        busy.task.send({'req': 'dequeue_job', 'auth': busy.auth, 'id': id(job)})
+        SysTask(server.run, job, reply_task, node)
+        return True
+
+    def _retain_job_args(self, job):
+        """Internal use only.
+        """
+        if job.args_file:
+            job.args = job.kwargs = None
+            return
+        if (len(job.args) + len(job.kwargs)) < pycos.config.DispycosJobArgsSpillSize:
+            return
+        # id of job may be reused after job is done, so use unique file
+        args_file = None
+        try:
+            fd, args_file = tempfile.mkstemp(prefix='job_args_',
+                                             dir=os.path.join(self.__dest_path,
+                                                              self.__client_auth))
+            with os.fdopen(fd, 'wb') as fd:
+                fd.write(pycos.serialize((job.args, job.kwargs)))
+        except Exception:
+            logger.warning('Could not save arguments of job %s in "%s"', job.name, args_file)
+            if args_file:
+                try:
+                    os.remove(args_file)
+                except Exception:
+                    pass
+            return
+        job.args_file = args_file
+        job.args = job.kwargs = None
+
+    def _discard_job_args(self, job):
+        """Internal use only.
+        """
+        job.args = job.kwargs = None
+        if job.args_file:
+            try:
+                os.remove(job.args_file)
+            except Exception:
+                pass
+            job.args_file = None
+
+    def __data_server(self, job, auth, task=None):
+        # location of server that holds (most of) data needed by job, waiting
+        # for such server to become available
+        timeout = job.options.locality_delay
+        keys = job.options.data
+        while 1:
+            best = None
+            for node in self._nodes.values():
+                for server in node.servers.values():
+                    if not server.data:
+                        continue
+                    held = len(keys & server.data)
+                    if not held or self.__resources_left(node, job) is None:
+                        continue
+                    avail = ((not job.cpu) or
+                             (server.cpu_avail.is_set() and node.cpu_avail.is_set()))
+                    key = (avail, held, -len(server.rtasks))
+                    if not best or key > best[0]:
+                        best = (key, server, node)
+            if not best:
+                raise StopIteration(None)
+            if best[0][0]:
+                raise StopIteration(best[1].task.location)
+            if timeout <= 0:
+                raise StopIteration(None)
+            start = time.time()
+            if best[1].cpu_avail.is_set():
+                yield best[2].cpu_avail.wait(timeout=timeout)
+            else:
+                yield best[1].cpu_avail.wait(timeout=timeout)
+            if self.__client_auth != auth:
+                raise StopIteration(None)
+            timeout -= time.time() - start
+
+    def __resources_left(self, node, job):
+        # memory and disk left at node after running job (or None if node
+        # doesn't have enough resources)
+        info = node.avail_info
+        if not info:
+            return (0, 0)
+        memory_reserved, disk_reserved = node.unused_reservation()
+        memory = disk = 0
+        if job.options.memory and info.memory is not None:
+            memory = info.memory - memory_reserved - job.options.memory
+            if memory < 0:
+                return None
+        if job.options.disk and info.disk is not None:
+            disk = info.disk - disk_reserved - job.options.disk
+            if disk < 0:
+                return None
+        return (memory, disk)
+
     def __client_proc(self, task=None):
         task.set_daemon()
         clients = {}
@@ -1734,10 +3387,19 @@ class Scheduler(object, metaclass=pycos.Singleton):
                 if req == 'schedule' or req == 'await':
                     pass
                 else:
+                    # request for client served by another scheduler
+                    for sched in self.__partitions:
+                        if auth and sched.__client_auth == auth:
+                            sched.__client_task.send(msg)
+                            break
                     continue
 
             if req == 'job':
-                SysTask(self.__submit_job, msg)
+                SysTask(self.__client_job, msg)
+                continue
+
+            if req == 'gang':
+                SysTask(self.__submit_gang, msg)
                 continue
 
             reply_task = msg.get('reply_task', None)
@@ -1901,7 +3563,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
                     node.task.send(req)
 
             elif req == 'node_allocate':
-                node = req.get('node', None)
+                node = msg.get('node', None)
                 if not isinstance(node, DispycosNodeAllocate):
                     continue
                 self.__cur_node_allocations = [node] + [na for na in self.__cur_node_allocations
@@ -1927,6 +3589,24 @@ class Scheduler(object, metaclass=pycos.Singleton):
                                ]
                     reply_task.send(servers)
 
+            elif req == 'load':
+                if reply_task:
+                    now = time.time()
+                    nodes = {}
+                    for node in self._nodes.values():
+                        if any(server.rtasks for server in node.servers.values()):
+                            idle = 0
+                        else:
+                            idle = now - node.busy_time
+                        nodes[node.addr] = (node.cpus, node.cpus_used, idle,
+                                            [server.task.location
+                                             for server in node.servers.values()])
+                    if self.__job_waits:
+                        wait_time = now - min(self.__job_waits.values())
+                    else:
+                        wait_time = 0
+                    reply_task.send(DispycosClusterLoad(self.__waiting_jobs, wait_time, nodes))
+
             elif req == 'tasks':
                 servers = []
                 tasks = []
@@ -2061,6 +3741,8 @@ class Scheduler(object, metaclass=pycos.Singleton):
         self._nodes.pop(node.addr, None)
         self._disabled_nodes[node.addr] = node
         client = self.__client
+        if node.job_queue:
+            self.__requeue_jobs(node)
         if node.status == Scheduler.NodeAbandoned:
             # TODO: safe to assume servers are disconnected as well?
             for server in node.disabled_servers.values():
@@ -2113,6 +3795,8 @@ class Scheduler(object, metaclass=pycos.Singleton):
                     self._cpu_nodes.discard(node)
                     if not self._cpu_nodes:
                         self._cpus_avail.clear()
+                if node.job_queue:
+                    self.__requeue_jobs(node)
 
         client = self.__client
         if server.status < Scheduler.ServerClosed:
@@ -2141,9 +3825,23 @@ class Scheduler(object, metaclass=pycos.Singleton):
         if server.rtasks:
             logger.warning('%s tasks abandoned at %s', len(server.rtasks), server_task.location)
             for rtask, job in server.rtasks.items():
+                if self._reserved_servers:
+                    self._release_servers(job, node)
+                if node.reserved.pop(job, None):
+                    self._resources_avail.set()
                 if client:
                     status = MonitorStatus(rtask, Scheduler.TaskAbandoned)
+                    if self.__twins or self.__spec_origins or self.__discard_tasks:
+                        status = self.__speculation_status(status)
+                        if not status:
+                            self._discard_job_args(job)
+                            continue
+                        rtask = status.info
+                    if job.retries:
+                        SysTask(self.__resubmit_job, rtask, job, status)
+                        continue
                     client._pulse_task.send({'req': status, 'auth': self.__client_auth})
+                self._discard_job_args(job)
             server.rtasks.clear()
 
         server.xfer_files = []
@@ -2161,6 +3859,11 @@ class Scheduler(object, metaclass=pycos.Singleton):
 
     def __close_client(self, reply_task=None, await_io=False, terminate=False, task=None):
         if self.__client:
+            for node in self._nodes.values():
+                for job, job_reply in node.job_queue:
+                    self.__dequeued(job)
+                    job_reply.send(None)
+                node.job_queue = []
             close_tasks = [SysTask(self.__close_node, node, await_io=await_io,
                                    terminate=terminate) for node in self._nodes.values()]
             close_tasks.extend([SysTask(self.__close_node, node, await_io=await_io,
@@ -2175,7 +3878,7 @@ class Scheduler(object, metaclass=pycos.Singleton):
         if self.__client and self.__client.status_task:
             self.__client.status_task.send(DispycosStatus(Scheduler.ClientClosed, id(self.__client)))
         self.__client_auth = self.__client = None
-        self.__client_sched_event.set()
+        (self.__primary or self).__client_sched_event.set()
         if reply_task:
             reply_task.send('closed')
         raise StopIteration(0)
@@ -2186,6 +3889,9 @@ class Scheduler(object, metaclass=pycos.Singleton):
         Must be called with 'yield' as 'yield scheduler.close()' or as
         task.
         """
+        for sched in self.__partitions:
+            if sched.__client:
+                yield sched.__close_client(task=task)
         yield self.__close_client(task=task)
         raise StopIteration(0)
 
@@ -2198,7 +3904,6 @@ if __name__ == '__main__':
     """
 
     import argparse
-    import signal
     try:
         import readline
     except ImportError:
@@ -2247,6 +3952,12 @@ if __name__ == '__main__':
     parser.add_argument('--zombie_period', dest='zombie_period', type=int,
                         default=(100 * MaxPulseInterval),
                         help='maximum time in seconds client is idle')
+    parser.add_argument('--phi_threshold', dest='phi_threshold', type=float, default=8,
+                        help='nodes not heard from for zombie_period are treated as zombies '
+                        'when suspicion level (phi accrual) of their pulses exceeds this threshold')
+    parser.add_argument('--max_clients', dest='max_clients', type=int, default=1,
+                        help='maximum number of clients to run at the same time; nodes are '
+                        'divided among clients in proportion to their CPU shares')
     parser.add_argument('-d', '--debug', action='store_true', dest='loglevel', default=False,
                         help='if given, debug messages are printed')
     parser.add_argument('--clean', action='store_true', dest='clean', default=False,
@@ -2258,6 +3969,8 @@ if __name__ == '__main__':
 
     if config['zombie_period'] and config['zombie_period'] < MaxPulseInterval:
         raise Exception('zombie_period must be >= %s' % MaxPulseInterval)
+    if config['max_clients'] < 1:
+        raise Exception('max_clients must be >= 1')
 
     if not config['name']:
         config['name'] = 'dispycos_scheduler'